@@ -0,0 +1,255 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .features import FEATURES, build_features_long
+from .loader import PriceSource
+from .model_backends import MODEL_BACKEND, make_model
+from .runtime_metrics import stage
+from .train import RETRAIN_MAX_WORKERS
+
+# processos para os folds (cada um treina um modelo); 1 = no próprio processo
+BACKTEST_MAX_WORKERS = int(os.getenv("BACKTEST_MAX_WORKERS", str(RETRAIN_MAX_WORKERS)))
+# candles processados por vez ao montar as features (memória do processo pai)
+BACKTEST_CHUNK_ROWS = int(os.getenv("BACKTEST_CHUNK_ROWS", "200000"))
+# teto da janela de treino no modo expanding: a memória de cada fold não cresce com o histórico
+BACKTEST_MAX_TRAIN_ROWS = int(os.getenv("BACKTEST_MAX_TRAIN_ROWS", "500000"))
+# onde fica o arquivo de features do backtest (apagado no fim); padrão: diretório temporário do sistema
+BACKTEST_TMP_DIR = os.getenv("BACKTEST_TMP_DIR") or None
+
+# candles do lote anterior repetidos no cálculo do seguinte: cobre as janelas (até 16 candles) e deixa o
+# peso do valor inicial das EMAs abaixo da precisão do float64 (0.875^512 ~ 1e-30), ou seja, as features
+# saem iguais às de build_features sobre o histórico inteiro
+FEATURE_WARMUP = 512
+MODES = ("rolling", "expanding")
+
+FEATURE_SCHEMA = pa.schema(
+    [("ts", pa.timestamp("us", tz="UTC"))] + [(f, pa.float64()) for f in FEATURES] + [("y", pa.float64())]
+)
+
+def _iter_price_chunks(source: PriceSource, symbol: str, since: Optional[datetime],
+                       chunk_rows: int) -> Iterator[pa.Table]:
+    pending: list[pa.RecordBatch] = []
+    n = 0
+    for batch in source.iter_batches(symbol, ("ts", "close"), since=since):
+        pending.append(batch)
+        n += batch.num_rows
+        if n >= chunk_rows:
+            yield pa.Table.from_batches(pending)
+            pending, n = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+def build_feature_file(source: PriceSource, symbol: str, path: str, since: Optional[datetime] = None,
+                       chunk_rows: int = BACKTEST_CHUNK_ROWS) -> dict:
+    # features (com y) de todo o histórico num arquivo Arrow IPC, calculadas uma vez e lidas pelos folds
+    # via memory map; só um lote de candles fica em memória por vez
+    carry = pd.DataFrame({"ts": pd.Series([], dtype="datetime64[us, UTC]"), "close": pd.Series([], dtype=float)})
+    last_ts = None
+    n_rows = 0
+    first_ts = None
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, FEATURE_SCHEMA) as writer:
+        for chunk in _iter_price_chunks(source, symbol, since, chunk_rows):
+            prices = pd.concat([carry, chunk.to_pandas()], ignore_index=True)
+            with stage("feature_build"):
+                feats = build_features_long(prices.assign(symbol=0))
+            if last_ts is not None:
+                feats = feats[feats["ts"] > last_ts]
+            if len(feats):
+                writer.write_batch(pa.RecordBatch.from_pandas(feats[["ts", *FEATURES, "y"]], schema=FEATURE_SCHEMA,
+                                                              preserve_index=False))
+                first_ts = first_ts if first_ts is not None else feats["ts"].iloc[0]
+                last_ts = feats["ts"].iloc[-1]
+                n_rows += len(feats)
+            carry = prices.iloc[-FEATURE_WARMUP:].reset_index(drop=True)
+    return {
+        "rows": n_rows,
+        "first_ts": first_ts.isoformat() if first_ts is not None else None,
+        "last_ts": last_ts.isoformat() if last_ts is not None else None,
+    }
+
+def make_folds(n_rows: int, train_size: int, test_size: int, step: Optional[int] = None,
+               mode: str = "rolling", max_train_rows: int = BACKTEST_MAX_TRAIN_ROWS) -> list[dict]:
+    # walk-forward por linhas de features: treino sempre antes do teste; rolling = janela fixa,
+    # expanding = desde o início (até max_train_rows)
+    if mode not in MODES:
+        raise ValueError(f"Modo de backtest desconhecido: {mode!r} (use {', '.join(MODES)}).")
+    if train_size + test_size > n_rows:
+        raise ValueError(f"Histórico curto para o backtest: {n_rows} linhas de features, "
+                         f"{train_size + test_size} necessárias (treino + teste).")
+    step = step or test_size
+    folds = []
+    test_start = train_size
+    while test_start + test_size <= n_rows:
+        if mode == "rolling":
+            train_start = test_start - train_size
+        else:
+            train_start = max(0, test_start - max_train_rows)
+        folds.append({"fold": len(folds), "train": (train_start, test_start),
+                      "test": (test_start, test_start + test_size)})
+        test_start += step
+    return folds
+
+def _columns(table: pa.Table) -> tuple[pd.DataFrame, np.ndarray]:
+    X = pd.DataFrame({f: table.column(f).to_numpy() for f in FEATURES})
+    return X, table.column("y").to_numpy()
+
+def _metrics(y: np.ndarray, pred: np.ndarray, last_close: np.ndarray) -> dict:
+    err = pred - y
+    naive = last_close - y
+    moved = y != last_close
+    mae, naive_mae = float(np.abs(err).mean()), float(np.abs(naive).mean())
+    return {
+        "mae": mae,
+        "rmse": float(np.sqrt((err ** 2).mean())),
+        # baseline ingênuo: próximo fechamento = fechamento atual
+        "naive_mae": naive_mae,
+        "naive_rmse": float(np.sqrt((naive ** 2).mean())),
+        "skill": 1.0 - mae / naive_mae if naive_mae else None,
+        # acerto do sentido do movimento (candles sem variação ficam de fora)
+        "direction_acc": float((np.sign(pred - last_close) == np.sign(y - last_close))[moved].mean())
+        if moved.any() else None,
+    }
+
+def run_fold(path: str, fold: dict, backend: str = MODEL_BACKEND) -> dict:
+    # roda no processo filho: o arquivo é mapeado em memória e só as linhas do fold são copiadas
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    (a, b), (c, d) = fold["train"], fold["test"]
+    train, test = table.slice(a, b - a), table.slice(c, d - c)
+    X_train, y_train = _columns(train)
+    X_test, y_test = _columns(test)
+    model = make_model(backend)
+    t0 = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - t0
+    pred = np.asarray(model.predict(X_test), dtype=np.float64)
+    return {
+        "fold": fold["fold"],
+        "train_start": train.column("ts")[0].as_py().isoformat(),
+        "train_end": train.column("ts")[-1].as_py().isoformat(),
+        "test_start": test.column("ts")[0].as_py().isoformat(),
+        "test_end": test.column("ts")[-1].as_py().isoformat(),
+        "n_train": b - a,
+        "n_test": d - c,
+        "fit_seconds": fit_seconds,
+        **_metrics(y_test, pred, X_test["close"].to_numpy()),
+    }
+
+def summarize(folds: list[dict]) -> dict:
+    n = np.array([f["n_test"] for f in folds], dtype=float)
+    mae = np.array([f["mae"] for f in folds])
+    rmse = np.array([f["rmse"] for f in folds])
+    naive_mae = np.array([f["naive_mae"] for f in folds])
+    naive_rmse = np.array([f["naive_rmse"] for f in folds])
+    # agregado sobre todas as previsões (folds ponderados pelo tamanho do teste)
+    pooled_mae = float((mae * n).sum() / n.sum())
+    pooled_naive_mae = float((naive_mae * n).sum() / n.sum())
+    return {
+        "folds": len(folds),
+        "mae": pooled_mae,
+        "rmse": float(np.sqrt((rmse ** 2 * n).sum() / n.sum())),
+        "naive_mae": pooled_naive_mae,
+        "naive_rmse": float(np.sqrt((naive_rmse ** 2 * n).sum() / n.sum())),
+        "skill": 1.0 - pooled_mae / pooled_naive_mae if pooled_naive_mae else None,
+        "mae_std": float(mae.std()),
+        "mae_worst": float(mae.max()),
+        # fração dos folds (regimes) em que o modelo erra menos que repetir o último fechamento
+        "beats_naive": float((mae < naive_mae).mean()),
+    }
+
+def run_backtest(
+    source: PriceSource,
+    symbol: str = "BTCUSDT",
+    train_size: int = 20_000,
+    test_size: int = 5_000,
+    step: Optional[int] = None,
+    mode: str = "rolling",
+    backend: Optional[str] = None,
+    max_workers: int = BACKTEST_MAX_WORKERS,
+    since: Optional[datetime] = None,
+    chunk_rows: int = BACKTEST_CHUNK_ROWS,
+    max_train_rows: int = BACKTEST_MAX_TRAIN_ROWS,
+) -> dict:
+    backend = backend or MODEL_BACKEND
+    make_model(backend)  # backend inválido falha antes de ler o histórico
+    with tempfile.TemporaryDirectory(prefix="backtest-", dir=BACKTEST_TMP_DIR) as tmp:
+        path = os.path.join(tmp, "features.arrow")
+        t0 = time.perf_counter()
+        info = build_feature_file(source, symbol, path, since=since, chunk_rows=chunk_rows)
+        info["build_seconds"] = time.perf_counter() - t0
+        if info["rows"] == 0:
+            raise RuntimeError("Sem dados para o backtest. Rode a ingestão (ou exporte para o lake) primeiro.")
+        folds = make_folds(info["rows"], train_size, test_size, step, mode, max_train_rows)
+
+        workers = max(1, min(max_workers, len(folds)))
+        t0 = time.perf_counter()
+        if workers == 1:
+            results = [run_fold(path, f, backend) for f in folds]
+        else:
+            # spawn, como no retreino: o processo da API tem threads e fork não é seguro
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                results = list(pool.map(run_fold, [path] * len(folds), folds, [backend] * len(folds)))
+        folds_seconds = time.perf_counter() - t0
+
+    return {
+        "symbol": symbol,
+        "backend": backend,
+        "mode": mode,
+        "train_size": train_size,
+        "test_size": test_size,
+        "step": step or test_size,
+        "workers": workers,
+        "features": info,
+        "folds_seconds": folds_seconds,
+        "summary": summarize(results),
+        "folds": results,
+    }
+
+def main() -> None:
+    # python -m api.backtest --symbol BTCUSDT --source parquet --train-size 50000 --test-size 10000 --mode expanding
+    import argparse
+    import json
+
+    from .model_backends import BACKENDS
+    from .train import get_price_source
+
+    ap = argparse.ArgumentParser(description="Backtest walk-forward do modelo de previsão.")
+    ap.add_argument("--symbol", default="BTCUSDT")
+    ap.add_argument("--source", default="parquet", choices=["parquet", "postgres"])
+    ap.add_argument("--since", type=datetime.fromisoformat, default=None)
+    ap.add_argument("--train-size", type=int, default=20_000)
+    ap.add_argument("--test-size", type=int, default=5_000)
+    ap.add_argument("--step", type=int, default=None)
+    ap.add_argument("--mode", default="rolling", choices=list(MODES))
+    ap.add_argument("--backend", default=MODEL_BACKEND, choices=list(BACKENDS))
+    ap.add_argument("--workers", type=int, default=BACKTEST_MAX_WORKERS)
+    ap.add_argument("--out", default=None, help="grava o resultado completo (JSON)")
+    args = ap.parse_args()
+
+    db = None
+    if args.source == "postgres":
+        from .db import SessionLocal
+        db = SessionLocal()
+    try:
+        out = run_backtest(get_price_source(args.source, db), args.symbol, args.train_size, args.test_size,
+                           args.step, args.mode, args.backend, args.workers, since=args.since)
+    finally:
+        if db is not None:
+            db.close()
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(out, f, indent=2)
+    print(json.dumps({k: v for k, v in out.items() if k != "folds"}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,126 @@
 from __future__ import annotations
 import os
-from datetime import datetime
-from typing import Generator
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import AsyncGenerator, Generator, Iterable, Optional
 
 from sqlalchemy import (
-    create_engine, String, DateTime, Numeric, BigInteger,
-    UniqueConstraint, Float
+    create_engine, make_url, text, String, DateTime, Double, BigInteger,
+    PrimaryKeyConstraint, UniqueConstraint, Index, Float, Integer
 )
-from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, Session, DeclarativeBase, Mapped, mapped_column
 
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "postgresql+psycopg2://postgres:postgres@db:5432/postgres",
 )
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# pool síncrono: handlers no threadpool, jobs em segundo plano e scheduler
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# pool assíncrono: leituras quentes (/prices/latest, /metrics) direto no event loop
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "10"))
+
+def _async_url(url: str) -> str:
+    # mesmo banco, driver assíncrono (asyncpg no Postgres, aiosqlite no SQLite)
+    u = make_url(url)
+    if u.get_backend_name() == "postgresql":
+        u = u.set(drivername="postgresql+asyncpg")
+    elif u.get_backend_name() == "sqlite":
+        u = u.set(drivername="sqlite+aiosqlite")
+    return u.render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+def _pool_options(url: str, size: int, overflow: int) -> dict:
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {"pool_size": size, "max_overflow": overflow, "pool_timeout": DB_POOL_TIMEOUT}
+
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, **_pool_options(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW))
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
+# criado na primeira leitura assíncrona (o driver só é importado quando usado)
+_ASYNC_ENGINE: Optional[AsyncEngine] = None
+_ASYNC_SESSION: Optional[async_sessionmaker] = None
+
+# SQLite só autoincrementa INTEGER PRIMARY KEY (usado em testes/benchmarks offline)
+BigIntPK = BigInteger().with_variant(Integer, "sqlite")
+
 class Base(DeclarativeBase):
     pass 
 
+# no Postgres a tabela é particionada por mês em ts (partições criadas sob demanda em ensure_partitions);
+# a chave (symbol, ts) inclui a coluna de partição, como o Postgres exige
 class Price(Base):
     __tablename__ = "prices"
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
     symbol: Mapped[str] = mapped_column(String(32), nullable=False)
     ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
 
-    open: Mapped[float] = mapped_column(Numeric(18, 8), nullable=True)
-    high: Mapped[float] = mapped_column(Numeric(18, 8), nullable=True)
-    low: Mapped[float] = mapped_column(Numeric(18, 8), nullable=True)
-    close: Mapped[float] = mapped_column(Numeric(18, 8), nullable=False)
-    volume: Mapped[float] = mapped_column(Numeric(18, 8), nullable=True)
+    open: Mapped[float] = mapped_column(Double, nullable=True)
+    high: Mapped[float] = mapped_column(Double, nullable=True)
+    low: Mapped[float] = mapped_column(Double, nullable=True)
+    close: Mapped[float] = mapped_column(Double, nullable=False)
+    volume: Mapped[float] = mapped_column(Double, nullable=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("symbol", "ts", name="uq_prices_symbol_ts"),
+        # "últimos N fechamentos do símbolo" sai só do índice (index-only scan)
+        Index("ix_prices_symbol_ts_close", "symbol", ts.desc(), postgresql_include=["close"]),
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+
+# agregados OHLCV de prices em resoluções maiores (5m/1h/1d...), mantidos a cada gravação;
+# ts segue a convenção de prices: fechamento do último candle do intervalo
+class PriceRollup(Base):
+    __tablename__ = "price_rollups"
+
+    symbol: Mapped[str] = mapped_column(String(32), nullable=False)
+    resolution: Mapped[str] = mapped_column(String(8), nullable=False)
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    open: Mapped[float] = mapped_column(Double, nullable=True)
+    high: Mapped[float] = mapped_column(Double, nullable=True)
+    low: Mapped[float] = mapped_column(Double, nullable=True)
+    close: Mapped[float] = mapped_column(Double, nullable=False)
+    volume: Mapped[float] = mapped_column(Double, nullable=True)
+    # candles de origem no intervalo (intervalo incompleto enquanto < resolução / base)
+    candles: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("symbol", "resolution", "ts", name="uq_price_rollups_symbol_res_ts"),
+    )
 
-    __table_args__ = (UniqueConstraint("symbol", "ts", name="uq_prices_symbol_ts"),)
+# previsões servidas, gravadas em lote por api/predlog.py (uma por símbolo/intervalo/versão/candle de origem);
+# só recebem inserts, e actual/resolved_at são preenchidos uma única vez, quando o candle previsto (target_ts) é gravado
+class Prediction(Base):
+    __tablename__ = "prediction_log"
+
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
+    symbol: Mapped[str] = mapped_column(String(32), nullable=False)
+    interval: Mapped[str] = mapped_column(String(8), nullable=False)
+    model_version: Mapped[str] = mapped_column(String(64), nullable=False)
+    base_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    target_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    predicted: Mapped[float] = mapped_column(Double, nullable=False)
+    last_close: Mapped[float] = mapped_column(Double, nullable=False)
+    predicted_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    actual: Mapped[float] = mapped_column(Double, nullable=True)
+    resolved_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("symbol", "interval", "model_version", "base_ts", name="uq_prediction_log_key"),
+        Index("ix_prediction_log_symbol_target", "symbol", "target_ts"),
+    )
 
 class ModelMetric(Base):
     __tablename__ = "model_metrics"
 
-    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(BigIntPK, primary_key=True, autoincrement=True)
     model_version: Mapped[str] = mapped_column(String(64), nullable=False)
     train_end_ts: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
     mae: Mapped[float] = mapped_column(Float, nullable=True)
@@ -52,5 +134,63 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+def get_async_engine() -> AsyncEngine:
+    global _ASYNC_ENGINE, _ASYNC_SESSION
+    if _ASYNC_ENGINE is None:
+        _ASYNC_ENGINE = create_async_engine(
+            ASYNC_DATABASE_URL, pool_pre_ping=True,
+            **_pool_options(ASYNC_DATABASE_URL, ASYNC_DB_POOL_SIZE, ASYNC_DB_MAX_OVERFLOW),
+        )
+        _ASYNC_SESSION = async_sessionmaker(_ASYNC_ENGINE, expire_on_commit=False)
+    return _ASYNC_ENGINE
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    get_async_engine()
+    async with _ASYNC_SESSION() as db:
+        yield db
+
+async def dispose_async_engine() -> None:
+    global _ASYNC_ENGINE, _ASYNC_SESSION
+    if _ASYNC_ENGINE is not None:
+        await _ASYNC_ENGINE.dispose()
+        _ASYNC_ENGINE, _ASYNC_SESSION = None, None
+
+def _month_start(ts: datetime) -> datetime:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    ts = ts.astimezone(timezone.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+def _next_month(ts: datetime) -> datetime:
+    return (ts + timedelta(days=32)).replace(day=1)
+
+_PARTITIONS: set[str] = set()
+_PARTITIONS_LOCK = threading.Lock()
+
+def ensure_partitions(db: Session, timestamps: Iterable[datetime]) -> list[str]:
+    # cria (se faltar) a partição mensal de cada ts e faz commit; em outros bancos não faz nada.
+    # Roda na sessão do chamador: numa conexão à parte, o DDL esperaria o lock que a própria sessão segura
+    if db.get_bind().dialect.name != "postgresql":
+        return []
+    months = {_month_start(ts) for ts in timestamps}
+    with _PARTITIONS_LOCK:
+        missing = sorted(m for m in months if f"prices_{m:%Y%m}" not in _PARTITIONS)
+        if not missing:
+            return []
+        created = []
+        for start in missing:
+            name = f"prices_{start:%Y%m}"
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF prices "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_month(start).isoformat()}')"
+            ))
+            created.append(name)
+        db.commit()
+        _PARTITIONS.update(created)
+    return created
+
 def init_db() -> None:
     Base.metadata.create_all(bind=engine)
+    now = datetime.now(timezone.utc)
+    with SessionLocal() as db:
+        ensure_partitions(db, [now, _next_month(_month_start(now))])
\ No newline at end of file
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import math
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional, Iterable
+
+from .features import FEATURES
+
+# ret_15 precisa do fechamento de 15 candles atrás, logo 16 valores na janela
+HISTORY = 16
+
+def _alpha(span: int) -> float:
+    return 2.0 / (span + 1.0)
+
+# estado O(janela) por símbolo; vector() reproduz a linha de build_features do último candle
+class IncrementalFeatures:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.closes: deque[float] = deque(maxlen=HISTORY)
+        self.ema_5: Optional[float] = None
+        self.ema_15: Optional[float] = None
+        self.last_ts: Optional[datetime] = None
+        self.count = 0
+        # candles anteriores a last_ts recusados: o estado não os incorpora e diverge de build_features
+        # até ser reconstruído (quem chama descarta o estado; ver stream.push_feature_states)
+        self.out_of_order = 0
+
+    def update(self, ts: datetime, close: float) -> bool:
+        if self.last_ts is not None and ts <= self.last_ts:
+            # o mesmo candle de novo é só repetição; um anterior é um buraco preenchido depois
+            if ts < self.last_ts:
+                self.out_of_order += 1
+            return False
+        close = float(close)
+        self.closes.append(close)
+        if self.ema_5 is None:
+            self.ema_5 = self.ema_15 = close
+        else:
+            a5, a15 = _alpha(5), _alpha(15)
+            self.ema_5 = (1.0 - a5) * self.ema_5 + a5 * close
+            self.ema_15 = (1.0 - a15) * self.ema_15 + a15 * close
+        self.last_ts = ts
+        self.count += 1
+        return True
+
+    def extend(self, rows: Iterable[tuple[datetime, float]]) -> int:
+        return sum(1 for ts, close in rows if self.update(ts, close))
+
+    @property
+    def ready(self) -> bool:
+        return len(self.closes) == HISTORY
+
+    @property
+    def last_close(self) -> Optional[float]:
+        return self.closes[-1] if self.closes else None
+
+    def vector(self) -> Optional[list[float]]:
+        if not self.ready:
+            return None
+        c = list(self.closes)
+        last = c[-1]
+        w5, w15 = c[-5:], c[-15:]
+        sma_5 = math.fsum(w5) / 5
+        sma_15 = math.fsum(w15) / 15
+        std_15 = math.sqrt(math.fsum((x - sma_15) ** 2 for x in w15) / 14)
+        values = {
+            "ret_1": last / c[-2] - 1.0,
+            "ret_5": last / c[-6] - 1.0,
+            "ret_15": last / c[-16] - 1.0,
+            "sma_5": sma_5,
+            "sma_15": sma_15,
+            "ema_5": self.ema_5,
+            "ema_15": self.ema_15,
+            "std_15": std_15,
+            "close": last,
+        }
+        return [values[f] for f in FEATURES]
+
+    @classmethod
+    def restore(cls, closes: Iterable[float], ema_5: float, ema_15: float,
+                last_ts: datetime, count: int) -> "IncrementalFeatures":
+        # retoma o estado a partir de linhas já materializadas (ver feature_store)
+        state = cls()
+        state.closes = deque((float(c) for c in closes), maxlen=HISTORY)
+        state.ema_5, state.ema_15 = float(ema_5), float(ema_15)
+        state.last_ts, state.count = last_ts, count
+        return state
+
+    def copy(self) -> "IncrementalFeatures":
+        other = IncrementalFeatures()
+        other.closes = deque(self.closes, maxlen=HISTORY)
+        other.ema_5, other.ema_15 = self.ema_5, self.ema_15
+        other.last_ts, other.count = self.last_ts, self.count
+        other.out_of_order = self.out_of_order
+        return other
+
+
+class FeatureStates:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._states: dict[str, IncrementalFeatures] = {}
+
+    def get(self, symbol: str) -> Optional[IncrementalFeatures]:
+        return self._states.get(symbol)
+
+    def get_or_create(self, symbol: str) -> tuple[IncrementalFeatures, bool]:
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is not None:
+                return state, False
+            state = IncrementalFeatures()
+            self._states[symbol] = state
+            return state, True
+
+    def drop(self, symbol: str) -> None:
+        with self._lock:
+            self._states.pop(symbol, None)
+
+    def symbols(self) -> list[str]:
+        return sorted(self._states)
+
+
+FEATURE_STATES = FeatureStates()
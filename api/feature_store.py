@@ -0,0 +1,285 @@
+from __future__ import annotations
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy.orm import Session
+
+from .feature_state import HISTORY, IncrementalFeatures
+from .features import FEATURES, build_features_long
+from .lake import DATA_DIR
+from .loader import load_prices
+from .model_store import _check_key
+from .runtime_metrics import FEATURE_RESYNCS
+
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", os.path.join(DATA_DIR, "features"))
+# linhas mantidas por símbolo (as mais antigas saem em segmentos inteiros) e símbolos em memória (LRU)
+FEATURE_STORE_ROWS = int(os.getenv("FEATURE_STORE_ROWS", "50000"))
+FEATURE_STORE_MAX_SYMBOLS = int(os.getenv("FEATURE_STORE_MAX_SYMBOLS", "128"))
+# candles lidos do banco para materializar um símbolo pela primeira vez
+FEATURE_STORE_SEED_ROWS = int(os.getenv("FEATURE_STORE_SEED_ROWS", "5000"))
+# segmentos abaixo de FEATURE_STORE_SEGMENT_ROWS linhas são "abertos"; passando de
+# FEATURE_STORE_COMPACT_EVERY abertos no fim, viram um só (reescreve no máximo ~SEGMENT_ROWS linhas)
+FEATURE_STORE_SEGMENT_ROWS = int(os.getenv("FEATURE_STORE_SEGMENT_ROWS", "5000"))
+FEATURE_STORE_COMPACT_EVERY = int(os.getenv("FEATURE_STORE_COMPACT_EVERY", "32"))
+
+FEATURE_SCHEMA = pa.schema(
+    [("ts", pa.timestamp("us", tz="UTC"))] + [(f, pa.float64()) for f in FEATURES]
+)
+
+def _utc(ts: datetime) -> pd.Timestamp:
+    # o sqlite devolve ts sem fuso; o store guarda em UTC
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts
+
+# uma linha de features por (symbol, ts), em segmentos Arrow IPC (<root>/<symbol>/<ts inicial>.arrow);
+# a ingestão chama update(), que grava só as linhas novas, e o treino/predição leem as linhas prontas
+class FeatureStore:
+    def __init__(self, root: str = FEATURE_STORE_DIR, max_rows: int = FEATURE_STORE_ROWS,
+                 max_symbols: int = FEATURE_STORE_MAX_SYMBOLS, segment_rows: int = FEATURE_STORE_SEGMENT_ROWS,
+                 compact_every: int = FEATURE_STORE_COMPACT_EVERY) -> None:
+        self.root = root
+        self.max_rows = max_rows
+        self.max_symbols = max_symbols
+        self.segment_rows = segment_rows
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._locks: dict[str, threading.RLock] = {}
+        # symbol -> (tabela, [(arquivo do segmento, linhas)]) na ordem do tempo
+        self._tables: OrderedDict[str, tuple[pa.Table, list[tuple[str, int]]]] = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+        self.rows_appended = 0
+        self.segments_written = 0
+        self.compactions = 0
+
+    def _dir(self, symbol: str) -> str:
+        return os.path.join(self.root, _check_key(symbol, "symbol"))
+
+    def _symbol_lock(self, symbol: str) -> threading.RLock:
+        with self._lock:
+            return self._locks.setdefault(symbol, threading.RLock())
+
+    def _cached(self, symbol: str) -> Optional[tuple[pa.Table, list[tuple[str, int]]]]:
+        with self._lock:
+            entry = self._tables.get(symbol)
+            if entry is not None:
+                self._tables.move_to_end(symbol)
+                self.hits += 1
+            return entry
+
+    def _entry(self, symbol: str) -> Optional[tuple[pa.Table, list[tuple[str, int]]]]:
+        entry = self._cached(symbol)
+        if entry is not None:
+            return entry
+        # a leitura dos segmentos não pode cruzar com uma compactação do mesmo símbolo
+        with self._symbol_lock(symbol):
+            entry = self._cached(symbol)
+            if entry is None:
+                entry = self._load(symbol)
+                if entry is not None:
+                    self.loads += 1
+                    self._remember(symbol, entry)
+        return entry
+
+    def _load(self, symbol: str) -> Optional[tuple[pa.Table, list[tuple[str, int]]]]:
+        d = self._dir(symbol)
+        try:
+            names = sorted(n for n in os.listdir(d) if n.endswith(".arrow"))
+        except FileNotFoundError:
+            return None
+        tables, segments, last_ts = [], [], None
+        for name in names:
+            path = os.path.join(d, name)
+            with pa.memory_map(path, "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            if table.num_rows == 0:
+                continue
+            if last_ts is not None and table.column("ts")[0].as_py() <= last_ts:
+                # sobra de uma compactação interrompida: as linhas já estão no segmento anterior
+                os.remove(path)
+                continue
+            tables.append(table)
+            segments.append((name, table.num_rows))
+            last_ts = table.column("ts")[-1].as_py()
+        if not tables:
+            return None
+        return pa.concat_tables(tables), segments
+
+    def get(self, symbol: str) -> Optional[pa.Table]:
+        entry = self._entry(symbol)
+        return None if entry is None else entry[0]
+
+    def _remember(self, symbol: str, entry: tuple[pa.Table, list[tuple[str, int]]]) -> None:
+        with self._lock:
+            self._tables[symbol] = entry
+            self._tables.move_to_end(symbol)
+            while len(self._tables) > self.max_symbols:
+                self._tables.popitem(last=False)
+
+    def _write_segment(self, symbol: str, table: pa.Table) -> tuple[str, int]:
+        # nome = ts inicial em µs: a ordem dos arquivos é a ordem do tempo e a compactação
+        # reescreve o primeiro segmento do trecho no mesmo lugar
+        d = self._dir(symbol)
+        os.makedirs(d, exist_ok=True)
+        name = f"{table.column('ts')[0].value:020d}.arrow"
+        path = os.path.join(d, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, FEATURE_SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.segments_written += 1
+        return name, table.num_rows
+
+    def _remove_segment(self, symbol: str, name: str) -> None:
+        try:
+            os.remove(os.path.join(self._dir(symbol), name))
+        except FileNotFoundError:
+            pass
+
+    def _append(self, symbol: str, new: pa.Table) -> pa.Table:
+        entry = self._entry(symbol)
+        table, segments = entry if entry is not None else (FEATURE_SCHEMA.empty_table(), [])
+        segments = segments + [self._write_segment(symbol, new)]
+        table = pa.concat_tables([table, new])
+
+        tail = 0
+        while tail < len(segments) and segments[-1 - tail][1] < self.segment_rows:
+            tail += 1
+        if tail > self.compact_every:
+            start = table.num_rows - sum(n for _, n in segments[-tail:])
+            merged = table.slice(start).combine_chunks()
+            name = self._write_segment(symbol, merged)
+            for old, _ in segments[-tail + 1:]:
+                self._remove_segment(symbol, old)
+            segments = segments[:-tail] + [name]
+            table = pa.concat_tables([table.slice(0, start), merged])
+            self.compactions += 1
+
+        # corte por segmentos inteiros: o mais antigo sai enquanto o resto ainda cobre max_rows
+        while len(segments) > 1 and table.num_rows - segments[0][1] >= self.max_rows:
+            self._remove_segment(symbol, segments[0][0])
+            table = table.slice(segments[0][1])
+            segments = segments[1:]
+        self._remember(symbol, (table, segments))
+        return table
+
+    def state(self, symbol: str) -> Optional[IncrementalFeatures]:
+        table = self.get(symbol)
+        if table is None or table.num_rows < HISTORY:
+            return None
+        tail = table.slice(table.num_rows - HISTORY)
+        return IncrementalFeatures.restore(
+            tail.column("close").to_pylist(),
+            tail.column("ema_5")[-1].as_py(),
+            tail.column("ema_15")[-1].as_py(),
+            tail.column("ts")[-1].as_py(),
+            table.num_rows,
+        )
+
+    def _rewind(self, symbol: str, before: datetime) -> Optional[IncrementalFeatures]:
+        # volta o store para as linhas anteriores a `before`: o segmento que cruza o corte é regravado
+        # no mesmo nome e os seguintes saem; sem HISTORY linhas antes do corte, o símbolo é refeito do zero
+        table, segments = self._entry(symbol)
+        cut = _utc(before).value // 1000
+        keep = int(np.searchsorted(table.column("ts").cast(pa.int64()).to_numpy(), cut))
+        if keep < HISTORY:
+            self.drop(symbol)
+            return None
+        start = 0
+        for i, (name, n) in enumerate(segments):
+            if start + n > keep:
+                for old, _ in segments[i + 1:]:
+                    self._remove_segment(symbol, old)
+                if start == keep:
+                    self._remove_segment(symbol, name)
+                    segments = segments[:i]
+                else:
+                    segments = segments[:i] + [self._write_segment(symbol, table.slice(start, keep - start))]
+                break
+            start += n
+        self._remember(symbol, (table.slice(0, keep), segments))
+        return self.state(symbol)
+
+    def _seed(self, db: Session, symbol: str) -> pa.Table:
+        df = load_prices(db, symbol, ("ts", "close"), limit=FEATURE_STORE_SEED_ROWS)
+        if df.empty:
+            return FEATURE_SCHEMA.empty_table()
+        feats = build_features_long(df.assign(symbol=symbol), target=False)
+        return pa.Table.from_pandas(feats[["ts"] + FEATURES], schema=FEATURE_SCHEMA, preserve_index=False)
+
+    def update(self, db: Session, symbol: str, oldest: Optional[datetime] = None) -> int:
+        # oldest: ts mais antigo entre os candles recém-gravados; se ficar atrás do último ts do store
+        # (buraco preenchido depois), as linhas a partir dele são recalculadas
+        with self._symbol_lock(symbol):
+            state = self.state(symbol)
+            if state is not None and oldest is not None and _utc(oldest) < _utc(state.last_ts):
+                state = self._rewind(symbol, oldest)
+                FEATURE_RESYNCS.inc(symbol, "store")
+            if state is None:
+                table = self._seed(db, symbol)
+                if table.num_rows > self.max_rows:
+                    table = table.slice(table.num_rows - self.max_rows)
+                # rematerializa do zero: segmentos curtos demais para o estado incremental saem
+                self.drop(symbol)
+                if table.num_rows:
+                    self._append(symbol, table.combine_chunks())
+                self.rows_appended += table.num_rows
+                return table.num_rows
+
+            df = load_prices(db, symbol, ("ts", "close"), since=state.last_ts)
+            rows = []
+            for ts, close in zip(df["ts"], df["close"]):
+                if state.update(ts, close):
+                    rows.append([ts] + state.vector())
+            if not rows:
+                return 0
+            new = pa.Table.from_pandas(
+                pd.DataFrame(rows, columns=["ts"] + FEATURES), schema=FEATURE_SCHEMA, preserve_index=False,
+            )
+            self._append(symbol, new)
+            self.rows_appended += len(rows)
+            return len(rows)
+
+    def update_many(self, db: Session, symbols: list[str],
+                    oldest: Optional[dict[str, datetime]] = None) -> dict[str, int]:
+        oldest = oldest or {}
+        return {sym: self.update(db, sym, oldest.get(sym)) for sym in symbols}
+
+    def training_set(self, symbol: str, limit: int) -> Optional[pd.DataFrame]:
+        # últimas `limit` linhas com alvo: y é o close da linha seguinte, a última fica de fora
+        table = self.get(symbol)
+        if table is None or table.num_rows < 2:
+            return None
+        table = table.slice(max(0, table.num_rows - limit - 1))
+        df = table.to_pandas()
+        df["y"] = df["close"].shift(-1)
+        return df.iloc[:-1].reset_index(drop=True)
+
+    def drop(self, symbol: str) -> None:
+        with self._lock:
+            self._tables.pop(symbol, None)
+        shutil.rmtree(self._dir(symbol), ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "cached_symbols": list(self._tables),
+            "rows": {sym: t.num_rows for sym, (t, _) in self._tables.items()},
+            "segments": {sym: len(segs) for sym, (_, segs) in self._tables.items()},
+            "hits": self.hits,
+            "loads": self.loads,
+            "rows_appended": self.rows_appended,
+            "segments_written": self.segments_written,
+            "compactions": self.compactions,
+        }
+
+
+FEATURE_STORE = FeatureStore()
@@ -1,28 +1,61 @@
 from __future__ import annotations
+from datetime import timedelta
+
+import numpy as np
 import pandas as pd
 
+FEATURES = [
+    "ret_1", "ret_5", "ret_15",
+    "sma_5", "sma_15", "ema_5", "ema_15", "std_15",
+    "close"
+]
+
+# intervalos de kline da Binance com passo fixo; "1M" (mês) não tem duração constante e é recusado
+_INTERVAL_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def interval_delta(interval: str) -> timedelta:
+    n, unit = interval[:-1], interval[-1:]
+    if unit not in _INTERVAL_SECONDS or not n.isdigit() or int(n) == 0:
+        raise ValueError(f"Intervalo {interval!r} não suportado: use s, m, h, d ou w (ex.: 1m, 4h); "
+                         "1M (mês) não tem duração fixa.")
+    return timedelta(seconds=int(n) * _INTERVAL_SECONDS[unit])
+
+def build_features_long(df: pd.DataFrame, target: bool = True) -> pd.DataFrame:
+    # formato longo (symbol, ts, close) de vários símbolos; cada feature é uma única chamada
+    # agrupada (kernels Cython do pandas), sem loop Python por símbolo.
+    # Retorna symbol, ts, FEATURES e y, sem as linhas incompletas, ordenado por (symbol, ts);
+    # com target=False não calcula y e mantém o último candle de cada símbolo.
+    # Símbolos viram códigos inteiros: ordenar e agrupar por int é bem mais barato que por string
+    codes, uniques = pd.factorize(df["symbol"], sort=True)
+    ts = df["ts"]
+    if not pd.api.types.is_datetime64_any_dtype(ts):
+        ts = pd.to_datetime(ts)
+    order = np.lexsort((ts.to_numpy("int64"), codes))
+    codes = codes[order]
+    ts = ts.array.take(order)
+    close = pd.Series(df["close"].to_numpy(dtype="float64")[order])
+
+    # um único símbolo dispensa o groupby (mesmos kernels, sem o custo de indexar grupos)
+    g = close.groupby(codes, sort=False) if len(uniques) > 1 else close
+    cols = {"close": close.to_numpy()}
+    for k in (1, 5, 15):
+        cols[f"ret_{k}"] = (close / g.shift(k) - 1).to_numpy()
+    cols["sma_5"] = g.rolling(5).mean().to_numpy()
+    cols["sma_15"] = g.rolling(15).mean().to_numpy()
+    cols["ema_5"] = g.ewm(span=5, adjust=False).mean().to_numpy()
+    cols["ema_15"] = g.ewm(span=15, adjust=False).mean().to_numpy()
+    cols["std_15"] = g.rolling(15).std().to_numpy()
+    if target:
+        cols["y"] = g.shift(-1).to_numpy()
+
+    keep = np.ones(len(close), dtype=bool)
+    for v in cols.values():
+        keep &= ~np.isnan(v)
+
+    out = {"symbol": uniques.take(codes[keep]), "ts": ts[keep]}
+    out.update((f, cols[f][keep]) for f in FEATURES + (["y"] if target else []))
+    return pd.DataFrame(out)
+
 def build_features(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
-    df = df.sort_values("ts").reset_index(drop=True)
-
-    df["ret_1"] = df["close"].pct_change(1)
-    df["ret_5"] = df["close"].pct_change(5)
-    df["ret_15"] = df["close"].pct_change(15)
-
-    df["sma_5"] = df["close"].rolling(5).mean()
-    df["sma_15"] = df["close"].rolling(15).mean()
-    df["ema_5"] = df["close"].ewm(span=5, adjust=False).mean()
-    df["ema_15"] = df["close"].ewm(span=15, adjust=False).mean()
-    df["std_15"] = df["close"].rolling(15).std()
-
-    df["y"] = df["close"].shift(-1)
-
-    feats = [
-        "ret_1", "ret_5", "ret_15",
-        "sma_5", "sma_15", "ema_5", "ema_15", "std_15",
-        "close"
-    ]
-
-    df = df.dropna().reset_index(drop=True)
-    X = df[feats]
-    y = df["y"]
-    return X, y
+    long = build_features_long(df[["ts", "close"]].assign(symbol=0))
+    return long[FEATURES], long["y"]
@@ -1,26 +1,110 @@
 from __future__ import annotations
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from typing import Optional, Protocol
+
 import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .db import Price, ensure_partitions
+from .predlog import PREDICTION_LOG
+from .response_cache import PRICES_CACHE
+from .rollups import update_rollups
+from .runtime_metrics import INGEST_FAILURES, INGEST_ROWS, stage
+
+BINANCE_BASE_URL = os.getenv("BINANCE_BASE_URL", "https://api.binance.com")
+BINANCE_BASE = f"{BINANCE_BASE_URL.rstrip('/')}/api/v3/klines"
 
-from .db import Price
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+# orçamento de requisições por segundo ao upstream (Binance: 6000 de peso/min, klines pesa 1-10)
+INGEST_RATE_LIMIT = float(os.getenv("INGEST_RATE_LIMIT", "10"))
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "15"))
+# limite de páginas por execução ao preencher lacunas grandes (o restante fica para a próxima)
+INGEST_MAX_PAGES = int(os.getenv("INGEST_MAX_PAGES", "20"))
+KLINES_PAGE_SIZE = 1000
+# lotes grandes (backfill) vão por COPY + staging; abaixo disso, INSERT ... VALUES em chunks
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+INGEST_COPY_THRESHOLD = int(os.getenv("INGEST_COPY_THRESHOLD", "2000"))
 
-BINANCE_BASE = "https://api.binance.com/api/v3/klines"
+PRICE_WRITE_COLUMNS = ("symbol", "ts", "open", "high", "low", "close", "volume")
+SQLITE_MAX_VARIABLES = 32766
+
+logger = logging.getLogger(__name__)
 
 def _ms_to_dt_utc(ms: int) -> datetime:
     return datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc).replace(microsecond=999000)
 
-def _fetch_binance_klines(symbol: str, interval: str, limit: int) -> list[dict]:
-    params = {"symbol": symbol, "interval": interval, "limit": limit}
-    r = requests.get(BINANCE_BASE, params=params, timeout=15)
-    r.raise_for_status()
-    data = r.json()
+def _dt_to_ms(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
 
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class KlineSource(Protocol):
+    def fetch(self, symbol: str, interval: str, limit: int, start_ms: Optional[int] = None) -> list[dict]: ...
+
+class BinanceKlineSource:
+    def __init__(
+        self,
+        base_url: str = BINANCE_BASE,
+        max_connections: int = INGEST_MAX_WORKERS,
+        rate_limit: float = INGEST_RATE_LIMIT,
+        timeout: float = INGEST_TIMEOUT,
+    ) -> None:
+        self.base_url = base_url
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit)
+        # sessão única com pool keep-alive compartilhado entre as threads de coleta
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, symbol: str, interval: str, limit: int, start_ms: Optional[int] = None) -> list[dict]:
+        self.limiter.acquire()
+        params = {"symbol": symbol, "interval": interval, "limit": limit}
+        if start_ms is not None:
+            params["startTime"] = start_ms
+        r = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return _parse_klines(symbol, r.json())
+
+def _parse_klines(symbol: str, data: list) -> list[dict]:
     rows = []
     for k in data:
-        open_time = int(k[0])
-        ts = _ms_to_dt_utc(int(k[6])) 
+        ts = _ms_to_dt_utc(int(k[6]))
         rows.append({
             "symbol": symbol,
             "ts": ts,
@@ -32,16 +116,240 @@ def _fetch_binance_klines(symbol: str, interval: str, limit: int) -> list[dict]:
         })
     return rows
 
-def _bulk_upsert_prices(db: Session, rows: list[dict]) -> int:
-    if not rows:
-        return 0
-    stmt = pg_insert(Price.__table__).values(rows)
-    stmt = stmt.on_conflict_do_nothing(index_elements=["symbol", "ts"])
-    db.execute(stmt)
-    db.commit()
-    return len(rows)
-
-def run_ingestion(db: Session, symbol: str = "BTCUSDT", interval: str = "1m", limit: int = 1000) -> int:
-    rows = _fetch_binance_klines(symbol=symbol, interval=interval, limit=limit)
-    inserted = _bulk_upsert_prices(db, rows)
+_DEFAULT_SOURCE: Optional[BinanceKlineSource] = None
+_DEFAULT_SOURCE_LOCK = threading.Lock()
+
+def get_default_source() -> BinanceKlineSource:
+    global _DEFAULT_SOURCE
+    with _DEFAULT_SOURCE_LOCK:
+        if _DEFAULT_SOURCE is None:
+            _DEFAULT_SOURCE = BinanceKlineSource()
+        return _DEFAULT_SOURCE
+
+def _fetch_binance_klines(symbol: str, interval: str, limit: int, start_ms: Optional[int] = None) -> list[dict]:
+    return get_default_source().fetch(symbol, interval, limit, start_ms=start_ms)
+
+class Watermarks:
+    # symbol -> ts do último candle gravado, semeado do banco na primeira consulta. A chave é só o
+    # símbolo, como em prices (PK symbol, ts): a tabela guarda uma série por símbolo (API_INTERVAL)
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._marks: dict[str, datetime] = {}
+
+    def get(self, db: Session, symbol: str) -> Optional[datetime]:
+        with self._lock:
+            if symbol in self._marks:
+                return self._marks[symbol]
+        last = db.execute(select(func.max(Price.ts)).where(Price.symbol == symbol)).scalar()
+        if last is not None:
+            self.advance(symbol, last)
+        return last
+
+    def advance(self, symbol: str, ts: datetime) -> None:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        with self._lock:
+            cur = self._marks.get(symbol)
+            if cur is None or ts > cur:
+                self._marks[symbol] = ts
+
+    def reset(self, symbol: Optional[str] = None) -> None:
+        with self._lock:
+            if symbol is None:
+                self._marks.clear()
+            else:
+                self._marks.pop(symbol, None)
+
+    def snapshot(self) -> dict[str, str]:
+        with self._lock:
+            return {s: ts.isoformat() for s, ts in self._marks.items()}
+
+
+WATERMARKS = Watermarks()
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _closed_only(rows: list[dict]) -> list[dict]:
+    # o REST devolve por último o candle ainda aberto (fechamento no futuro); gravá-lo faria o
+    # ON CONFLICT DO NOTHING descartar depois a versão fechada que chega pelo stream
+    now = _utcnow()
+    return [r for r in rows if r["ts"] <= now]
+
+def _fetch_since(source: KlineSource, symbol: str, interval: str, limit: int,
+                 since: Optional[datetime], max_pages: int = INGEST_MAX_PAGES) -> list[dict]:
+    if since is None:
+        with stage("fetch"):
+            return _closed_only(source.fetch(symbol, interval, limit))
+
+    rows: list[dict] = []
+    start_ms = _dt_to_ms(since) + 1
+    for _ in range(max_pages):
+        with stage("fetch"):
+            page = source.fetch(symbol, interval, KLINES_PAGE_SIZE, start_ms=start_ms)
+        rows.extend(page)
+        if len(page) < KLINES_PAGE_SIZE:
+            break
+        start_ms = _dt_to_ms(page[-1]["ts"]) + 1
+    return _closed_only(rows)
+
+def _chunks(rows: list[dict], size: int):
+    for i in range(0, len(rows), max(1, size)):
+        yield rows[i:i + size]
+
+def _values_upsert_prices(db: Session, rows: list[dict], chunk_size: int = INGEST_CHUNK_SIZE) -> Counter:
+    ensure_partitions(db, (r["ts"] for r in rows))
+    # SQLite (testes/benchmarks offline) tem o mesmo ON CONFLICT DO NOTHING ... RETURNING
+    insert = pg_insert
+    if db.get_bind().dialect.name == "sqlite":
+        insert = sqlite_insert
+        chunk_size = min(chunk_size, SQLITE_MAX_VARIABLES // len(PRICE_WRITE_COLUMNS))
+    inserted: Counter = Counter()
+    for chunk in _chunks(rows, chunk_size):
+        stmt = insert(Price.__table__).values(chunk)
+        stmt = stmt.on_conflict_do_nothing(index_elements=["symbol", "ts"])
+        stmt = stmt.returning(Price.__table__.c.symbol)
+        inserted.update(sym for (sym,) in db.execute(stmt))
+        db.commit()
     return inserted
+
+_STAGING_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS prices_staging (
+    symbol TEXT, ts TIMESTAMPTZ,
+    open DOUBLE PRECISION, high DOUBLE PRECISION, low DOUBLE PRECISION,
+    close DOUBLE PRECISION, volume DOUBLE PRECISION
+) ON COMMIT DELETE ROWS
+"""
+
+def _copy_upsert_prices(db: Session, rows: list[dict], chunk_size: int = INGEST_CHUNK_SIZE) -> Counter:
+    cols = ", ".join(PRICE_WRITE_COLUMNS)
+    merge_sql = (
+        f"INSERT INTO prices ({cols}) SELECT {cols} FROM prices_staging "
+        "ON CONFLICT (symbol, ts) DO NOTHING RETURNING symbol"
+    )
+    ensure_partitions(db, (r["ts"] for r in rows))
+    inserted: Counter = Counter()
+    for chunk in _chunks(rows, chunk_size):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for r in chunk:
+            writer.writerow([
+                r["symbol"], r["ts"].isoformat(),
+                r.get("open"), r.get("high"), r.get("low"), r["close"], r.get("volume"),
+            ])
+        buf.seek(0)
+        # cada chunk é uma transação: a staging é esvaziada no commit (ON COMMIT DELETE ROWS)
+        raw = db.connection().connection
+        with raw.cursor() as cur:
+            cur.execute(_STAGING_DDL)
+            cur.copy_expert(f"COPY prices_staging ({cols}) FROM STDIN WITH (FORMAT csv)", buf)
+            cur.execute(merge_sql)
+            inserted.update(sym for (sym,) in cur.fetchall())
+        db.commit()
+    return inserted
+
+def _upsert_prices(db: Session, rows: list[dict], chunk_size: int = INGEST_CHUNK_SIZE) -> Counter:
+    # símbolo -> linhas efetivamente inseridas (conflitos não entram no RETURNING)
+    if not rows:
+        return Counter()
+    with stage("upsert"):
+        if len(rows) >= INGEST_COPY_THRESHOLD and db.get_bind().dialect.name == "postgresql":
+            return _copy_upsert_prices(db, rows, chunk_size)
+        return _values_upsert_prices(db, rows, chunk_size)
+
+def _update_rollups(db: Session, rows: list[dict], inserted: Counter) -> None:
+    # antes de invalidar o cache (a próxima leitura de /prices/range já vê os agregados novos);
+    # falha aqui não desfaz a gravação: `python -m api.rollups rebuild` recalcula depois
+    try:
+        update_rollups(db, rows, inserted)
+    except Exception:
+        logger.exception("falha ao atualizar price_rollups")
+
+def _resolve_predictions(db: Session, rows: list[dict], inserted: Counter) -> None:
+    # liga as previsões do log aos fechamentos recém-gravados (erro online); falha aqui não desfaz a
+    # gravação e as previsões seguem pendentes no log
+    try:
+        PREDICTION_LOG.resolve(db, rows, inserted)
+    except Exception:
+        logger.exception("falha ao resolver previsões do log")
+
+def _invalidate_caches(inserted: Counter) -> None:
+    for sym, n in inserted.items():
+        if n:
+            INGEST_ROWS.inc(sym, amount=n)
+            PRICES_CACHE.invalidate(sym)
+
+def _advance_watermarks(rows: list[dict]) -> None:
+    last: dict[str, datetime] = {}
+    for r in rows:
+        if r["symbol"] not in last or r["ts"] > last[r["symbol"]]:
+            last[r["symbol"]] = r["ts"]
+    for sym, ts in last.items():
+        WATERMARKS.advance(sym, ts)
+
+def run_ingestion(db: Session, symbol: str = "BTCUSDT", interval: str = "1m", limit: int = 1000,
+                  source: Optional[KlineSource] = None) -> int:
+    source = source or get_default_source()
+    since = WATERMARKS.get(db, symbol)
+    try:
+        rows = _fetch_since(source, symbol, interval, limit, since)
+        inserted = _upsert_prices(db, rows)
+    except Exception:
+        INGEST_FAILURES.inc(symbol)
+        raise
+    _advance_watermarks(rows)
+    _update_rollups(db, rows, inserted)
+    _resolve_predictions(db, rows, inserted)
+    _invalidate_caches(inserted)
+    return sum(inserted.values())
+
+def run_ingestion_many(
+    db: Session,
+    symbols: list[str],
+    interval: str = "1m",
+    limit: int = 1000,
+    source: Optional[KlineSource] = None,
+    max_workers: int = INGEST_MAX_WORKERS,
+) -> dict:
+    source = source or get_default_source()
+    symbols = [s.strip() for s in symbols if s.strip()]
+    # watermarks lidos antes do fan-out: a sessão do chamador não é compartilhada entre threads
+    since = {sym: WATERMARKS.get(db, sym) for sym in symbols}
+
+    def _fetch(sym: str):
+        try:
+            return sym, _fetch_since(source, sym, interval, limit, since[sym]), None
+        except Exception as e:
+            return sym, [], e
+
+    fetched: dict[str, int] = {}
+    errors: dict[str, str] = {}
+    rows: list[dict] = []
+    workers = max(1, min(max_workers, len(symbols)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest") as pool:
+        for sym, sym_rows, err in pool.map(_fetch, symbols):
+            if err is not None:
+                errors[sym] = repr(err)
+                INGEST_FAILURES.inc(sym)
+                continue
+            fetched[sym] = len(sym_rows)
+            rows.extend(sym_rows)
+
+    # um único upsert para todos os símbolos, na sessão do chamador
+    try:
+        inserted = _upsert_prices(db, rows)
+    except Exception:
+        for sym in fetched:
+            INGEST_FAILURES.inc(sym)
+        raise
+    _advance_watermarks(rows)
+    _update_rollups(db, rows, inserted)
+    _resolve_predictions(db, rows, inserted)
+    _invalidate_caches(inserted)
+    return {
+        "interval": interval,
+        "fetched": fetched,
+        "inserted": sum(inserted.values()),
+        "inserted_by_symbol": dict(inserted),
+        "errors": errors,
+    }
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from .runtime_metrics import job as job_metrics
+
+# operações longas (treino, exportação) rodam aqui, fora do threadpool dos handlers:
+# um /train de minutos não ocupa as threads que servem as leituras
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+# jobs concluídos mantidos para consulta (os mais antigos saem)
+JOBS_RETENTION = int(os.getenv("JOBS_RETENTION", "200"))
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _session() -> Session:
+    from .db import SessionLocal
+    return SessionLocal()
+
+class JobManager:
+    def __init__(self, max_workers: int = JOBS_MAX_WORKERS, retention: int = JOBS_RETENTION,
+                 session_factory: Callable[[], Session] = _session) -> None:
+        self.max_workers = max_workers
+        self.retention = retention
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, dict] = OrderedDict()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            return self._pool
+
+    def submit(self, kind: str, fn: Callable[[Session], Any], params: Optional[dict] = None) -> dict:
+        # o mesmo pedido já na fila ou rodando não é enfileirado de novo
+        params = params or {}
+        with self._lock:
+            for j in self._jobs.values():
+                if j["kind"] == kind and j["params"] == params and j["status"] in ("queued", "running"):
+                    return dict(j)
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id, "kind": kind, "params": params, "status": "queued",
+                "created_at": _now(), "started_at": None, "finished_at": None,
+                "result": None, "error": None,
+            }
+            self._trim()
+            snapshot = dict(self._jobs[job_id])
+        self._executor().submit(self._run, job_id, fn)
+        return snapshot
+
+    def _run(self, job_id: str, fn: Callable[[Session], Any]) -> None:
+        self._set(job_id, status="running", started_at=_now())
+        kind = self._jobs[job_id]["kind"]
+        db = self.session_factory()
+        try:
+            with job_metrics(kind):
+                result = fn(db)
+            self._set(job_id, status="succeeded", result=result, finished_at=_now())
+        except Exception as e:
+            self._set(job_id, status="failed", error=str(e), finished_at=_now())
+        finally:
+            db.close()
+
+    def _set(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _trim(self) -> None:
+        finished = [k for k, j in self._jobs.items() if j["status"] in ("succeeded", "failed")]
+        for k in finished[:max(0, len(self._jobs) - self.retention)]:
+            del self._jobs[k]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            j = self._jobs.get(job_id)
+            return dict(j) if j is not None else None
+
+    def list(self, kind: Optional[str] = None, limit: int = 50) -> list[dict]:
+        with self._lock:
+            jobs = [dict(j) for j in reversed(self._jobs.values()) if kind is None or j["kind"] == kind]
+        return jobs[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: dict[str, int] = {}
+            for j in self._jobs.values():
+                counts[j["status"]] = counts.get(j["status"], 0) + 1
+        return {"max_workers": self.max_workers, "retention": self.retention, "by_status": counts}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+JOBS = JobManager()
@@ -0,0 +1,241 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from sqlalchemy.orm import Session
+
+from .loader import BATCH_SIZE, iter_price_batches, _schema_for, PRICE_COLUMNS
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
+LAKE_DIR = os.path.join(DATA_DIR, "lake", "prices")
+# row groups grandes favorecem leitura sequencial; zstd comprime bem e descomprime rápido
+LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", "131072"))
+LAKE_COMPRESSION = os.getenv("LAKE_COMPRESSION", "zstd")
+WATERMARKS_NAME = "_watermarks.json"
+
+# symbol e date ficam no caminho (symbol=.../date=...), não dentro do arquivo
+LAKE_COLUMNS = tuple(c for c in PRICE_COLUMNS if c != "symbol")
+_US_PER_DAY = 86_400_000_000
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+class LakeWatermarks:
+    # symbol -> ts do último candle exportado, persistido num JSON ao lado do dataset
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.path = os.path.join(root, WATERMARKS_NAME)
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def get(self, symbol: str) -> Optional[datetime]:
+        value = self._read().get(symbol)
+        return datetime.fromisoformat(value) if value else None
+
+    def advance(self, symbol: str, ts: datetime) -> None:
+        with self._lock:
+            marks = self._read()
+            cur = marks.get(symbol)
+            if cur is not None and datetime.fromisoformat(cur) >= ts:
+                return
+            marks[symbol] = ts.isoformat()
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(marks, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def snapshot(self) -> dict[str, str]:
+        return self._read()
+
+class _DayWriter:
+    # um arquivo por (símbolo, dia) por execução; só aparece no dataset depois de fechado
+    def __init__(self, root: str, symbol: str, day: int, schema: pa.Schema, run_id: str) -> None:
+        date = (_EPOCH + timedelta(days=day)).strftime("%Y-%m-%d")
+        d = os.path.join(root, f"symbol={symbol}", f"date={date}")
+        os.makedirs(d, exist_ok=True)
+        self.day = day
+        self.path = os.path.join(d, f"part-{run_id}.parquet")
+        # prefixo "." faz o arquivo parcial ser ignorado por leitores do dataset
+        self.tmp_path = os.path.join(d, f".part-{run_id}.parquet.tmp")
+        self.schema = schema
+        self.writer = pq.ParquetWriter(self.tmp_path, schema, compression=LAKE_COMPRESSION)
+        self.pending: list[pa.RecordBatch] = []
+        self.pending_rows = 0
+        self.rows = 0
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        self.pending.append(batch)
+        self.pending_rows += batch.num_rows
+        if self.pending_rows >= LAKE_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        table = pa.Table.from_batches(self.pending, schema=self.schema)
+        self.writer.write_table(table, row_group_size=LAKE_ROW_GROUP_SIZE)
+        self.rows += table.num_rows
+        self.pending, self.pending_rows = [], 0
+
+    def close(self) -> str:
+        self._flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self.writer.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+def export_prices(db: Session, symbol: str, max_rows: Optional[int] = None, root: str = LAKE_DIR) -> dict:
+    marks = LakeWatermarks(root)
+    since = marks.get(symbol)
+    run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+    n_rows = 0
+    files: list[str] = []
+    writer: Optional[_DayWriter] = None
+    last_ts: Optional[datetime] = None
+    try:
+        # lotes em ordem crescente de ts: cada dia é escrito e fechado antes do seguinte
+        for batch in iter_price_batches(db, symbol, LAKE_COLUMNS, since=since):
+            if max_rows is not None and n_rows + batch.num_rows > max_rows:
+                batch = batch.slice(0, max_rows - n_rows)
+            if batch.num_rows == 0:
+                break
+            ts_us = batch.column(0).cast(pa.int64()).to_numpy()
+            days = ts_us // _US_PER_DAY
+            bounds = np.flatnonzero(np.diff(days)) + 1
+            for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(days)]):
+                day = int(days[start])
+                if writer is not None and writer.day != day:
+                    files.append(writer.close())
+                    marks.advance(symbol, last_ts)
+                    writer = None
+                if writer is None:
+                    writer = _DayWriter(root, symbol, day, batch.schema, run_id)
+                writer.write(batch.slice(start, end - start))
+                last_ts = _EPOCH + timedelta(microseconds=int(ts_us[end - 1]))
+            n_rows += batch.num_rows
+            if max_rows is not None and n_rows >= max_rows:
+                break
+        if writer is not None:
+            files.append(writer.close())
+            marks.advance(symbol, last_ts)
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    return {
+        "symbol": symbol,
+        "rows": n_rows,
+        "files": files,
+        "since": since.isoformat() if since else None,
+        "watermark": last_ts.isoformat() if last_ts else (since.isoformat() if since else None),
+        "root": root,
+    }
+
+class ParquetPriceSource:
+    # lê o dataset do lake sem banco: arquivos mapeados em memória, partições podadas por
+    # symbol/date e filtro de ts empurrado para as estatísticas dos row groups
+    def __init__(self, root: str = LAKE_DIR) -> None:
+        self.root = root
+        self.filesystem = pafs.LocalFileSystem(use_mmap=True)
+
+    def _dataset(self) -> Optional[ds.Dataset]:
+        if not os.path.isdir(self.root):
+            return None
+        return ds.dataset(
+            self.root, format="parquet", filesystem=self.filesystem,
+            partitioning=ds.partitioning(pa.schema([("symbol", pa.string()), ("date", pa.string())]), flavor="hive"),
+        )
+
+    def load(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+             limit: Optional[int] = None, since: Optional[datetime] = None) -> pa.Table:
+        columns = tuple(columns)
+        schema = _schema_for(columns)
+        dataset = self._dataset()
+        if dataset is None:
+            return schema.empty_table()
+
+        expr = self._filter(symbol, since)
+        cols = [c for c in columns if c != "symbol"]
+
+        by_date: dict[str, list] = {}
+        for frag in dataset.get_fragments(filter=expr):
+            by_date.setdefault(_fragment_date(frag), []).append(frag)
+
+        # com limit, lê os dias do mais recente para o mais antigo até juntar N linhas
+        tables, n_rows = [], 0
+        for date in sorted(by_date, reverse=limit is not None):
+            for frag in by_date[date]:
+                t = frag.to_table(columns=cols, filter=expr, schema=dataset.schema)
+                tables.append(t)
+                n_rows += t.num_rows
+            if limit is not None and n_rows >= limit:
+                break
+        if not tables:
+            return schema.empty_table()
+
+        table = pa.concat_tables(tables)
+        table = table.take(pc.sort_indices(table, sort_keys=[("ts", "ascending")]))
+        if limit is not None and table.num_rows > limit:
+            table = table.slice(table.num_rows - limit)
+        return self._finish(table, symbol, columns, schema)
+
+    def iter_batches(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                     since: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+        # um dia (partição) por vez, em ordem: memória limitada ao maior dia
+        columns = tuple(columns)
+        schema = _schema_for(columns)
+        dataset = self._dataset()
+        if dataset is None:
+            return
+        expr = self._filter(symbol, since)
+        cols = [c for c in columns if c != "symbol"]
+        by_date: dict[str, list] = {}
+        for frag in dataset.get_fragments(filter=expr):
+            by_date.setdefault(_fragment_date(frag), []).append(frag)
+        for date in sorted(by_date):
+            table = pa.concat_tables([f.to_table(columns=cols, filter=expr, schema=dataset.schema)
+                                      for f in by_date[date]])
+            table = table.take(pc.sort_indices(table, sort_keys=[("ts", "ascending")]))
+            yield from self._finish(table, symbol, columns, schema).to_batches(max_chunksize=batch_size)
+
+    def _filter(self, symbol: str, since: Optional[datetime]):
+        expr = ds.field("symbol") == symbol
+        if since is not None:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            expr = expr & (ds.field("date") >= f"{since.astimezone(timezone.utc):%Y-%m-%d}")
+            expr = expr & (ds.field("ts") > pa.scalar(since, type=pa.timestamp("us", tz="UTC")))
+        return expr
+
+    @staticmethod
+    def _finish(table: pa.Table, symbol: str, columns: tuple, schema: pa.Schema) -> pa.Table:
+        if "symbol" in columns:
+            table = table.append_column("symbol", pa.array([symbol] * table.num_rows, type=pa.string()))
+        return table.select(list(columns)).cast(schema)
+
+def _fragment_date(fragment) -> str:
+    # "date=YYYY-MM-DD" ordena como a data
+    return os.path.basename(os.path.dirname(fragment.path))
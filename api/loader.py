@@ -0,0 +1,160 @@
+from __future__ import annotations
+import tempfile
+from datetime import datetime
+from typing import Iterator, Optional, Protocol, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from sqlalchemy import select, cast, BigInteger, extract
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .db import Price
+
+PRICE_COLUMNS = ("symbol", "ts", "open", "high", "low", "close", "volume")
+PRICE_SCHEMA = pa.schema([
+    ("symbol", pa.string()),
+    ("ts", pa.timestamp("us", tz="UTC")),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.float64()),
+])
+
+BATCH_SIZE = 50_000
+# saída do COPY fica em memória até este tamanho e depois vai para disco
+COPY_SPOOL_BYTES = 64 * 1024 * 1024
+
+def _schema_for(columns: Sequence[str]) -> pa.Schema:
+    return pa.schema([PRICE_SCHEMA.field(c) for c in columns])
+
+def _price_select(symbol: str, columns: Sequence[str], limit: Optional[int],
+                  since: Optional[datetime], for_copy: bool):
+    t = Price.__table__
+    exprs = []
+    for c in columns:
+        col = t.c[c]
+        if c == "ts":
+            # no COPY o ts sai como epoch em microssegundos: o Arrow converte sem parse de texto
+            expr = cast(extract("epoch", col) * 1_000_000, BigInteger) if for_copy else col
+        else:
+            expr = col
+        exprs.append(expr.label(c))
+
+    stmt = select(*exprs).where(t.c.symbol == symbol)
+    if since is not None:
+        stmt = stmt.where(t.c.ts > since)
+    if limit is None:
+        return stmt.order_by(t.c.ts.asc())
+    sub = stmt.add_columns(t.c.ts.label("_order_ts")).order_by(t.c.ts.desc()).limit(limit).subquery()
+    return select(*[sub.c[c] for c in columns]).order_by(sub.c["_order_ts"].asc())
+
+def _iter_core_batches(db: Session, stmt, columns: Sequence[str], batch_size: int) -> Iterator[pa.RecordBatch]:
+    schema = _schema_for(columns)
+    conn = db.connection().execution_options(stream_results=True, yield_per=batch_size)
+    result = conn.execute(stmt)
+    for chunk in result.partitions(batch_size):
+        arrays = [pa.array(col, type=schema.field(i).type) for i, col in enumerate(zip(*chunk))]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _iter_copy_batches(db: Session, stmt, columns: Sequence[str], batch_size: int) -> Iterator[pa.RecordBatch]:
+    schema = _schema_for(columns)
+    sql = str(stmt.compile(dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}))
+    raw = db.connection().connection
+    with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES, mode="w+b") as buf:
+        with raw.cursor() as cur:
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", buf)
+        if buf.tell() == 0:
+            return
+        buf.seek(0)
+        column_types = {c: (pa.int64() if c == "ts" else schema.field(c).type) for c in columns}
+        reader = pacsv.open_csv(
+            buf,
+            read_options=pacsv.ReadOptions(column_names=list(columns), block_size=1 << 22),
+            convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=False),
+        )
+        pending: list[pa.RecordBatch] = []
+        for batch in reader:
+            arrays = [
+                batch.column(i).cast(schema.field(i).type) if c == "ts" else batch.column(i)
+                for i, c in enumerate(columns)
+            ]
+            pending.append(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            if sum(b.num_rows for b in pending) >= batch_size:
+                yield from pa.Table.from_batches(pending, schema=schema).combine_chunks().to_batches()
+                pending = []
+        if pending:
+            yield from pa.Table.from_batches(pending, schema=schema).combine_chunks().to_batches()
+
+def iter_price_batches(
+    db: Session,
+    symbol: str,
+    columns: Sequence[str] = PRICE_COLUMNS,
+    limit: Optional[int] = None,
+    since: Optional[datetime] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[pa.RecordBatch]:
+    columns = tuple(columns)
+    use_copy = db.get_bind().dialect.name == "postgresql"
+    stmt = _price_select(symbol, columns, limit, since, for_copy=use_copy)
+    if use_copy:
+        return _iter_copy_batches(db, stmt, columns, batch_size)
+    return _iter_core_batches(db, stmt, columns, batch_size)
+
+def load_prices_table(db: Session, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                      limit: Optional[int] = None, since: Optional[datetime] = None) -> pa.Table:
+    columns = tuple(columns)
+    batches = list(iter_price_batches(db, symbol, columns, limit=limit, since=since))
+    return pa.Table.from_batches(batches, schema=_schema_for(columns))
+
+def load_prices(db: Session, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                limit: Optional[int] = None, since: Optional[datetime] = None) -> pd.DataFrame:
+    return load_prices_table(db, symbol, columns, limit=limit, since=since).to_pandas()
+
+async def load_prices_table_async(db: AsyncSession, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                                  limit: Optional[int] = None, since: Optional[datetime] = None) -> pa.Table:
+    # leituras curtas do event loop (driver assíncrono); históricos grandes seguem pelo COPY síncrono
+    columns = tuple(columns)
+    schema = _schema_for(columns)
+    rows = (await db.execute(_price_select(symbol, columns, limit, since, for_copy=False))).all()
+    if not rows:
+        return schema.empty_table()
+    arrays = [pa.array(col, type=schema.field(i).type) for i, col in enumerate(zip(*rows))]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def load_prices_for_symbols(db: Session, symbols: Sequence[str], since: datetime,
+                            columns: Sequence[str] = ("symbol", "ts", "close")) -> pd.DataFrame:
+    # leitura incremental de vários símbolos numa só consulta (resultado pequeno: só candles novos)
+    columns = tuple(columns)
+    t = Price.__table__
+    exprs = [t.c[c].label(c) for c in columns]
+    stmt = (
+        select(*exprs)
+        .where(t.c.symbol.in_(list(symbols)), t.c.ts > since)
+        .order_by(t.c.symbol.asc(), t.c.ts.asc())
+    )
+    batches = list(_iter_core_batches(db, stmt, columns, BATCH_SIZE))
+    return pa.Table.from_batches(batches, schema=_schema_for(columns)).to_pandas()
+
+class PriceSource(Protocol):
+    # histórico de preços em ordem crescente de ts; limit = últimos N candles após since
+    def load(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+             limit: Optional[int] = None, since: Optional[datetime] = None) -> pa.Table: ...
+
+    # o mesmo histórico em lotes, sem materializar tudo (backtests de anos de 1m)
+    def iter_batches(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                     since: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> Iterator[pa.RecordBatch]: ...
+
+class PostgresPriceSource:
+    def __init__(self, db: Session) -> None:
+        self.db = db
+
+    def load(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+             limit: Optional[int] = None, since: Optional[datetime] = None) -> pa.Table:
+        return load_prices_table(self.db, symbol, columns, limit=limit, since=since)
+
+    def iter_batches(self, symbol: str, columns: Sequence[str] = ("ts", "close"),
+                     since: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+        return iter_price_batches(self.db, symbol, columns, since=since, batch_size=batch_size)
@@ -1,46 +1,82 @@
 from __future__ import annotations
+import asyncio
+import json
+import logging
 import os
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from typing import Optional, List
 
-from fastapi import FastAPI, Depends, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 
-from .db import get_db, init_db, Price, ModelMetric
-from .ingest import run_ingestion
-from .train import train_model, MODEL_PATH, MODELS_DIR
-from .predict import predict_next
+from .db import get_db, get_async_db, dispose_async_engine, init_db, ModelMetric, Prediction
+from .ingest import run_ingestion, run_ingestion_many
+from .jobs import JOBS
+from .loader import load_prices_table_async
+from .lake import export_prices, DATA_DIR
+from .response_cache import PRICES_CACHE
+from .rollups import RANGE_MAX_POINTS, RESOLUTIONS, load_range_async
+from .feature_store import FEATURE_STORE
+from .train import train_model, get_price_source, TRAIN_SOURCE, TRAIN_LIMIT
+from .model_backends import MODEL_BACKEND
+from .backtest import run_backtest
+from .retrain import retrain
+from .features import interval_delta
+from .predict import predict_next, predict_batch
+from .push import PRICE_FEED, push_updates, push_from_db, sse_stream
+from .predlog import ONLINE_ERRORS, PREDICTION_LOG
+from .model_store import MODEL_STORE
+from .registry import REGISTRY
+from .runtime_metrics import RUNTIME_METRICS, JOB_RUNS, job
+from .stream import StreamIngestor, ReplaySource, push_feature_states
 
 SCHEDULER: Optional[BackgroundScheduler] = None
+STREAM: Optional[StreamIngestor] = None
+logger = logging.getLogger(__name__)
 
 API_SYMBOLS = os.getenv("INGEST_SYMBOLS", "BTCUSDT").split(",")
 API_INTERVAL = os.getenv("INGEST_INTERVAL", "1m")
 API_INGEST_LIMIT = int(os.getenv("INGEST_LIMIT", "300"))
 
-RETRAIN_CRON = os.getenv("RETRAIN_CRON", "0 */6 * * *")
+# checagem do retreino: barata, só treina símbolos com candles novos suficientes ou drift (ver api/retrain.py)
+RETRAIN_CRON = os.getenv("RETRAIN_CRON", "*/15 * * * *")
 ENABLE_SCHEDULER = os.getenv("ENABLE_SCHEDULER", "1") == "1"
+# stream: websocket de klines (candles gravados ao fechar); poll: REST a cada minuto pelo scheduler
+INGEST_MODE = os.getenv("INGEST_MODE", "stream")
+# arquivo gravado com `python -m api.stream record`: substitui a corretora (testes de carga offline)
+STREAM_REPLAY_FILE = os.getenv("STREAM_REPLAY_FILE")
+STREAM_REPLAY_SPEED = float(os.getenv("STREAM_REPLAY_SPEED", "100"))
 
-DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "..", "data"))
 os.makedirs(DATA_DIR, exist_ok=True)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    PREDICTION_LOG.start()
 
-    global SCHEDULER
+    global SCHEDULER, STREAM
+    stream_task = None
+    if ENABLE_SCHEDULER and INGEST_MODE == "stream":
+        STREAM = _build_stream()
+        stream_task = asyncio.create_task(STREAM.run())
     if ENABLE_SCHEDULER:
         SCHEDULER = BackgroundScheduler(timezone="UTC")
-        SCHEDULER.add_job(
-            func=lambda: _safe_ingest_job(),
-            trigger=CronTrigger.from_crontab("* * * * *"),  # a cada 1 min
-            id="ingest_job",
-            replace_existing=True,
-            max_instances=1,
-        )
+        if INGEST_MODE == "poll":
+            SCHEDULER.add_job(
+                func=lambda: _safe_ingest_job(),
+                trigger=CronTrigger.from_crontab("* * * * *"),  # a cada 1 min
+                id="ingest_job",
+                replace_existing=True,
+                max_instances=1,
+            )
         SCHEDULER.add_job(
             func=lambda: _safe_retrain_job(),
             trigger=CronTrigger.from_crontab(RETRAIN_CRON),
@@ -48,22 +84,68 @@ async def lifespan(app: FastAPI):
             replace_existing=True,
             max_instances=1,
         )
+        SCHEDULER.add_listener(_on_job_not_run, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
         SCHEDULER.start()
 
     yield
 
     if SCHEDULER:
         SCHEDULER.shutdown(wait=False)
+    if stream_task is not None:
+        STREAM.stop()
+        try:
+            await asyncio.wait_for(stream_task, timeout=5)
+        except (asyncio.TimeoutError, Exception):
+            stream_task.cancel()
+    JOBS.shutdown()
+    PREDICTION_LOG.stop()
+    await dispose_async_engine()
+
+def _build_stream() -> StreamIngestor:
+    source = ReplaySource(STREAM_REPLAY_FILE, STREAM_REPLAY_SPEED) if STREAM_REPLAY_FILE else None
+    stream = StreamIngestor(API_SYMBOLS, API_INTERVAL, source=source, backfill=source is None)
+    # assinantes em memória: estado incremental do predict e feature store (o cache de /prices/latest
+    # já é invalidado na gravação)
+    stream.subscribe(lambda rows: push_feature_states(rows, API_INTERVAL))
+    stream.subscribe(_update_feature_store)
+    # depois do estado incremental: a previsão publicada já usa o candle novo sem ir ao banco
+    stream.subscribe(_push_updates)
+    return stream
+
+def _push_updates(rows: list[dict]) -> None:
+    from .db import SessionLocal
+    push_updates(rows, API_INTERVAL, _predict_for_push, SessionLocal)
+
+def _predict_for_push(db: Session, symbol: str, interval: str) -> dict:
+    return predict_next(db, symbol=symbol, interval=interval)
+
+def _update_feature_store(rows: list[dict]) -> None:
+    from .db import SessionLocal
+    # o candle mais antigo de cada símbolo: se cair atrás do store, o fim do store é recalculado
+    oldest: dict = {}
+    for r in rows:
+        oldest[r["symbol"]] = min(r["ts"], oldest.get(r["symbol"], r["ts"]))
+    with SessionLocal() as db:
+        FEATURE_STORE.update_many(db, sorted(oldest), oldest)
+
+def _on_job_not_run(event):
+    # execução pulada (a anterior ainda rodava) ou perdida (scheduler atrasado): a ingestão está ficando para trás
+    status = "skipped" if event.code == EVENT_JOB_MAX_INSTANCES else "missed"
+    JOB_RUNS.inc(event.job_id.removesuffix("_job"), status)
+    logger.warning("job %s %s", event.job_id, status)
 
 def _safe_ingest_job():
     from .db import SessionLocal
     db = SessionLocal()
     try:
-        for sym in API_SYMBOLS:
-            try:
-                run_ingestion(db, symbol=sym.strip(), interval=API_INTERVAL, limit=API_INGEST_LIMIT)
-            except Exception:
-                pass
+        with job("ingest"):
+            res = run_ingestion_many(db, API_SYMBOLS, interval=API_INTERVAL, limit=API_INGEST_LIMIT)
+            FEATURE_STORE.update_many(db, [s for s, n in res["inserted_by_symbol"].items() if n])
+            push_from_db(db, res["inserted_by_symbol"], API_INTERVAL, _predict_for_push)
+        if res["errors"]:
+            logger.warning("ingestão com falhas: %s", res["errors"])
+    except Exception:
+        logger.exception("falha no job de ingestão")
     finally:
         db.close()
 
@@ -71,11 +153,14 @@ def _safe_retrain_job():
     from .db import SessionLocal
     db = SessionLocal()
     try:
-        for sym in API_SYMBOLS:
-            try:
-                train_model(db, symbol=sym.strip())
-            except Exception:
-                pass
+        with job("retrain"):
+            res = retrain(db, API_SYMBOLS, interval=API_INTERVAL)
+        if res["results"]:
+            logger.info("retreino: %s", {s: r["fit"] for s, r in res["results"].items()})
+        if res["errors"]:
+            logger.warning("retreino com falhas: %s", res["errors"])
+    except Exception:
+        logger.exception("falha no job de retreino")
     finally:
         db.close()
 
@@ -88,7 +173,13 @@ app.add_middleware(
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "scheduler": bool(SCHEDULER)}
+    return {"status": "ok", "scheduler": bool(SCHEDULER), "ingest_mode": INGEST_MODE}
+
+@app.get("/stream/status")
+async def stream_status():
+    if STREAM is None:
+        return {"running": False, "ingest_mode": INGEST_MODE}
+    return {"running": True, **STREAM.status()}
 
 @app.post("/ingest/run")
 def ingest(
@@ -97,63 +188,288 @@ def ingest(
     limit: int = Query(1000, ge=1, le=1000),
     db: Session = Depends(get_db),
 ):
+    # prices guarda uma série por símbolo (sem coluna de intervalo): outro intervalo se misturaria a ela
+    if interval != API_INTERVAL:
+        raise HTTPException(status_code=400, detail=f"Intervalo {interval} não suportado: a ingestão grava {API_INTERVAL}.")
     inserted = run_ingestion(db, symbol=symbol, interval=interval, limit=limit)
-    return {"symbol": symbol, "interval": interval, "limit": limit, "inserted": inserted}
+    features = FEATURE_STORE.update(db, symbol) if inserted else 0
+    if inserted:
+        push_from_db(db, {symbol: inserted}, interval, _predict_for_push)
+    return {"symbol": symbol, "interval": interval, "limit": limit, "inserted": inserted, "features": features}
+
+async def _latest_prices_body(db: AsyncSession, symbol: str, n: int) -> bytes:
+    df = (await load_prices_table_async(db, symbol, ("ts", "close"), limit=n)).to_pandas()
+    data = [{"ts": ts.isoformat(), "close": float(c)} for ts, c in zip(df["ts"], df["close"])]
+    return json.dumps({"symbol": symbol, "data": data}).encode()
 
+# leituras quentes são async: acerto de cache não passa pelo threadpool e a falta consulta com o driver assíncrono
 @app.get("/prices/latest")
-def latest_prices(
+async def latest_prices(
     symbol: str = Query("BTCUSDT"),
     n: int = Query(200, ge=1, le=2000),
-    db: Session = Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    rows = (
-        db.query(Price)
-        .filter(Price.symbol == symbol)
-        .order_by(Price.ts.desc())
-        .limit(n)
-        .all()
+    entry = await PRICES_CACHE.get_or_build_async((symbol, n), lambda: _latest_prices_body(db, symbol, n))
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and entry.etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# push para o dashboard: snapshot (o mesmo corpo de /prices/latest, do cache) e depois só candles novos
+# e a previsão de cada candle, calculada uma vez para todas as conexões
+@app.get("/stream/prices")
+async def stream_prices(
+    request: Request,
+    symbol: str = Query("BTCUSDT"),
+    n: int = Query(200, ge=1, le=2000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    sub = PRICE_FEED.subscribe(symbol)
+    try:
+        entry = await PRICES_CACHE.get_or_build_async((symbol, n), lambda: _latest_prices_body(db, symbol, n))
+    except Exception:
+        PRICE_FEED.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        sse_stream(PRICE_FEED, sub, entry.body, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    data = [{"ts": r.ts.isoformat(), "close": float(r.close)} for r in reversed(rows)]
-    return {"symbol": symbol, "data": data}
+
+@app.get("/stream/prices/info")
+def stream_prices_info():
+    return PRICE_FEED.stats()
+
+# períodos longos: OHLCV agregado (price_rollups 5m/1h/1d, mantidos na ingestão) ou LTTB sobre o fechamento;
+# a resposta fica no mesmo cache de /prices/latest e cai quando o símbolo recebe candles novos
+@app.get("/prices/range")
+async def prices_range(
+    symbol: str = Query("BTCUSDT"),
+    start: datetime = Query(...),
+    end: Optional[datetime] = Query(None),
+    resolution: str = Query("auto", pattern="^(auto|" + "|".join(RESOLUTIONS) + ")$"),
+    method: str = Query("ohlc", pattern="^(ohlc|lttb)$"),
+    max_points: int = Query(RANGE_MAX_POINTS, ge=10, le=5000),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    # sem `end`, vai até o último candle: a chave não muda a cada chamada e o cache vale até a próxima gravação
+    key = (symbol, "range", start.isoformat(), end.isoformat() if end else "now", resolution, method, max_points)
+    end = end or datetime.now(timezone.utc)
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    try:
+        entry = await PRICES_CACHE.get_or_build_async(
+            key, lambda: load_range_async(db, symbol, start, end, resolution, method, max_points),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and entry.etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/prices/cache")
+def prices_cache():
+    return PRICES_CACHE.stats()
+
+@app.get("/features/info")
+def features_info():
+    return FEATURE_STORE.stats()
+
+def _accepted(job: dict) -> Response:
+    body = {"job_id": job["id"], "status": job["status"], "status_url": f"/jobs/{job['id']}"}
+    return Response(content=json.dumps(body), status_code=202, media_type="application/json",
+                    headers={"Location": body["status_url"]})
 
 @app.post("/train")
-def train(symbol: str = Query("BTCUSDT"), db: Session = Depends(get_db)):
-    res = train_model(db, symbol=symbol)
-    return res
+def train(
+    symbol: str = Query("BTCUSDT"),
+    interval: str = Query("1m"),
+    source: str = Query(TRAIN_SOURCE, pattern="^(postgres|parquet)$"),
+    limit: int = Query(TRAIN_LIMIT, ge=200, le=2_000_000),
+    backend: str = Query(MODEL_BACKEND, pattern="^(gbr|hgb|linear)$"),
+    wait: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    # padrão: vira job em segundo plano (202 + /jobs/{id}); wait=true mantém a resposta síncrona
+    def run(jdb: Session) -> dict:
+        return train_model(jdb, symbol=symbol, interval=interval, source=get_price_source(source, jdb),
+                           limit=limit, backend=backend)
+    if wait:
+        return run(db)
+    job = JOBS.submit("train", run, {"symbol": symbol, "interval": interval, "source": source, "limit": limit,
+                                     "backend": backend})
+    return _accepted(job)
+
+@app.post("/retrain")
+def retrain_run(
+    symbols: List[str] = Query(["BTCUSDT"]),
+    interval: str = Query("1m"),
+    backend: str = Query(MODEL_BACKEND, pattern="^(gbr|hgb|linear)$"),
+    dry_run: bool = Query(False),
+    wait: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    # o mesmo retreino do scheduler: pula símbolos sem dados novos e faz warm start quando possível;
+    # dry_run=true só devolve as decisões (síncrono)
+    def run(jdb: Session) -> dict:
+        return retrain(jdb, symbols, interval=interval, backend=backend, dry_run=dry_run)
+    if wait or dry_run:
+        return run(db)
+    job = JOBS.submit("retrain", run, {"symbols": symbols, "interval": interval, "backend": backend})
+    return _accepted(job)
+
+@app.post("/backtest")
+def backtest(
+    symbol: str = Query("BTCUSDT"),
+    source: str = Query(TRAIN_SOURCE, pattern="^(postgres|parquet)$"),
+    since: Optional[datetime] = Query(None),
+    train_size: int = Query(20_000, ge=200),
+    test_size: int = Query(5_000, ge=10),
+    step: Optional[int] = Query(None, ge=1),
+    mode: str = Query("rolling", pattern="^(rolling|expanding)$"),
+    backend: str = Query(MODEL_BACKEND, pattern="^(gbr|hgb|linear)$"),
+):
+    # walk-forward sobre o histórico inteiro: sempre em segundo plano (minutos em anos de 1m)
+    def run(jdb: Session) -> dict:
+        return run_backtest(get_price_source(source, jdb), symbol, train_size, test_size, step, mode, backend,
+                            since=since)
+    job = JOBS.submit("backtest", run, {
+        "symbol": symbol, "source": source, "since": since.isoformat() if since else None,
+        "train_size": train_size, "test_size": test_size, "step": step, "mode": mode, "backend": backend,
+    })
+    return _accepted(job)
+
+@app.get("/jobs")
+def list_jobs(kind: Optional[str] = Query(None), limit: int = Query(50, ge=1, le=500)):
+    return {"items": JOBS.list(kind, limit), **JOBS.stats()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return job
+
+def _check_interval(interval: str) -> None:
+    # o passo do intervalo define o ts alvo das previsões; "1M" e afins respondem 400 em vez de 500
+    try:
+        interval_delta(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/predict")
 def predict(
     symbol: str = Query("BTCUSDT"),
     ingest_interval: str = Query("1m"),
     ingest_limit: int = Query(5, ge=1, le=1000),
+    ingest: Optional[bool] = Query(None),
     db: Session = Depends(get_db),
 ):
-    try:
-        run_ingestion(db, symbol=symbol, interval=ingest_interval, limit=ingest_limit)
-    except Exception:
-        pass
-    res = predict_next(db, symbol=symbol)
+    _check_interval(ingest_interval)
+    # sem valor explícito, só busca no REST quando o stream não está rodando (com ele os dados já estão frescos)
+    if ingest is None:
+        ingest = STREAM is None
+    if ingest:
+        try:
+            run_ingestion(db, symbol=symbol, interval=ingest_interval, limit=ingest_limit)
+        except Exception:
+            pass
+    res = predict_next(db, symbol=symbol, interval=ingest_interval)
     return res
 
+@app.post("/predict/batch")
+def predict_many(
+    symbols: List[str] = Query(["BTCUSDT"]),
+    horizon: int = Query(1, ge=1, le=120),
+    interval: str = Query("1m"),
+    ingest: bool = Query(False),
+    ingest_limit: int = Query(5, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    _check_interval(interval)
+    if ingest:
+        try:
+            run_ingestion_many(db, symbols, interval=interval, limit=ingest_limit)
+        except Exception:
+            pass
+    return predict_batch(db, symbols, horizon=horizon, interval=interval)
+
+# erro das previsões servidas, ligado ao fechamento realizado na gravação dos candles: MAE/RMSE móveis
+# (média exponencial) por símbolo e versão, mantidos em memória sem reler o log
+@app.get("/predictions/errors")
+async def prediction_errors(
+    symbol: Optional[str] = Query(None),
+    interval: Optional[str] = Query(None),
+):
+    return {"span": ONLINE_ERRORS.span, "series": ONLINE_ERRORS.snapshot(symbol, interval),
+            "log": PREDICTION_LOG.stats()}
+
+@app.get("/predictions")
+async def list_predictions(
+    symbol: str = Query("BTCUSDT"),
+    interval: str = Query("1m"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    rows = (await db.execute(
+        select(Prediction)
+        .where(Prediction.symbol == symbol, Prediction.interval == interval)
+        .order_by(Prediction.target_ts.desc())
+        .limit(limit)
+    )).scalars().all()
+    items = []
+    for p in rows:
+        items.append({
+            "model_version": p.model_version,
+            "base_ts": p.base_ts.isoformat(),
+            "target_ts": p.target_ts.isoformat(),
+            "predicted": p.predicted,
+            "last_close": p.last_close,
+            "actual": p.actual,
+            "error": p.predicted - p.actual if p.actual is not None else None,
+            "predicted_at": p.predicted_at.isoformat(),
+        })
+    return {"symbol": symbol, "interval": interval, "items": items}
+
 @app.get("/model/info")
 def model_info():
-    import os
-    exists = os.path.exists(MODEL_PATH)
-    listing = sorted(os.listdir(MODELS_DIR)) if os.path.isdir(MODELS_DIR) else []
-    return {"models_dir": MODELS_DIR, "model_path": MODEL_PATH, "exists": bool(exists), "listing": listing}
+    models = [
+        {"symbol": m["symbol"], "interval": m["interval"], "current": m["current"], "versions": m["versions"]}
+        for m in MODEL_STORE.list()
+    ]
+    return {
+        "models_dir": MODEL_STORE.root, "retention": MODEL_STORE.retention, "models": models,
+        "cache": REGISTRY.stats(),
+    }
+
+@app.post("/model/promote")
+def model_promote(
+    symbol: str = Query("BTCUSDT"),
+    interval: str = Query("1m"),
+    version: str = Query(...),
+):
+    try:
+        data = MODEL_STORE.promote(symbol, interval, version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"symbol": symbol, "interval": interval, "current": data["current"]}
 
 
 @app.get("/metrics")
-def list_metrics(
+async def list_metrics(
     limit: int = Query(50, ge=1, le=500),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    rows = (
-        db.query(ModelMetric)
+    rows = (await db.execute(
+        select(ModelMetric)
         .order_by(ModelMetric.created_at.desc())
         .limit(limit)
-        .all()
-    )
+    )).scalars().all()
     out = []
     for m in rows:
         out.append({
@@ -165,38 +481,26 @@ def list_metrics(
         })
     return {"items": out}
 
+@app.get("/metrics/runtime", response_class=PlainTextResponse)
+def runtime_metrics():
+    # formato texto do Prometheus (scrape direto)
+    return PlainTextResponse(RUNTIME_METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/export/parquet")
 def export_parquet(
     symbol: str = Query("BTCUSDT"),
-    n: int = Query(10000, ge=1, le=500000),
+    n: Optional[int] = Query(None, ge=1),
+    wait: bool = Query(False),
     db: Session = Depends(get_db),
 ):
-    import pandas as pd
-    import pyarrow as pa
-    import pyarrow.parquet as pq
-    os.makedirs(DATA_DIR, exist_ok=True)
-
-    rows = (
-        db.query(Price)
-        .filter(Price.symbol == symbol)
-        .order_by(Price.ts.desc())
-        .limit(n)
-        .all()
+    if wait:
+        return _export_result(export_prices(db, symbol, max_rows=n))
+    job = JOBS.submit(
+        "export", lambda jdb: _export_result(export_prices(jdb, symbol, max_rows=n)), {"symbol": symbol, "n": n},
     )
-    rows = list(reversed(rows))
-    if not rows:
-        return {"ok": False, "message": "Sem dados para exportar."}
-
-    df = pd.DataFrame([{
-        "symbol": r.symbol, "ts": r.ts, "open": float(r.open), "high": float(r.high),
-        "low": float(r.low), "close": float(r.close), "volume": float(r.volume)
-    } for r in rows])
-
-    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-    fname = f"{symbol}_{ts}.parquet"
-    fpath = os.path.join(DATA_DIR, fname)
-
-    table = pa.Table.from_pandas(df)
-    pq.write_table(table, fpath)
+    return _accepted(job)
 
-    return {"ok": True, "path": fpath, "rows": int(len(df))}
+def _export_result(res: dict) -> dict:
+    if res["rows"] == 0:
+        return {"ok": False, "message": "Sem dados novos para exportar.", **res}
+    return {"ok": True, **res}
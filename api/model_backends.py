@@ -0,0 +1,138 @@
+from __future__ import annotations
+import copy
+import os
+from typing import Optional
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+# gbr: GradientBoostingRegressor (original); hgb: HistGradientBoostingRegressor (fit bem mais rápido
+# em janelas grandes); linear: Ridge padronizado, linha de base barata
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gbr")
+# na previsão, usa as árvores achatadas em arrays NumPy gravadas no bundle (quando houver)
+PREDICT_COMPILED = os.getenv("PREDICT_COMPILED", "1") == "1"
+
+BACKENDS = ("gbr", "hgb", "linear")
+
+def make_model(backend: Optional[str] = None):
+    backend = backend or MODEL_BACKEND
+    if backend == "gbr":
+        return GradientBoostingRegressor(random_state=42)
+    if backend == "hgb":
+        return HistGradientBoostingRegressor(random_state=42)
+    if backend == "linear":
+        return make_pipeline(StandardScaler(), Ridge(alpha=1.0))
+    raise ValueError(f"Backend de modelo desconhecido: {backend!r} (use {', '.join(BACKENDS)}).")
+
+def warm_start_copy(model, extra: int):
+    # cópia do ensemble pronta para acrescentar `extra` árvores ao que já foi ajustado (warm start do sklearn);
+    # o modelo original segue intacto (está no cache do registry, servindo previsões). None quando o backend
+    # não tem ajuste incremental válido numa janela nova: o hgb refaz os bins (_bin_mapper) a cada fit e as
+    # árvores antigas ficariam com limiares de outra discretização; o linear é refeito do zero, já barato
+    if isinstance(model, GradientBoostingRegressor):
+        warm = copy.deepcopy(model)
+        warm.set_params(warm_start=True, n_estimators=model.n_estimators_ + extra)
+        return warm
+    return None
+
+def n_trees(model) -> Optional[int]:
+    if isinstance(model, GradientBoostingRegressor):
+        return int(model.n_estimators_)
+    if isinstance(model, HistGradientBoostingRegressor):
+        return int(model.n_iter_)
+    return None
+
+class CompiledTrees:
+    # ensemble achatado: os nós de todas as árvores em arrays contíguos; a previsão desce todas
+    # as árvores ao mesmo tempo, um nível por iteração, sem chamar o sklearn nem montar DataFrame.
+    # Folhas apontam para si mesmas, então `depth` iterações levam qualquer linha até a folha.
+    # Previsões iguais às do sklearn (a menos da ordem da soma em ponto flutuante).
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 missing_left: np.ndarray, value: np.ndarray, roots: np.ndarray, depth: int,
+                 base: float, scale: float, float32: bool) -> None:
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.base = base
+        self.scale = scale
+        # as árvores do sklearn comparam X em float32 (GradientBoostingRegressor)
+        self.float32 = float32
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def predict(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if self.float32:
+            X = X.astype(np.float32).astype(np.float64)
+        has_nan = bool(np.isnan(X).any())
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = x <= self.threshold[node]
+            if has_nan:
+                go_left |= np.isnan(x) & self.missing_left[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.base + self.scale * self.value[node].sum(axis=1)
+
+def _flatten(trees: list[dict]) -> dict:
+    # trees: por árvore, arrays feature/threshold/left/right/missing_left/value/is_leaf (índices locais)
+    offsets = np.cumsum([0] + [len(t["value"]) for t in trees[:-1]])
+    out = {k: [] for k in ("feature", "threshold", "left", "right", "missing_left", "value")}
+    for off, t in zip(offsets, trees):
+        idx = np.arange(len(t["value"]))
+        leaf = t["is_leaf"]
+        out["feature"].append(np.where(leaf, 0, t["feature"]).astype(np.intp))
+        out["threshold"].append(t["threshold"].astype(np.float64))
+        out["left"].append((np.where(leaf, idx, t["left"]) + off).astype(np.intp))
+        out["right"].append((np.where(leaf, idx, t["right"]) + off).astype(np.intp))
+        out["missing_left"].append(t["missing_left"].astype(bool))
+        out["value"].append(t["value"].astype(np.float64))
+    flat = {k: np.concatenate(v) for k, v in out.items()}
+    flat["roots"] = offsets.astype(np.intp)
+    return flat
+
+def compile_model(model) -> Optional[CompiledTrees]:
+    # None quando o modelo não é um ensemble de árvores suportado (ex.: linear, já barato)
+    if isinstance(model, GradientBoostingRegressor):
+        trees, depth = [], 0
+        for est in model.estimators_[:, 0]:
+            t = est.tree_
+            leaf = t.children_left == -1
+            trees.append({
+                "feature": t.feature, "threshold": t.threshold,
+                "left": t.children_left, "right": t.children_right,
+                "missing_left": getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=bool)),
+                "value": t.value[:, 0, 0], "is_leaf": leaf,
+            })
+            depth = max(depth, t.max_depth)
+        base = float(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0, 0])
+        return CompiledTrees(**_flatten(trees), depth=depth, base=base, scale=float(model.learning_rate),
+                             float32=True)
+    if isinstance(model, HistGradientBoostingRegressor):
+        trees, depth = [], 0
+        for (predictor,) in model._predictors:
+            n = predictor.nodes
+            if n["is_categorical"].any():
+                return None
+            trees.append({
+                "feature": n["feature_idx"], "threshold": n["num_threshold"],
+                "left": n["left"], "right": n["right"],
+                "missing_left": n["missing_go_to_left"], "value": n["value"], "is_leaf": n["is_leaf"].astype(bool),
+            })
+            depth = max(depth, int(n["depth"].max()))
+        base = float(np.ravel(model._baseline_prediction)[0])
+        return CompiledTrees(**_flatten(trees), depth=depth, base=base, scale=1.0, float32=False)
+    return None
@@ -0,0 +1,154 @@
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+import joblib
+
+from .registry import REGISTRY, ModelRegistry
+
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.join(os.path.dirname(__file__), "models"))
+# versões mantidas por (símbolo, intervalo) além da corrente; as mais antigas são apagadas
+MODEL_RETENTION = int(os.getenv("MODEL_RETENTION", "5"))
+MANIFEST_NAME = "manifest.json"
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+def _check_key(value: str, name: str) -> str:
+    if not _KEY_RE.match(value or ""):
+        raise ValueError(f"{name} inválido: {value!r}")
+    return value
+
+# layout: <root>/<symbol>/<interval>/<version>.pkl + manifest.json com as versões e o ponteiro "current"
+class ModelStore:
+    def __init__(self, root: str = MODELS_DIR, retention: int = MODEL_RETENTION,
+                 registry: ModelRegistry = REGISTRY) -> None:
+        self.root = root
+        self.retention = max(1, retention)
+        self.registry = registry
+        self._lock = threading.Lock()
+        # (symbol, interval) -> (chave do manifest, manifest); evita reler o JSON a cada previsão
+        self._manifests: dict[tuple[str, str], tuple[tuple[int, int], dict]] = {}
+
+    def _dir(self, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, _check_key(symbol, "symbol"), _check_key(interval, "interval"))
+
+    def _manifest_path(self, symbol: str, interval: str) -> str:
+        return os.path.join(self._dir(symbol, interval), MANIFEST_NAME)
+
+    def manifest(self, symbol: str, interval: str = "1m") -> Optional[dict]:
+        path = self._manifest_path(symbol, interval)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        entry = self._manifests.get((symbol, interval))
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._manifests[(symbol, interval)] = (key, data)
+        return data
+
+    def _write_manifest(self, symbol: str, interval: str, data: dict) -> None:
+        path = self._manifest_path(symbol, interval)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        # os.replace é atômico: leitores veem o manifest antigo ou o novo, nunca um parcial
+        os.replace(tmp_path, path)
+        self._manifests.pop((symbol, interval), None)
+
+    def save(self, symbol: str, interval: str, bundle: dict, info: Optional[dict] = None,
+             promote: bool = True) -> dict:
+        d = self._dir(symbol, interval)
+        os.makedirs(d, exist_ok=True)
+        with self._lock:
+            data = self.manifest(symbol, interval) or {
+                "symbol": symbol, "interval": interval, "current": None, "versions": [],
+            }
+            known = {v["version"] for v in data["versions"]}
+            version, n = bundle["version"], 1
+            while version in known:
+                version = f"{bundle['version']}_{n}"
+                n += 1
+            bundle = {**bundle, "version": version, "symbol": symbol, "interval": interval}
+
+            fname = f"{version}.pkl"
+            path = os.path.join(d, fname)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(bundle, tmp_path)
+            os.replace(tmp_path, path)
+
+            entry = {
+                "version": version,
+                "file": fname,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                **(info or {}),
+            }
+            data = {**data, "versions": data["versions"] + [entry]}
+            if promote:
+                data["current"] = version
+            data = self._collect(d, data)
+            self._write_manifest(symbol, interval, data)
+            if promote:
+                self.registry.publish(path, bundle)
+        return {**entry, "path": path, "current": data["current"]}
+
+    def promote(self, symbol: str, interval: str, version: str) -> dict:
+        with self._lock:
+            data = self.manifest(symbol, interval)
+            if data is None or all(v["version"] != version for v in data["versions"]):
+                raise RuntimeError(f"Versão {version} não encontrada para {symbol}/{interval}.")
+            data = {**data, "current": version}
+            self._write_manifest(symbol, interval, data)
+        return data
+
+    def _collect(self, d: str, data: dict) -> dict:
+        versions = data["versions"]
+        keep = versions[-self.retention:]
+        if data["current"] is not None and all(v["version"] != data["current"] for v in keep):
+            keep = [v for v in versions if v["version"] == data["current"]] + keep
+        for v in versions:
+            if v in keep:
+                continue
+            path = os.path.join(d, v["file"])
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.registry.invalidate(path)
+        return {**data, "versions": keep}
+
+    def current_path(self, symbol: str, interval: str = "1m") -> str:
+        data = self.manifest(symbol, interval)
+        if data is None or data.get("current") is None:
+            raise RuntimeError(f"Modelo não encontrado para {symbol}/{interval}. Treine primeiro (/train).")
+        entry = next(v for v in data["versions"] if v["version"] == data["current"])
+        return os.path.join(self._dir(symbol, interval), entry["file"])
+
+    def load(self, symbol: str, interval: str = "1m") -> dict:
+        return self.registry.get(self.current_path(symbol, interval))
+
+    def list(self) -> list[dict]:
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for symbol in sorted(os.listdir(self.root)):
+            sym_dir = os.path.join(self.root, symbol)
+            if not os.path.isdir(sym_dir) or not _KEY_RE.match(symbol):
+                continue
+            for interval in sorted(os.listdir(sym_dir)):
+                if not _KEY_RE.match(interval):
+                    continue
+                data = self.manifest(symbol, interval)
+                if data is not None:
+                    out.append(data)
+        return out
+
+
+MODEL_STORE = ModelStore()
@@ -1,49 +1,124 @@
 from __future__ import annotations
-import os
+import threading
 from datetime import datetime, timezone
-import joblib
+import numpy as np
 import pandas as pd
 from sqlalchemy.orm import Session
 
-from .db import Price
-from .features import build_features
-from .train import MODEL_PATH
+from .feature_state import FEATURE_STATES, IncrementalFeatures
+from .feature_store import FEATURE_STORE
+from .features import FEATURES, interval_delta
+from .loader import load_prices, load_prices_for_symbols
+from .model_backends import PREDICT_COMPILED, CompiledTrees
+from .model_store import MODEL_STORE
+from .predlog import PREDICTION_LOG
+from .runtime_metrics import stage
 
 def _load_latest_df(db: Session, symbol: str, limit: int = 5000) -> pd.DataFrame:
-    rows = (
-        db.query(Price)
-        .filter(Price.symbol == symbol)
-        .order_by(Price.ts.desc())
-        .limit(limit)
-        .all()
-    )
-    if not rows:
+    with stage("db_query"):
+        df = load_prices(db, symbol, ("ts", "close"), limit=limit)
+    if df.empty:
         raise RuntimeError("Sem dados no banco. Rode ingestão.")
-    rows = list(reversed(rows))
-    df = pd.DataFrame([{"ts": r.ts, "close": float(r.close)} for r in rows])
     return df
 
-def _load_model():
-    if not os.path.exists(MODEL_PATH):
-        raise RuntimeError("Modelo não encontrado. Treine primeiro (/train).")
-    bundle = joblib.load(MODEL_PATH)
-    return bundle["model"], bundle.get("version", "unknown")
+def _load_newer_rows(db: Session, symbol: str, since: datetime) -> list[tuple[datetime, float]]:
+    with stage("db_query"):
+        df = load_prices(db, symbol, ("ts", "close"), since=since)
+    return list(zip(df["ts"], df["close"]))
 
-def predict_next(db: Session, symbol: str = "BTCUSDT") -> dict:
-    model, version = _load_model()
+def _seed_state(db: Session, symbol: str, state: IncrementalFeatures) -> None:
+    # estado frio: parte das features materializadas; sem elas, reprocessa a janela do banco
+    stored = FEATURE_STORE.state(symbol)
+    if stored is not None:
+        state.closes, state.ema_5, state.ema_15 = stored.closes, stored.ema_5, stored.ema_15
+        state.last_ts, state.count = stored.last_ts, stored.count
+        rows = _load_newer_rows(db, symbol, state.last_ts)
+        with stage("feature_build"):
+            state.extend(rows)
+        return
     df = _load_latest_df(db, symbol)
-    X, y = build_features(df)
-    if len(X) == 0:
+    with stage("feature_build"):
+        state.extend(zip(df["ts"], df["close"]))
+
+def _sync_state(db: Session, symbol: str) -> IncrementalFeatures:
+    state, _ = FEATURE_STATES.get_or_create(symbol)
+    with state.lock:
+        if state.count == 0:
+            _seed_state(db, symbol, state)
+        else:
+            rows = _load_newer_rows(db, symbol, state.last_ts)
+            with stage("feature_build"):
+                state.extend(rows)
+    return state
+
+def _sync_states(db: Session, symbols: list[str]) -> tuple[dict[str, IncrementalFeatures], dict[str, str]]:
+    states: dict[str, IncrementalFeatures] = {}
+    errors: dict[str, str] = {}
+    warm: list[str] = []
+    for sym in symbols:
+        state, _ = FEATURE_STATES.get_or_create(sym)
+        if state.count == 0:
+            try:
+                _sync_state(db, sym)
+            except Exception as e:
+                errors[sym] = str(e)
+                continue
+        else:
+            warm.append(sym)
+        states[sym] = state
+
+    # símbolos já aquecidos: uma única consulta traz os candles novos de todos
+    if warm:
+        since = min(states[sym].last_ts for sym in warm)
+        with stage("db_query"):
+            df = load_prices_for_symbols(db, warm, since)
+        with stage("feature_build"):
+            for sym, g in df.groupby("symbol", sort=False):
+                state = states[sym]
+                with state.lock:
+                    state.extend(zip(g["ts"], g["close"]))
+    return states, errors
+
+# última previsão por (símbolo, intervalo): sem candle novo e sem modelo novo, a resposta é a mesma
+_MEMO: dict[tuple[str, str], tuple[tuple, dict]] = {}
+_MEMO_LOCK = threading.Lock()
+
+def _load_model(symbol: str, interval: str = "1m"):
+    with stage("model_load"):
+        bundle = MODEL_STORE.load(symbol, interval)
+    # bundles antigos (ou backend linear) não têm a versão compilada: cai no estimador do sklearn
+    compiled = bundle.get("compiled") if PREDICT_COMPILED else None
+    return compiled or bundle["model"], bundle.get("version", "unknown")
+
+def _model_input(model, rows: list[list[float]]):
+    # árvores compiladas recebem a matriz direto; o sklearn espera os nomes das features
+    X = np.asarray(rows, dtype=np.float64)
+    if isinstance(model, CompiledTrees):
+        return X
+    return pd.DataFrame(X, columns=FEATURES)
+
+def predict_next(db: Session, symbol: str = "BTCUSDT", interval: str = "1m") -> dict:
+    model, version = _load_model(symbol, interval)
+    state = _sync_state(db, symbol)
+    with state.lock:
+        x = state.vector()
+        last_close = state.last_close
+        last_ts = state.last_ts.astimezone(timezone.utc)
+    if x is None:
         raise RuntimeError("Sem features para prever. Treine novamente.")
 
-    last_close = float(df["close"].iloc[-1])
-    last_ts = df["ts"].iloc[-1].astimezone(timezone.utc)
+    key = (version, id(model), last_ts)
+    memo = _MEMO.get((symbol, interval))
+    if memo is not None and memo[0] == key:
+        return dict(memo[1])
 
-    yhat = float(model.predict(X.iloc[[-1]])[0])
+    X = _model_input(model, [x])
+    with stage("inference"):
+        yhat = float(model.predict(X)[0])
     delta = yhat - last_close
     delta_pct = delta / last_close if last_close != 0 else 0.0
 
-    return {
+    result = {
         "symbol": symbol,
         "predicted_next_close": yhat,
         "last_close": last_close,
@@ -53,3 +128,75 @@ def predict_next(db: Session, symbol: str = "BTCUSDT") -> dict:
         "last_ts": last_ts.isoformat(),
         "predicted_at": datetime.now(timezone.utc).isoformat(),
     }
+    with _MEMO_LOCK:
+        _MEMO[(symbol, interval)] = (key, result)
+    # só no cálculo: respostas do memo são a mesma previsão e não vão de novo para o log
+    PREDICTION_LOG.record(symbol, interval, version, last_ts, yhat, last_close)
+    return result
+
+def predict_batch(db: Session, symbols: list[str], horizon: int = 1, interval: str = "1m") -> dict:
+    symbols = list(dict.fromkeys(s.strip() for s in symbols if s.strip()))
+    models: dict[str, tuple] = {}
+    errors: dict[str, str] = {}
+    for sym in symbols:
+        try:
+            models[sym] = _load_model(sym, interval)
+        except Exception as e:
+            errors[sym] = str(e)
+    states, sync_errors = _sync_states(db, list(models))
+    errors.update(sync_errors)
+
+    snaps: dict[str, IncrementalFeatures] = {}
+    for sym, state in states.items():
+        with state.lock:
+            if not state.ready:
+                errors[sym] = "Sem features para prever. Treine novamente."
+                continue
+            snaps[sym] = state.copy()
+
+    order = list(snaps)
+    # símbolos que compartilham o mesmo artefato (mesmo objeto em cache) vão numa única chamada
+    groups: dict[int, list[str]] = {}
+    for sym in order:
+        groups.setdefault(id(models[sym][0]), []).append(sym)
+    base = {sym: (snaps[sym].last_close, snaps[sym].last_ts.astimezone(timezone.utc)) for sym in order}
+    forecasts: dict[str, list[dict]] = {sym: [] for sym in order}
+    step = interval_delta(interval)
+
+    # previsão recursiva: a cada passo, uma chamada por modelo com a matriz dos seus símbolos
+    for h in range(1, horizon + 1):
+        for group in groups.values():
+            model = models[group[0]][0]
+            X = _model_input(model, [snaps[sym].vector() for sym in group])
+            with stage("inference"):
+                yhat = model.predict(X)
+            for sym, y in zip(group, yhat):
+                snap = snaps[sym]
+                ts = snap.last_ts + step
+                forecasts[sym].append({"step": h, "ts": ts.astimezone(timezone.utc).isoformat(), "predicted_close": float(y)})
+                snap.update(ts, float(y))
+
+    items = []
+    for sym in order:
+        last_close, last_ts = base[sym]
+        yhat = forecasts[sym][0]["predicted_close"]
+        PREDICTION_LOG.record(sym, interval, models[sym][1], last_ts, yhat, last_close)
+        delta = yhat - last_close
+        items.append({
+            "symbol": sym,
+            "predicted_next_close": yhat,
+            "last_close": last_close,
+            "delta": delta,
+            "delta_pct": delta / last_close if last_close != 0 else 0.0,
+            "model_version": models[sym][1],
+            "last_ts": last_ts.isoformat(),
+            "forecast": forecasts[sym],
+        })
+
+    return {
+        "horizon": horizon,
+        "interval": interval,
+        "items": items,
+        "errors": errors,
+        "predicted_at": datetime.now(timezone.utc).isoformat(),
+    }
@@ -0,0 +1,325 @@
+from __future__ import annotations
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .db import Price, Prediction
+from .response_cache import interval_seconds
+from .runtime_metrics import RUNTIME_METRICS, Counter, Gauge, stage
+
+PREDLOG_ENABLED = os.getenv("PREDLOG_ENABLED", "1") == "1"
+# previsões acumuladas em memória até um INSERT em lote; o flush também roda a cada PREDLOG_FLUSH_SECONDS
+PREDLOG_BATCH_SIZE = int(os.getenv("PREDLOG_BATCH_SIZE", "500"))
+PREDLOG_FLUSH_SECONDS = float(os.getenv("PREDLOG_FLUSH_SECONDS", "5"))
+# teto do buffer com o banco fora do ar: as previsões mais antigas são descartadas (predlog_dropped)
+PREDLOG_MAX_BUFFER = int(os.getenv("PREDLOG_MAX_BUFFER", "50000"))
+# janela efetiva, em previsões, do MAE/RMSE online (média exponencial, alpha = 2 / (span + 1))
+PREDLOG_EWM_SPAN = int(os.getenv("PREDLOG_EWM_SPAN", "500"))
+# séries (símbolo, intervalo, versão) acompanhadas em memória; as sem previsão resolvida há mais tempo saem
+PREDLOG_MAX_SERIES = int(os.getenv("PREDLOG_MAX_SERIES", "512"))
+
+# versão "*": todas as versões do símbolo juntas
+ALL_VERSIONS = "*"
+
+PREDLOG_WRITTEN = RUNTIME_METRICS.register(Counter(
+    "predlog_written", "Previsões gravadas no log (prediction_log).",
+))
+PREDLOG_DROPPED = RUNTIME_METRICS.register(Counter(
+    "predlog_dropped", "Previsões descartadas com o buffer do log cheio.",
+))
+PREDLOG_RESOLVED = RUNTIME_METRICS.register(Counter(
+    "predlog_resolved", "Previsões ligadas ao fechamento realizado, por símbolo.", ("symbol",),
+))
+ONLINE_MAE = RUNTIME_METRICS.register(Gauge(
+    "online_mae", "MAE online (média exponencial) das previsões resolvidas, por símbolo.", ("symbol",),
+))
+ONLINE_RMSE = RUNTIME_METRICS.register(Gauge(
+    "online_rmse", "RMSE online (média exponencial) das previsões resolvidas, por símbolo.", ("symbol",),
+))
+
+logger = logging.getLogger(__name__)
+
+def _session() -> Session:
+    from .db import SessionLocal
+    return SessionLocal()
+
+def _utc(ts: datetime) -> datetime:
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+class ErrorStats:
+    # memória constante por série: médias exponenciais (janela móvel) e totais desde o início do processo
+    __slots__ = ("alpha", "n", "ewm_abs", "ewm_sq", "ewm_naive_abs", "sum_abs", "sum_sq", "sum_naive_abs", "last_ts")
+
+    def __init__(self, alpha: float) -> None:
+        self.alpha = alpha
+        self.n = 0
+        self.ewm_abs = self.ewm_sq = self.ewm_naive_abs = 0.0
+        self.sum_abs = self.sum_sq = self.sum_naive_abs = 0.0
+        self.last_ts: Optional[datetime] = None
+
+    def update(self, err: float, naive_err: float, ts: datetime) -> None:
+        a, sq, na = abs(err), err * err, abs(naive_err)
+        if self.n == 0:
+            self.ewm_abs, self.ewm_sq, self.ewm_naive_abs = a, sq, na
+        else:
+            self.ewm_abs += self.alpha * (a - self.ewm_abs)
+            self.ewm_sq += self.alpha * (sq - self.ewm_sq)
+            self.ewm_naive_abs += self.alpha * (na - self.ewm_naive_abs)
+        self.n += 1
+        self.sum_abs += a
+        self.sum_sq += sq
+        self.sum_naive_abs += na
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+
+    def snapshot(self) -> dict:
+        return {
+            "n": self.n,
+            "mae": self.ewm_abs,
+            "rmse": math.sqrt(self.ewm_sq),
+            # baseline ingênuo: próximo fechamento = fechamento atual
+            "naive_mae": self.ewm_naive_abs,
+            "skill": 1.0 - self.ewm_abs / self.ewm_naive_abs if self.ewm_naive_abs else None,
+            "mae_total": self.sum_abs / self.n if self.n else None,
+            "rmse_total": math.sqrt(self.sum_sq / self.n) if self.n else None,
+            "last_ts": self.last_ts.isoformat() if self.last_ts else None,
+        }
+
+class OnlineErrors:
+    def __init__(self, span: int = PREDLOG_EWM_SPAN, max_series: int = PREDLOG_MAX_SERIES) -> None:
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.max_series = max(1, max_series)
+        self._lock = threading.Lock()
+        self._series: OrderedDict[tuple[str, str, str], ErrorStats] = OrderedDict()
+
+    def _get(self, key: tuple[str, str, str]) -> ErrorStats:
+        stats = self._series.get(key)
+        if stats is None:
+            stats = self._series[key] = ErrorStats(self.alpha)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        self._series.move_to_end(key)
+        return stats
+
+    def observe(self, symbol: str, interval: str, version: str, predicted: float, actual: float,
+                last_close: float, ts: datetime) -> None:
+        err, naive_err = predicted - actual, last_close - actual
+        with self._lock:
+            for v in (version, ALL_VERSIONS):
+                self._get((symbol, interval, v)).update(err, naive_err, ts)
+            overall = self._series[(symbol, interval, ALL_VERSIONS)]
+            mae, rmse = overall.ewm_abs, math.sqrt(overall.ewm_sq)
+        ONLINE_MAE.set(symbol, value=mae)
+        ONLINE_RMSE.set(symbol, value=rmse)
+
+    def get(self, symbol: str, interval: str, version: str = ALL_VERSIONS) -> Optional[dict]:
+        with self._lock:
+            stats = self._series.get((symbol, interval, version))
+            return stats.snapshot() if stats is not None else None
+
+    def snapshot(self, symbol: Optional[str] = None, interval: Optional[str] = None) -> list[dict]:
+        with self._lock:
+            items = [(k, s.snapshot()) for k, s in self._series.items()
+                     if (symbol is None or k[0] == symbol) and (interval is None or k[1] == interval)]
+        return [{"symbol": sym, "interval": itv, "model_version": v, **snap}
+                for (sym, itv, v), snap in sorted(items)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+ONLINE_ERRORS = OnlineErrors()
+
+# log append-only das previsões: record() só acumula em memória; flush() grava o lote num único INSERT
+# (thread própria a cada PREDLOG_FLUSH_SECONDS ou ao juntar PREDLOG_BATCH_SIZE) e resolve(), chamado na
+# gravação de candles, liga cada previsão ao fechamento realizado e alimenta o erro online
+class PredictionLog:
+    def __init__(self, session_factory: Callable[[], Session] = _session, batch_size: int = PREDLOG_BATCH_SIZE,
+                 flush_seconds: float = PREDLOG_FLUSH_SECONDS, max_buffer: int = PREDLOG_MAX_BUFFER,
+                 errors: OnlineErrors = ONLINE_ERRORS, enabled: bool = PREDLOG_ENABLED) -> None:
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max(1, max_buffer)
+        self.errors = errors
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # serializa flush e resolve: o UPDATE de resolve() sempre enxerga os lotes já retirados do buffer
+        self._flush_lock = threading.Lock()
+        self._buffer: list[dict] = []
+        # última previsão registrada por série: a mesma previsão servida de novo (memo, batch) não duplica
+        self._last: OrderedDict[tuple[str, str, str], datetime] = OrderedDict()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.written = 0
+        self.resolved = 0
+        self.last_error: Optional[str] = None
+
+    def record(self, symbol: str, interval: str, version: str, base_ts: datetime, predicted: float,
+               last_close: float) -> bool:
+        if not self.enabled:
+            return False
+        base_ts = _utc(base_ts)
+        key = (symbol, interval, version)
+        with self._lock:
+            if self._last.get(key) == base_ts:
+                return False
+            self._last[key] = base_ts
+            self._last.move_to_end(key)
+            if len(self._last) > PREDLOG_MAX_SERIES:
+                self._last.popitem(last=False)
+            self._buffer.append({
+                "symbol": symbol, "interval": interval, "model_version": version,
+                "base_ts": base_ts, "target_ts": base_ts + timedelta(seconds=interval_seconds(interval)),
+                "predicted": float(predicted), "last_close": float(last_close),
+                "predicted_at": datetime.now(timezone.utc),
+            })
+            dropped = self._trim()
+            full = len(self._buffer) >= self.batch_size
+        if dropped:
+            PREDLOG_DROPPED.inc(amount=dropped)
+        if full:
+            self._wake.set()
+        return True
+
+    def _trim(self) -> int:
+        # chamado com self._lock
+        excess = len(self._buffer) - self.max_buffer
+        if excess > 0:
+            del self._buffer[:excess]
+        return max(0, excess)
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def flush(self, db: Optional[Session] = None) -> int:
+        with self._flush_lock:
+            return self._flush(db)
+
+    def _flush(self, db: Optional[Session]) -> int:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        own = db is None
+        db = db or self.session_factory()
+        try:
+            t = Prediction.__table__
+            insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else pg_insert
+            with stage("predlog_flush"):
+                # o SQLite limita as variáveis por comando: chunks de batch_size linhas cabem folgados
+                for i in range(0, len(rows), self.batch_size):
+                    stmt = insert(t).values(rows[i:i + self.batch_size])
+                    db.execute(stmt.on_conflict_do_nothing(
+                        index_elements=["symbol", "interval", "model_version", "base_ts"]))
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            self.last_error = repr(e)
+            # volta para o buffer (na frente das que chegaram enquanto isso) e tenta no próximo flush
+            with self._lock:
+                self._buffer = rows + self._buffer
+                dropped = self._trim()
+            if dropped:
+                PREDLOG_DROPPED.inc(amount=dropped)
+            raise
+        finally:
+            if own:
+                db.close()
+        self.flushes += 1
+        self.written += len(rows)
+        PREDLOG_WRITTEN.inc(amount=len(rows))
+        return len(rows)
+
+    def resolve(self, db: Session, rows: list[dict], inserted: dict[str, int]) -> int:
+        # chamada após gravar candles: um UPDATE ... FROM prices por símbolo, limitado aos ts gravados
+        bounds: dict[str, list[datetime]] = {}
+        for r in rows:
+            if not inserted.get(r["symbol"]):
+                continue
+            b = bounds.setdefault(r["symbol"], [r["ts"], r["ts"]])
+            b[0], b[1] = min(b[0], r["ts"]), max(b[1], r["ts"])
+        if not bounds:
+            return 0
+        p, pr = Prediction.__table__, Price.__table__
+        now = datetime.now(timezone.utc)
+        resolved = []
+        with self._flush_lock:
+            self._flush(db)
+            try:
+                with stage("predlog_resolve"):
+                    for sym, (lo, hi) in sorted(bounds.items()):
+                        stmt = (
+                            update(p)
+                            .values(actual=pr.c.close, resolved_at=now)
+                            .where(p.c.symbol == sym, p.c.target_ts >= lo, p.c.target_ts <= hi,
+                                   p.c.actual.is_(None), pr.c.symbol == p.c.symbol, pr.c.ts == p.c.target_ts)
+                            .returning(p.c.symbol, p.c.interval, p.c.model_version, p.c.predicted, p.c.actual,
+                                       p.c.last_close, p.c.target_ts)
+                        )
+                        resolved.extend(db.execute(stmt).all())
+                    db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        # em ordem de candle: a média exponencial pondera os mais recentes
+        for sym, interval, version, predicted, actual, last_close, ts in sorted(resolved, key=lambda r: r[6]):
+            self.errors.observe(sym, interval, version, predicted, actual, last_close, _utc(ts))
+            PREDLOG_RESOLVED.inc(sym)
+        self.resolved += len(resolved)
+        return len(resolved)
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="predlog", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("falha ao gravar o log de previsões")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        # no desligamento: grava o que ainda está no buffer
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("falha ao gravar o log de previsões")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None,
+            "pending": len(self._buffer),
+            "flushes": self.flushes,
+            "written": self.written,
+            "resolved": self.resolved,
+            "last_error": self.last_error,
+        }
+
+
+PREDICTION_LOG = PredictionLog()
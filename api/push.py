@@ -0,0 +1,209 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from .loader import load_prices_table
+from .runtime_metrics import RUNTIME_METRICS, Counter, Gauge
+
+# eventos pendentes por conexão; cliente que não acompanha é desligado com `resync` (reconecta e
+# recebe um snapshot novo) em vez de acumular memória no servidor
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "256"))
+# comentário SSE enviado sem eventos por este tempo: mantém proxies e o cliente sabendo que a conexão vive
+PUSH_HEARTBEAT_SECONDS = float(os.getenv("PUSH_HEARTBEAT_SECONDS", "15"))
+
+PUSH_EVENTS = RUNTIME_METRICS.register(Counter(
+    "push_events", "Eventos publicados no feed de preços, por tipo (candles, prediction).", ("event",),
+))
+PUSH_DROPPED = RUNTIME_METRICS.register(Counter(
+    "push_dropped", "Conexões do feed desligadas por fila cheia (cliente lento).",
+))
+PUSH_SUBSCRIBERS = RUNTIME_METRICS.register(Gauge(
+    "push_subscribers", "Conexões abertas no feed de preços, por símbolo.", ("symbol",),
+))
+
+def sse_event(event: str, data: dict, event_id: Optional[str] = None) -> bytes:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode()
+
+def _ts(value: datetime) -> str:
+    return value.isoformat()
+
+class Subscriber:
+    __slots__ = ("symbol", "loop", "queue", "overflowed")
+
+    def __init__(self, symbol: str, loop: asyncio.AbstractEventLoop, queue_size: int) -> None:
+        self.symbol = symbol
+        self.loop = loop
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, payload: bytes) -> None:
+        # roda no event loop da conexão
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # fila cheia: o gerador vê `overflowed` no próximo evento e encerra com `resync`
+            self.overflowed = True
+            PUSH_DROPPED.inc()
+
+class PriceFeed:
+    # fan-out por símbolo: cada evento é montado e serializado uma vez, na thread da gravação, e o mesmo
+    # payload vai para todas as conexões; o custo cresce com a taxa de candles, não com o número de telas
+    def __init__(self, queue_size: int = PUSH_QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subs: dict[str, set[Subscriber]] = defaultdict(set)
+        # última previsão por símbolo: vai junto do snapshot para quem conecta depois dela
+        self._last_prediction: dict[str, bytes] = {}
+        self._last_ts: dict[str, datetime] = {}
+
+    def subscribe(self, symbol: str) -> Subscriber:
+        # chamado de dentro do event loop que vai consumir a fila
+        sub = Subscriber(symbol, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subs[symbol].add(sub)
+            PUSH_SUBSCRIBERS.set(symbol, value=len(self._subs[symbol]))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.symbol)
+            if subs is None:
+                return
+            subs.discard(sub)
+            PUSH_SUBSCRIBERS.set(sub.symbol, value=len(subs))
+            if not subs:
+                del self._subs[sub.symbol]
+
+    def has_subscribers(self, symbol: str) -> bool:
+        with self._lock:
+            return bool(self._subs.get(symbol))
+
+    def last_prediction(self, symbol: str) -> Optional[bytes]:
+        with self._lock:
+            return self._last_prediction.get(symbol)
+
+    def last_ts(self, symbol: str) -> Optional[datetime]:
+        with self._lock:
+            return self._last_ts.get(symbol)
+
+    def publish(self, symbol: str, event: str, data: dict, event_id: Optional[str] = None) -> int:
+        # seguro a partir de qualquer thread; devolve quantas conexões receberam
+        payload = sse_event(event, data, event_id)
+        with self._lock:
+            if event == "prediction":
+                self._last_prediction[symbol] = payload
+            subs = list(self._subs.get(symbol, ()))
+        PUSH_EVENTS.inc(event)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, payload)
+            except RuntimeError:
+                # loop já encerrado (conexão morta sem unsubscribe)
+                self.unsubscribe(sub)
+        return len(subs)
+
+    def publish_candles(self, rows: list[dict]) -> list[str]:
+        # rows: candles recém-gravados (symbol, ts, close, ...); devolve os símbolos com assinantes
+        by_symbol: dict[str, list[dict]] = defaultdict(list)
+        for r in rows:
+            by_symbol[r["symbol"]].append(r)
+        published = []
+        for sym, sym_rows in sorted(by_symbol.items()):
+            sym_rows.sort(key=lambda r: r["ts"])
+            with self._lock:
+                last = self._last_ts.get(sym)
+                if last is None or sym_rows[-1]["ts"] > last:
+                    self._last_ts[sym] = sym_rows[-1]["ts"]
+            if not self.has_subscribers(sym):
+                continue
+            data = [{"ts": _ts(r["ts"]), "close": float(r["close"])} for r in sym_rows]
+            self.publish(sym, "candles", {"symbol": sym, "data": data}, event_id=data[-1]["ts"])
+            published.append(sym)
+        return published
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_size": self.queue_size,
+                "subscribers": {s: len(subs) for s, subs in self._subs.items()},
+            }
+
+
+PRICE_FEED = PriceFeed()
+
+def push_updates(rows: list[dict], interval: str, predict: Callable[[Session, str, str], dict],
+                 session_factory: Callable[[], Session], feed: PriceFeed = PRICE_FEED) -> None:
+    # candles novos para quem está conectado e uma previsão por símbolo e candle (memoizada no predict),
+    # calculada uma vez aqui e não por tela; símbolo sem conexões não custa nada
+    symbols = feed.publish_candles(rows)
+    if not symbols:
+        return
+    with session_factory() as db:
+        _publish_predictions(db, symbols, interval, predict, feed)
+
+def push_from_db(db: Session, inserted_by_symbol: dict[str, int], interval: str,
+                 predict: Callable[[Session, str, str], dict], feed: PriceFeed = PRICE_FEED) -> None:
+    # ingestão por polling/manual: lê só os candles novos dos símbolos com conexões abertas
+    rows: list[dict] = []
+    for sym, n in inserted_by_symbol.items():
+        if not n or not feed.has_subscribers(sym):
+            continue
+        table = load_prices_table(db, sym, ("ts", "close"), limit=n, since=feed.last_ts(sym))
+        rows.extend({"symbol": sym, "ts": ts, "close": c}
+                    for ts, c in zip(table.column("ts").to_pylist(), table.column("close").to_pylist()))
+    if rows:
+        _publish_predictions(db, feed.publish_candles(rows), interval, predict, feed)
+
+def _publish_predictions(db: Session, symbols: list[str], interval: str,
+                         predict: Callable[[Session, str, str], dict], feed: PriceFeed) -> None:
+    for sym in symbols:
+        try:
+            res = predict(db, sym, interval)
+        except Exception:
+            # sem modelo treinado ainda: só os candles seguem
+            continue
+        feed.publish(sym, "prediction", res, event_id=res.get("last_ts"))
+
+async def sse_stream(
+    feed: PriceFeed,
+    sub: Subscriber,
+    snapshot: bytes,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    heartbeat: float = PUSH_HEARTBEAT_SECONDS,
+) -> AsyncIterator[bytes]:
+    # snapshot primeiro (mesmo corpo de /prices/latest), depois só incrementos; o cliente descarta
+    # candles com ts já presente no buffer (a inscrição acontece antes do snapshot para não perder nada)
+    try:
+        body = json.loads(snapshot)
+        data = body.get("data") or []
+        yield sse_event("snapshot", body, event_id=data[-1]["ts"] if data else None)
+        last = feed.last_prediction(sub.symbol)
+        if last is not None:
+            yield last
+        while True:
+            try:
+                payload = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield b": ping\n\n"
+                continue
+            if sub.overflowed:
+                yield sse_event("resync", {"symbol": sub.symbol})
+                break
+            yield payload
+    finally:
+        feed.unsubscribe(sub)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Optional
+
+import joblib
+
+
+class ModelRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # path -> (chave do arquivo, bundle); a tupla é trocada inteira, nunca mutada
+        self._entries: dict[str, tuple[tuple[int, int], dict]] = {}
+        self.hits = 0
+        self.loads = 0
+        self.last_load_seconds: Optional[float] = None
+        self.total_load_seconds = 0.0
+
+    @staticmethod
+    def _file_key(path: str) -> tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path: str) -> dict:
+        try:
+            key = self._file_key(path)
+        except FileNotFoundError:
+            raise RuntimeError("Modelo não encontrado. Treine primeiro (/train).")
+
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            t0 = time.perf_counter()
+            bundle = joblib.load(path)
+            elapsed = time.perf_counter() - t0
+            self._entries[path] = (key, bundle)
+            self.loads += 1
+            self.last_load_seconds = elapsed
+            self.total_load_seconds += elapsed
+            return bundle
+
+    def publish(self, path: str, bundle: dict) -> None:
+        # chamado pelo treino logo após gravar o artefato: evita recarregar o que já está em memória
+        with self._lock:
+            self._entries[path] = (self._file_key(path), bundle)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def stats(self) -> dict:
+        return {
+            "cached": sorted(self._entries),
+            "hits": self.hits,
+            "loads": self.loads,
+            "last_load_seconds": self.last_load_seconds,
+            "total_load_seconds": self.total_load_seconds,
+        }
+
+
+REGISTRY = ModelRegistry()
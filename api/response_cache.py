@@ -0,0 +1,112 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from .features import interval_delta
+
+PRICES_CACHE_SIZE = int(os.getenv("PRICES_CACHE_SIZE", "256"))
+PRICES_CACHE_INTERVAL = os.getenv("INGEST_INTERVAL", "1m")
+
+def interval_seconds(interval: str) -> int:
+    return int(interval_delta(interval).total_seconds())
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "expires_at")
+
+    def __init__(self, body: bytes, expires_at: float) -> None:
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.expires_at = expires_at
+
+# LRU por chave (símbolo primeiro); entradas expiram no fechamento do próximo candle
+# ou antes, quando a ingestão grava candles novos do símbolo
+class ResponseCache:
+    def __init__(self, maxsize: int = PRICES_CACHE_SIZE, interval: str = PRICES_CACHE_INTERVAL,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.maxsize = maxsize
+        self.period = interval_seconds(interval)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        # geração por símbolo: resposta montada antes de uma invalidação não entra no cache
+        self._gens: dict[Hashable, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _expiry(self, now: float) -> float:
+        return (now // self.period + 1) * self.period
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, symbol: Hashable) -> tuple[int, int]:
+        return self._epoch, self._gens.get(symbol, 0)
+
+    def put(self, key: tuple, body: bytes, generation: Optional[tuple[int, int]] = None) -> CachedResponse:
+        entry = CachedResponse(body, self._expiry(self.clock()))
+        with self._lock:
+            if generation is not None and generation != self.generation(key[0]):
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_or_build(self, key: tuple, build: Callable[[], bytes]) -> CachedResponse:
+        entry = self.get(key)
+        if entry is None:
+            gen = self.generation(key[0])
+            entry = self.put(key, build(), gen)
+        return entry
+
+    async def get_or_build_async(self, key: tuple, build: Callable[[], Awaitable[bytes]]) -> CachedResponse:
+        entry = self.get(key)
+        if entry is None:
+            gen = self.generation(key[0])
+            entry = self.put(key, await build(), gen)
+        return entry
+
+    def invalidate(self, symbol: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if symbol is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._gens[symbol] = self._gens.get(symbol, 0) + 1
+                keys = [k for k in self._entries if k[0] == symbol]
+                dropped = len(keys)
+                for k in keys:
+                    del self._entries[k]
+            self.invalidations += dropped
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None,
+            "invalidations": self.invalidations,
+        }
+
+
+PRICES_CACHE = ResponseCache()
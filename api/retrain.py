@@ -0,0 +1,155 @@
+from __future__ import annotations
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy.orm import Session
+
+from .feature_store import FeatureStore
+from .features import FEATURES, build_features_long
+from .loader import PriceSource
+from .model_backends import MODEL_BACKEND, make_model, warm_start_copy
+from .model_store import MODEL_STORE, ModelStore
+from .predlog import ONLINE_ERRORS
+from .runtime_metrics import RUNTIME_METRICS, TRAIN_FAILURES, Counter, stage
+from .train import (RETRAIN_MAX_WORKERS, TRAIN_LIMIT, _default_features, _load_training_table, _to_ipc,
+                    fit_payloads)
+
+# candles novos (posteriores ao fim do treino do modelo corrente) que bastam para retreinar
+RETRAIN_MIN_NEW_ROWS = int(os.getenv("RETRAIN_MIN_NEW_ROWS", "360"))
+# drift: MAE do modelo corrente nos candles novos acima de RETRAIN_DRIFT_RATIO x o MAE de validação
+# do treino; só avaliado a partir de RETRAIN_DRIFT_MIN_ROWS candles novos (menos que isso é ruído)
+RETRAIN_DRIFT_RATIO = float(os.getenv("RETRAIN_DRIFT_RATIO", "1.5"))
+RETRAIN_DRIFT_MIN_ROWS = int(os.getenv("RETRAIN_DRIFT_MIN_ROWS", "60"))
+# árvores acrescentadas ao ensemble corrente em cada retreino incremental (só gbr)
+RETRAIN_WARM_ESTIMATORS = int(os.getenv("RETRAIN_WARM_ESTIMATORS", "20"))
+# depois de tantos retreinos incrementais seguidos, refaz do zero: o ensemble não cresce sem limite
+RETRAIN_FULL_EVERY = int(os.getenv("RETRAIN_FULL_EVERY", "10"))
+
+RETRAIN_DECISIONS = RUNTIME_METRICS.register(Counter(
+    "retrain_decisions", "Decisões do retreino por símbolo (skip, warm, full).", ("symbol", "action"),
+))
+
+def _training_frame(db: Optional[Session], source: Optional[PriceSource], symbol: str, limit: int,
+                    features: Optional[FeatureStore]) -> pd.DataFrame:
+    # sempre com features e y: a mesma tabela serve para medir o drift e para o fit
+    df = _load_training_table(db, source, symbol, limit, features).to_pandas()
+    if not df.empty and "y" not in df.columns:
+        with stage("feature_build"):
+            df = build_features_long(df[["ts", "close"]].assign(symbol=0)).drop(columns="symbol")
+    if not df.empty:
+        df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    return df
+
+def _current_entry(store: ModelStore, symbol: str, interval: str) -> Optional[dict]:
+    data = store.manifest(symbol, interval)
+    if data is None or data.get("current") is None:
+        return None
+    return next((v for v in data["versions"] if v["version"] == data["current"]), None)
+
+def plan_symbol(store: ModelStore, symbol: str, interval: str, df: pd.DataFrame, backend: str,
+                min_new_rows: int = RETRAIN_MIN_NEW_ROWS, drift_ratio: float = RETRAIN_DRIFT_RATIO,
+                drift_min_rows: int = RETRAIN_DRIFT_MIN_ROWS, full_every: int = RETRAIN_FULL_EVERY,
+                warm_estimators: int = RETRAIN_WARM_ESTIMATORS) -> tuple[dict, object]:
+    # decide o que fazer com o símbolo: (decisão, modelo base do warm start ou None)
+    decision = {"symbol": symbol, "action": "full", "reason": "no_model", "new_rows": None,
+                "live_mae": None, "live_source": None, "model_mae": None, "version": None}
+    entry = _current_entry(store, symbol, interval)
+    if entry is None or "train_end_ts" not in entry:
+        return decision, None
+
+    decision.update(version=entry["version"], model_mae=entry.get("mae"))
+    train_end = pd.Timestamp(entry["train_end_ts"])
+    train_end = train_end.tz_localize("UTC") if train_end.tzinfo is None else train_end
+    new = df[df["ts"] > train_end]
+    decision["new_rows"] = len(new)
+    if new.empty:
+        decision.update(action="skip", reason="no_new_data")
+        return decision, None
+
+    # erro das previsões servidas (prediction_log) quando há o bastante; senão, o modelo corrente é
+    # reaplicado aos candles novos (mesmo resultado, já que a previsão é determinística)
+    model = store.load(symbol, interval)["model"]
+    online = ONLINE_ERRORS.get(symbol, interval, entry["version"])
+    if online is not None and online["n"] >= drift_min_rows:
+        decision.update(live_mae=online["mae"], live_source="online")
+    elif len(new) >= drift_min_rows:
+        with stage("inference"):
+            pred = np.asarray(model.predict(new[FEATURES]), dtype=np.float64)
+        decision.update(live_mae=float(np.abs(pred - new["y"].to_numpy()).mean()), live_source="replay")
+
+    model_mae = entry.get("mae")
+    if len(new) >= min_new_rows:
+        decision["reason"] = "new_data"
+    elif decision["live_mae"] is not None and model_mae and decision["live_mae"] > drift_ratio * model_mae:
+        decision["reason"] = "drift"
+    else:
+        decision.update(action="skip", reason="below_threshold")
+        return decision, None
+
+    # incremental só sobre o mesmo backend, com as mesmas features e até o limite de retreinos seguidos;
+    # senão (ou para hgb/linear, sem warm start válido; ver warm_start_copy) refaz do zero
+    base = None
+    if (entry.get("backend", MODEL_BACKEND) == backend and entry.get("warm_starts", 0) < full_every
+            and getattr(model, "n_features_in_", None) == len(FEATURES)):
+        base = warm_start_copy(model, warm_estimators)
+    if base is not None:
+        decision["action"] = "warm"
+    return decision, base
+
+def retrain(
+    db: Optional[Session],
+    symbols: list[str],
+    interval: str = "1m",
+    store: Optional[ModelStore] = None,
+    max_workers: int = RETRAIN_MAX_WORKERS,
+    source: Optional[PriceSource] = None,
+    limit: int = TRAIN_LIMIT,
+    features: Optional[FeatureStore] = None,
+    backend: Optional[str] = None,
+    dry_run: bool = False,
+    **policy,
+) -> dict:
+    # retreino guiado por dados: símbolos sem candles novos (ou com poucos e sem drift) são pulados e os
+    # demais ganham árvores novas sobre o ensemble corrente em vez de um fit do zero
+    store = store or MODEL_STORE
+    backend = backend or MODEL_BACKEND
+    make_model(backend)  # backend inválido falha antes de ler os dados
+    features = features or _default_features(source)
+    symbols = list(dict.fromkeys(s.strip() for s in symbols if s.strip()))
+
+    decisions: list[dict] = []
+    payloads: dict[str, tuple] = {}
+    errors: dict[str, str] = {}
+    for sym in symbols:
+        try:
+            df = _training_frame(db, source, sym, limit, features)
+            if df.empty:
+                raise RuntimeError("Sem dados para treino. Rode a ingestão primeiro.")
+            decision, base = plan_symbol(store, sym, interval, df, backend, **policy)
+        except Exception as e:
+            errors[sym] = str(e)
+            continue
+        decisions.append(decision)
+        if decision["action"] == "skip" or dry_run:
+            continue
+        extra = {}
+        if base is not None:
+            entry = _current_entry(store, sym, interval)
+            extra = {"warm_starts": entry.get("warm_starts", 0) + 1, "base_version": entry["version"]}
+        payloads[sym] = (_to_ipc(pa.Table.from_pandas(df, preserve_index=False)), backend, base, extra)
+
+    workers, results, fit_errors = (0, {}, {})
+    if payloads:
+        workers, results, fit_errors = fit_payloads(db, store, interval, payloads, max_workers)
+    errors.update(fit_errors)
+
+    if not dry_run:
+        for d in decisions:
+            RETRAIN_DECISIONS.inc(d["symbol"], d["action"])
+        for sym in errors:
+            TRAIN_FAILURES.inc(sym)
+    return {"interval": interval, "dry_run": dry_run, "workers": workers, "decisions": decisions,
+            "results": results, "errors": errors}
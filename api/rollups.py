@@ -0,0 +1,271 @@
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .db import Price, PriceRollup
+from .response_cache import interval_seconds
+from .runtime_metrics import stage
+
+# resoluções mantidas em price_rollups, recalculadas a cada gravação de candles (a base é a tabela prices)
+ROLLUP_RESOLUTIONS = tuple(r.strip() for r in os.getenv("ROLLUP_RESOLUTIONS", "5m,1h,1d").split(",") if r.strip())
+ROLLUP_BASE = os.getenv("INGEST_INTERVAL", "1m")
+# pontos devolvidos por /prices/range quando o cliente não pede outro valor
+RANGE_MAX_POINTS = int(os.getenv("RANGE_MAX_POINTS", "1000"))
+# no LTTB, a fonte é a mais fina com até max_points × este fator de linhas (mais linhas = forma mais fiel)
+RANGE_LTTB_OVERSAMPLE = int(os.getenv("RANGE_LTTB_OVERSAMPLE", "8"))
+
+# resoluções aceitas em /prices/range; as que não estão guardadas saem da maior guardada que as divide
+RESOLUTIONS = ("1m", "5m", "15m", "30m", "1h", "4h", "1d", "1w")
+OHLCV = ("open", "high", "low", "close", "volume")
+ROLLUP_CHUNK_SIZE = 1000
+
+def _ms(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
+def _dt(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+def _step_ms(resolution: str) -> int:
+    return interval_seconds(resolution) * 1000
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    step = _step_ms(resolution)
+    return _dt(_ms(ts) // step * step)
+
+def bucket_label(ts: datetime, resolution: str) -> datetime:
+    # mesma convenção de prices: ts do intervalo = fechamento do seu último candle
+    step = _step_ms(resolution)
+    return _dt((_ms(ts) // step + 1) * step - 1)
+
+def _epoch_ms(ts: pd.Series) -> np.ndarray:
+    return ((ts - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+
+def stored_resolutions() -> tuple[str, ...]:
+    return (ROLLUP_BASE, *ROLLUP_RESOLUTIONS)
+
+def aggregate(df: pd.DataFrame, resolution: str) -> pd.DataFrame:
+    # df em ordem de ts com colunas ts + OHLCV (e `candles`, quando vem de outro agregado)
+    cols = ["ts", *OHLCV, "candles"]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+    step = _step_ms(resolution)
+    g = df.assign(_bucket=_epoch_ms(df["ts"]) // step).groupby("_bucket", sort=True)
+    out = g.agg(open=("open", "first"), high=("high", "max"), low=("low", "min"),
+                close=("close", "last"), volume=("volume", "sum"))
+    out["candles"] = g["candles"].sum() if "candles" in df else g.size()
+    out["ts"] = pd.to_datetime((out.index.to_numpy() + 1) * step - 1, unit="ms", utc=True)
+    return out.reset_index(drop=True)[cols]
+
+def _select(symbol: str, resolution: str, start: datetime, end: datetime):
+    # linhas com ts em [start, end) da base (prices) ou de uma resolução guardada
+    if resolution == ROLLUP_BASE:
+        t = Price.__table__
+        cols, cond = [t.c.ts, *(t.c[c] for c in OHLCV)], []
+    else:
+        t = PriceRollup.__table__
+        cols, cond = [t.c.ts, *(t.c[c] for c in OHLCV), t.c.candles], [t.c.resolution == resolution]
+    return select(*cols).where(t.c.symbol == symbol, *cond, t.c.ts >= start, t.c.ts < end).order_by(t.c.ts.asc())
+
+def _frame(rows: Sequence, resolution: str) -> pd.DataFrame:
+    cols = ["ts", *OHLCV] + ([] if resolution == ROLLUP_BASE else ["candles"])
+    df = pd.DataFrame(rows, columns=cols)
+    df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    df[list(OHLCV)] = df[list(OHLCV)].astype(float)
+    return df
+
+def _upsert(db: Session, symbol: str, resolution: str, agg: pd.DataFrame) -> int:
+    if agg.empty:
+        return 0
+    rows = [
+        {
+            "symbol": symbol, "resolution": resolution, "ts": ts.to_pydatetime(),
+            **{c: (None if pd.isna(v) else float(v)) for c, v in zip(OHLCV, vals)},
+            "candles": int(n),
+        }
+        for ts, *vals, n in agg[["ts", *OHLCV, "candles"]].itertuples(index=False, name=None)
+    ]
+    insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else pg_insert
+    t = PriceRollup.__table__
+    for i in range(0, len(rows), ROLLUP_CHUNK_SIZE):
+        stmt = insert(t).values(rows[i:i + ROLLUP_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["symbol", "resolution", "ts"],
+            set_={c: stmt.excluded[c] for c in (*OHLCV, "candles")},
+        )
+        db.execute(stmt)
+    return len(rows)
+
+def refresh_rollups(db: Session, symbol: str, start: datetime, end: datetime,
+                    resolutions: Sequence[str] = ROLLUP_RESOLUTIONS) -> int:
+    # recalcula, a partir de prices, os intervalos que contêm candles com ts em [start, end]:
+    # idempotente e correto também para candles atrasados (backfill de buraco)
+    if not resolutions:
+        return 0
+    lo = min(bucket_start(start, r) for r in resolutions)
+    hi = max(bucket_label(end, r) for r in resolutions) + timedelta(milliseconds=1)
+    with stage("rollup"):
+        base = _frame(db.execute(_select(symbol, ROLLUP_BASE, lo, hi)).all(), ROLLUP_BASE)
+        written = 0
+        for res in resolutions:
+            agg = aggregate(base, res)
+            touched = (agg["ts"] >= bucket_label(start, res)) & (agg["ts"] <= bucket_label(end, res))
+            written += _upsert(db, symbol, res, agg[touched])
+        db.commit()
+    return written
+
+def update_rollups(db: Session, rows: list[dict], inserted: dict[str, int]) -> int:
+    # chamada após gravar candles; só os símbolos com linhas novas, só os intervalos tocados
+    bounds: dict[str, list[datetime]] = {}
+    for r in rows:
+        if not inserted.get(r["symbol"]):
+            continue
+        b = bounds.setdefault(r["symbol"], [r["ts"], r["ts"]])
+        b[0], b[1] = min(b[0], r["ts"]), max(b[1], r["ts"])
+    try:
+        return sum(refresh_rollups(db, sym, lo, hi) for sym, (lo, hi) in sorted(bounds.items()))
+    except Exception:
+        db.rollback()
+        raise
+
+def rebuild_rollups(db: Session, symbol: str, chunk_days: int = 30) -> int:
+    # histórico gravado antes dos rollups existirem: recalcula tudo, em janelas de chunk_days
+    t = Price.__table__
+    first, last = db.execute(select(func.min(t.c.ts), func.max(t.c.ts)).where(t.c.symbol == symbol)).one()
+    if first is None:
+        return 0
+    written = 0
+    lo = bucket_start(first, "1d")
+    while lo <= bucket_start(last, "1d"):
+        hi = lo + timedelta(days=chunk_days)
+        written += refresh_rollups(db, symbol, lo, min(hi - timedelta(milliseconds=1), _dt(_ms(last))))
+        lo = hi
+    return written
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: índices de n_out pontos que preservam a forma da série
+    # (picos e vales ficam; média por intervalo os achataria)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.intp)
+    out = np.empty(n_out, dtype=np.intp)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def _buckets(start: datetime, end: datetime, resolution: str) -> int:
+    return math.ceil((_ms(end) - _ms(start)) / _step_ms(resolution))
+
+def pick_resolution(start: datetime, end: datetime, max_points: int) -> str:
+    # a mais fina que cabe em max_points intervalos
+    base = interval_seconds(ROLLUP_BASE)
+    candidates = [r for r in RESOLUTIONS if interval_seconds(r) >= base]
+    for res in candidates:
+        if _buckets(start, end, res) <= max_points:
+            return res
+    return candidates[-1]
+
+def source_for(resolution: str) -> str:
+    # a maior resolução guardada que divide a pedida (a base sempre divide)
+    step = interval_seconds(resolution)
+    divisors = [r for r in stored_resolutions() if step % interval_seconds(r) == 0]
+    return max(divisors, key=interval_seconds)
+
+def _lttb_source(start: datetime, end: datetime, max_points: int) -> str:
+    stored = sorted(stored_resolutions(), key=interval_seconds)
+    for res in stored:
+        if _buckets(start, end, res) <= max_points * RANGE_LTTB_OVERSAMPLE:
+            return res
+    return stored[-1]
+
+def _iso(ts: pd.Timestamp) -> str:
+    return ts.isoformat()
+
+def range_body(df: pd.DataFrame, symbol: str, start: datetime, end: datetime, resolution: str,
+               source: str, method: str, max_points: int) -> bytes:
+    if method == "lttb":
+        if not df.empty:
+            x = _epoch_ms(df["ts"]).astype(np.float64)
+            df = df.iloc[lttb(x, df["close"].to_numpy(), max_points)]
+        data = [{"ts": _iso(ts), "close": float(c)} for ts, c in zip(df["ts"], df["close"])]
+    else:
+        data = [
+            {"ts": _iso(ts), **{c: (None if pd.isna(v) else float(v)) for c, v in zip(OHLCV, vals)}}
+            for ts, *vals in df[["ts", *OHLCV]].itertuples(index=False, name=None)
+        ]
+    return json.dumps({
+        "symbol": symbol, "start": start.isoformat(), "end": end.isoformat(), "method": method,
+        "resolution": resolution, "source": source, "points": len(data), "data": data,
+    }).encode()
+
+def plan_range(start: datetime, end: datetime, resolution: str, method: str, max_points: int) -> tuple[str, str]:
+    # (resolução da resposta, resolução lida do banco); ValueError para pedidos que não cabem
+    if end <= start:
+        raise ValueError("`start` deve ser anterior a `end`.")
+    if method == "lttb":
+        source = _lttb_source(start, end, max_points)
+        return source, source
+    if resolution == "auto":
+        resolution = pick_resolution(start, end, max_points)
+    elif interval_seconds(resolution) < interval_seconds(ROLLUP_BASE):
+        raise ValueError(f"Resolução menor que a base ({ROLLUP_BASE}).")
+    elif _buckets(start, end, resolution) > max_points:
+        raise ValueError(
+            f"Período tem {_buckets(start, end, resolution)} intervalos de {resolution} (máximo {max_points}): "
+            "use resolution=auto, uma resolução maior ou aumente max_points."
+        )
+    return resolution, source_for(resolution)
+
+async def load_range_async(db: AsyncSession, symbol: str, start: datetime, end: datetime,
+                           resolution: str = "auto", method: str = "ohlc",
+                           max_points: int = RANGE_MAX_POINTS) -> bytes:
+    resolution, source = plan_range(start, end, resolution, method, max_points)
+    # os intervalos que contêm `start` e `end` entram inteiros (o último pode estar em andamento)
+    lo = bucket_start(start, resolution)
+    hi = bucket_label(end, resolution) + timedelta(milliseconds=1)
+    with stage("range_query"):
+        df = _frame((await db.execute(_select(symbol, source, lo, hi))).all(), source)
+    if source != resolution:
+        df = aggregate(df, resolution)
+    return range_body(df, symbol, start, end, resolution, source, method, max_points)
+
+def main() -> None:
+    # python -m api.rollups rebuild --symbols BTCUSDT,ETHUSDT
+    parser = argparse.ArgumentParser(description="Manutenção dos agregados de preços (price_rollups).")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rebuild = sub.add_parser("rebuild", help="recalcula os agregados de todo o histórico")
+    rebuild.add_argument("--symbols", default=os.getenv("INGEST_SYMBOLS", "BTCUSDT"))
+    rebuild.add_argument("--chunk-days", type=int, default=30)
+    args = parser.parse_args()
+
+    from .db import SessionLocal, init_db
+    init_db()
+    out = {}
+    with SessionLocal() as db:
+        for sym in [s.strip() for s in args.symbols.split(",") if s.strip()]:
+            out[sym] = rebuild_rollups(db, sym, chunk_days=args.chunk_days)
+    print(json.dumps({"resolutions": list(ROLLUP_RESOLUTIONS), "written": out}))
+
+if __name__ == "__main__":
+    main()
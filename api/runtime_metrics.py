@@ -0,0 +1,200 @@
+from __future__ import annotations
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# métricas de processo (contadores, gauges e histogramas) no formato texto do Prometheus;
+# custo por observação: um lock, uma busca binária e duas somas
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "app")
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# segundos: de 0,5 ms (consultas/inferência) a 2 min (retreino)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = f"{METRICS_PREFIX}_{name}" if METRICS_PREFIX else name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: esperados os rótulos {self.labelnames}, recebidos {labels}")
+        return tuple(str(v) for v in labels)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}_total{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, *labels, value: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def value(self, *labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # rótulos -> [contagem por bucket (+Inf no fim), soma]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    @contextmanager
+    def time(self, *labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - t0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1])) for k, s in self._series.items())
+        lines = self._header()
+        for key, (counts, total) in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+RUNTIME_METRICS = MetricsRegistry()
+
+STAGE_SECONDS = RUNTIME_METRICS.register(Histogram(
+    "stage_duration_seconds", "Duração das etapas quentes (consulta, features, modelo, inferência, coleta, upsert).",
+    ("stage",),
+))
+JOB_SECONDS = RUNTIME_METRICS.register(Histogram(
+    "job_duration_seconds", "Duração das execuções dos jobs agendados.", ("job",),
+))
+JOB_RUNS = RUNTIME_METRICS.register(Counter(
+    "job_runs", "Execuções dos jobs agendados por resultado (ok, error, skipped, missed).", ("job", "status"),
+))
+JOB_LAST_SUCCESS = RUNTIME_METRICS.register(Gauge(
+    "job_last_success_timestamp_seconds", "Epoch da última execução bem-sucedida de cada job.", ("job",),
+))
+INGEST_ROWS = RUNTIME_METRICS.register(Counter(
+    "ingest_rows", "Candles inseridos pela ingestão por símbolo.", ("symbol",),
+))
+INGEST_FAILURES = RUNTIME_METRICS.register(Counter(
+    "ingest_failures", "Falhas de coleta/gravação por símbolo.", ("symbol",),
+))
+TRAIN_FAILURES = RUNTIME_METRICS.register(Counter(
+    "train_failures", "Falhas de treino por símbolo.", ("symbol",),
+))
+FEATURE_RESYNCS = RUNTIME_METRICS.register(Counter(
+    "feature_resyncs", "Features reconstruídas por candle gravado fora de ordem (state, store).",
+    ("symbol", "target"),
+))
+
+def stage(name: str):
+    # with stage("db_query"): ...
+    return STAGE_SECONDS.time(name)
+
+@contextmanager
+def job(name: str):
+    # envolve um job agendado: duração, resultado e horário do último sucesso
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        JOB_RUNS.inc(name, "error")
+        raise
+    else:
+        JOB_RUNS.inc(name, "ok")
+        JOB_LAST_SUCCESS.set(name, value=time.time())
+    finally:
+        JOB_SECONDS.observe(name, value=time.perf_counter() - t0)
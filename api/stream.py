@@ -0,0 +1,377 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Optional, Protocol
+
+from sqlalchemy.orm import Session
+
+from .feature_state import FEATURE_STATES
+from .features import interval_delta
+from .ingest import (
+    KlineSource, _advance_watermarks, _fetch_since, _invalidate_caches, _ms_to_dt_utc, _update_rollups,
+    _resolve_predictions, _upsert_prices,
+    get_default_source, run_ingestion_many,
+)
+from .runtime_metrics import FEATURE_RESYNCS, INGEST_FAILURES, RUNTIME_METRICS, Counter, stage
+
+BINANCE_WS_URL = os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443")
+# candles fechados acumulados antes de gravar (o que vier primeiro: tamanho ou tempo)
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "1.0"))
+# espera entre reconexões: dobra a cada falha seguida, até o teto
+STREAM_RECONNECT_MIN = float(os.getenv("STREAM_RECONNECT_MIN", "1"))
+STREAM_RECONNECT_MAX = float(os.getenv("STREAM_RECONNECT_MAX", "30"))
+# candles pedidos ao REST quando há buraco (reconexão ou candle pulado no stream)
+STREAM_BACKFILL_LIMIT = int(os.getenv("STREAM_BACKFILL_LIMIT", "1000"))
+
+STREAM_EVENTS = RUNTIME_METRICS.register(Counter(
+    "stream_events", "Mensagens de kline recebidas pelo stream, por tipo (open, closed).", ("kind",),
+))
+STREAM_RECONNECTS = RUNTIME_METRICS.register(Counter(
+    "stream_reconnects", "Reconexões do stream de klines.",
+))
+
+def parse_kline_message(raw: str | bytes) -> Optional[dict]:
+    # evento kline da Binance, direto (/ws) ou no envelope do stream combinado ({"stream", "data"});
+    # mesma linha de _parse_klines (ts = fechamento do candle) mais o flag "closed"
+    msg = json.loads(raw)
+    data = msg.get("data", msg)
+    if data.get("e") != "kline":
+        return None
+    k = data["k"]
+    return {
+        "symbol": k["s"],
+        "ts": _ms_to_dt_utc(int(k["T"])),
+        "open": float(k["o"]),
+        "high": float(k["h"]),
+        "low": float(k["l"]),
+        "close": float(k["c"]),
+        "volume": float(k["v"]),
+        "closed": bool(k["x"]),
+        "event_ms": int(data.get("E", k["T"])),
+    }
+
+class StreamSource(Protocol):
+    def messages(self, symbols: list[str], interval: str) -> AsyncIterator[str | bytes]: ...
+
+class BinanceWebSocketSource:
+    # stream combinado: uma conexão para todos os símbolos
+    def __init__(self, base_url: str = BINANCE_WS_URL) -> None:
+        self.base_url = base_url.rstrip("/")
+
+    def url(self, symbols: list[str], interval: str) -> str:
+        streams = "/".join(f"{s.lower()}@kline_{interval}" for s in symbols)
+        return f"{self.base_url}/stream?streams={streams}"
+
+    async def messages(self, symbols: list[str], interval: str) -> AsyncIterator[str | bytes]:
+        import websockets
+
+        async with websockets.connect(self.url(symbols, interval), ping_interval=20, max_queue=1024) as ws:
+            async for raw in ws:
+                yield raw
+
+class ReplaySource:
+    # substitui a corretora: relê mensagens gravadas (uma por linha, como chegam do websocket)
+    # respeitando o intervalo entre eventos dividido por `speed`; speed=0 relê sem pausas
+    def __init__(self, path: str, speed: float = 100.0) -> None:
+        self.path = path
+        self.speed = speed
+
+    async def messages(self, symbols: list[str], interval: str) -> AsyncIterator[str | bytes]:
+        wanted = {s.upper() for s in symbols}
+        prev_ms: Optional[int] = None
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                data = json.loads(line)
+                data = data.get("data", data)
+                if data.get("k", {}).get("s") not in wanted:
+                    continue
+                event_ms = int(data.get("E", data["k"]["T"]))
+                if self.speed > 0 and prev_ms is not None and event_ms > prev_ms:
+                    await asyncio.sleep((event_ms - prev_ms) / 1000 / self.speed)
+                prev_ms = event_ms
+                yield line
+
+def push_feature_states(rows: list[dict], interval: str) -> None:
+    # estados aquecidos recebem os candles novos sem consultar o banco; se houver buraco
+    # entre o estado e o lote, o estado fica como está e o próximo predict sincroniza pelo banco.
+    # Candle anterior ao estado (buraco preenchido depois): o estado é descartado e o próximo
+    # predict o reconstrói a partir do feature store/banco
+    step = interval_delta(interval)
+    by_symbol: dict[str, list[dict]] = defaultdict(list)
+    for r in rows:
+        by_symbol[r["symbol"]].append(r)
+    for sym, sym_rows in by_symbol.items():
+        state = FEATURE_STATES.get(sym)
+        if state is None or state.count == 0:
+            continue
+        sym_rows.sort(key=lambda r: r["ts"])
+        with state.lock:
+            if sym_rows[0]["ts"] - state.last_ts > step:
+                continue
+            state.extend((r["ts"], r["close"]) for r in sym_rows)
+            stale = state.out_of_order > 0
+        if stale:
+            FEATURE_STATES.drop(sym)
+            FEATURE_RESYNCS.inc(sym, "state")
+
+class StreamIngestor:
+    def __init__(
+        self,
+        symbols: list[str],
+        interval: str = "1m",
+        source: Optional[StreamSource] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        rest_source: Optional[KlineSource] = None,
+        batch_size: int = STREAM_BATCH_SIZE,
+        flush_seconds: float = STREAM_FLUSH_SECONDS,
+        backfill: bool = True,
+    ) -> None:
+        self.symbols = [s.strip().upper() for s in symbols if s.strip()]
+        self.interval = interval
+        self.step = interval_delta(interval)
+        self.source = source or BinanceWebSocketSource()
+        self.session_factory = session_factory or _session
+        self.rest_source = rest_source
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.backfill = backfill
+        self._subscribers: list[Callable[[list[dict]], None]] = []
+        self._buffer: list[dict] = []
+        self._last_ts: dict[str, datetime] = {}
+        self._stopping = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connected = False
+        self.stats = {
+            "messages": 0, "closed": 0, "inserted": 0, "flushes": 0, "reconnects": 0,
+            "backfilled": 0, "errors": 0, "last_error": None, "last_event_ms": None, "last_flush_at": None,
+        }
+
+    def subscribe(self, callback: Callable[[list[dict]], None]) -> None:
+        # chamado (na thread da gravação) com os candles efetivamente inseridos, após o commit
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[list[dict]], None]) -> None:
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def status(self) -> dict:
+        last = self.stats["last_event_ms"]
+        return {
+            "symbols": self.symbols,
+            "interval": self.interval,
+            "source": type(self.source).__name__,
+            "connected": self.connected,
+            "buffered": len(self._buffer),
+            "lag_seconds": (time.time() * 1000 - last) / 1000 if last else None,
+            **self.stats,
+        }
+
+    def stop(self) -> None:
+        # pode ser chamado de outra thread (ex.: assinante)
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        else:
+            self._stopping.set()
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        delay = STREAM_RECONNECT_MIN
+        while not self._stopping.is_set():
+            received = self.stats["messages"]
+            try:
+                # reconexão: o REST completa o que passou desde o último candle gravado (watermark)
+                if self.backfill:
+                    await asyncio.to_thread(self._backfill_all)
+                await self._consume()
+                if self._buffer:
+                    await asyncio.to_thread(self._flush)
+                if isinstance(self.source, ReplaySource):
+                    break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # lote que falhou não avança o watermark: volta pelo backfill na reconexão
+                self._buffer = []
+                self.stats["errors"] += 1
+                self.stats["last_error"] = repr(e)
+            finally:
+                self.connected = False
+            if self._stopping.is_set():
+                break
+            if self.stats["messages"] > received:
+                delay = STREAM_RECONNECT_MIN
+            self.stats["reconnects"] += 1
+            STREAM_RECONNECTS.inc()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, STREAM_RECONNECT_MAX)
+
+    async def _consume(self) -> None:
+        # leitor em task própria alimenta uma fila: o timeout de flush cancela só o get(), nunca o gerador
+        queue: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+        done = object()
+
+        async def pump() -> None:
+            try:
+                async for raw in self.source.messages(self.symbols, self.interval):
+                    await queue.put(raw)
+                await queue.put(done)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+
+        reader = asyncio.create_task(pump())
+        next_flush = time.monotonic() + self.flush_seconds
+        try:
+            while not self._stopping.is_set():
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(0.0, next_flush - time.monotonic()))
+                except asyncio.TimeoutError:
+                    item = None
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if item is not None:
+                    self.connected = True
+                    self._handle(item)
+                if len(self._buffer) >= self.batch_size or time.monotonic() >= next_flush:
+                    if self._buffer:
+                        await asyncio.to_thread(self._flush)
+                    next_flush = time.monotonic() + self.flush_seconds
+        finally:
+            reader.cancel()
+            try:
+                await reader
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def _handle(self, raw) -> None:
+        row = parse_kline_message(raw)
+        self.stats["messages"] += 1
+        if row is None:
+            return
+        self.stats["last_event_ms"] = row.pop("event_ms")
+        STREAM_EVENTS.inc("closed" if row["closed"] else "open")
+        # só candles fechados vão para o banco; atualizações do candle em aberto são descartadas
+        if not row.pop("closed"):
+            return
+        self.stats["closed"] += 1
+        self._buffer.append(row)
+
+    def _backfill_all(self) -> None:
+        db = self.session_factory()
+        try:
+            res = run_ingestion_many(db, self.symbols, interval=self.interval, limit=STREAM_BACKFILL_LIMIT,
+                                     source=self.rest_source)
+            self.stats["backfilled"] += res["inserted"]
+        finally:
+            db.close()
+
+    def _flush(self) -> None:
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        # candle pulado no stream (ex.: mensagem perdida): busca no REST o que falta desde o último
+        # candle gravado e grava junto com o lote (assinantes recebem os candles recuperados também)
+        gaps: set[str] = set()
+        prev = dict(self._last_ts)
+        for r in sorted(rows, key=lambda r: (r["symbol"], r["ts"])):
+            last = prev.get(r["symbol"])
+            if last is not None and r["ts"] - last > self.step:
+                gaps.add(r["symbol"])
+            prev[r["symbol"]] = r["ts"]
+        if gaps and self.backfill:
+            rest = self.rest_source or get_default_source()
+            fetched = [row for sym in sorted(gaps)
+                       for row in _fetch_since(rest, sym, self.interval, STREAM_BACKFILL_LIMIT, self._last_ts[sym])]
+            self.stats["backfilled"] += len(fetched)
+            seen = {(r["symbol"], r["ts"]) for r in rows}
+            rows = sorted(rows + [r for r in fetched if (r["symbol"], r["ts"]) not in seen],
+                          key=lambda r: (r["symbol"], r["ts"]))
+        db = self.session_factory()
+        try:
+            with stage("stream_flush"):
+                inserted = _upsert_prices(db, rows)
+            _update_rollups(db, rows, inserted)
+            _resolve_predictions(db, rows, inserted)
+        except Exception:
+            for sym in {r["symbol"] for r in rows}:
+                INGEST_FAILURES.inc(sym)
+            raise
+        finally:
+            db.close()
+        _advance_watermarks(rows)
+        _invalidate_caches(inserted)
+        for r in rows:
+            if r["symbol"] not in self._last_ts or r["ts"] > self._last_ts[r["symbol"]]:
+                self._last_ts[r["symbol"]] = r["ts"]
+        self.stats["inserted"] += sum(inserted.values())
+        self.stats["flushes"] += 1
+        self.stats["last_flush_at"] = datetime.now(timezone.utc).isoformat()
+
+        new_rows = [r for r in rows if inserted.get(r["symbol"])]
+        if not new_rows:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(new_rows)
+            except Exception as e:
+                self.stats["last_error"] = repr(e)
+
+def _session() -> Session:
+    from .db import SessionLocal
+    return SessionLocal()
+
+def main() -> None:
+    # gravar:     python -m api.stream record --symbols BTCUSDT,ETHUSDT --seconds 600 --out klines.jsonl
+    # reproduzir: python -m api.stream replay --file klines.jsonl --speed 100   (grava em DATABASE_URL)
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["record", "replay"])
+    ap.add_argument("--symbols", default="BTCUSDT")
+    ap.add_argument("--interval", default="1m")
+    ap.add_argument("--out", default="klines.jsonl")
+    ap.add_argument("--seconds", type=float, default=600)
+    ap.add_argument("--file", default="klines.jsonl")
+    ap.add_argument("--speed", type=float, default=100.0)
+    args = ap.parse_args()
+    symbols = args.symbols.split(",")
+
+    if args.command == "record":
+        async def record() -> int:
+            n = 0
+            deadline = time.monotonic() + args.seconds
+            with open(args.out, "w", encoding="utf-8") as f:
+                async for raw in BinanceWebSocketSource().messages(symbols, args.interval):
+                    f.write((raw.decode() if isinstance(raw, bytes) else raw) + "\n")
+                    n += 1
+                    if time.monotonic() >= deadline:
+                        break
+            return n
+        print(json.dumps({"recorded": asyncio.run(record()), "out": args.out}))
+        return
+
+    ingestor = StreamIngestor(symbols, args.interval, source=ReplaySource(args.file, args.speed), backfill=False)
+    t0 = time.perf_counter()
+    asyncio.run(ingestor.run())
+    elapsed = time.perf_counter() - t0
+    out = ingestor.status()
+    out["elapsed_seconds"] = elapsed
+    out["messages_per_sec"] = out["messages"] / elapsed if elapsed else None
+    print(json.dumps(out, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
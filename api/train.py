@@ -1,38 +1,73 @@
 from __future__ import annotations
-from datetime import datetime, timezone
+import multiprocessing
 import os
-import joblib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from sqlalchemy.orm import Session
-from sklearn.ensemble import GradientBoostingRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
-from .db import Price, ModelMetric
-from .features import build_features
+from .db import ModelMetric
+from .feature_store import FEATURE_STORE, FeatureStore
+from .features import FEATURES, build_features
+from .lake import ParquetPriceSource
+from .model_backends import BACKENDS, MODEL_BACKEND, compile_model, make_model, n_trees
+from .loader import PriceSource, PostgresPriceSource
+from .model_store import MODEL_STORE, ModelStore
+from .runtime_metrics import TRAIN_FAILURES, stage
 
-MODELS_DIR = os.path.join(os.path.dirname(__file__), "models")
-MODEL_PATH = os.path.join(MODELS_DIR, "model.pkl")
+# com a fonte parquet o histórico não pesa no banco e o limite pode ser bem maior
+TRAIN_LIMIT = int(os.getenv("TRAIN_LIMIT", "5000"))
+TRAIN_SOURCE = os.getenv("TRAIN_SOURCE", "postgres")
+# com a fonte postgres, treina a partir das features materializadas (feature_store) em vez de recalcular
+TRAIN_FEATURE_STORE = os.getenv("TRAIN_FEATURE_STORE", "1") == "1"
+# processos de treino em paralelo no retreino agendado (1 = no próprio processo)
+RETRAIN_MAX_WORKERS = int(os.getenv("RETRAIN_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
 
-def _load_prices_df(db: Session, symbol: str, limit: int = 5000) -> pd.DataFrame:
-    q = (
-        db.query(Price)
-        .filter(Price.symbol == symbol)
-        .order_by(Price.ts.desc())
-        .limit(limit)
-    )
-    rows = q.all()
-    if not rows:
+def get_price_source(name: str, db: Optional[Session] = None) -> PriceSource:
+    if name == "parquet":
+        return ParquetPriceSource()
+    if name == "postgres":
+        if db is None:
+            raise RuntimeError("Fonte postgres exige sessão de banco.")
+        return PostgresPriceSource(db)
+    raise ValueError(f"Fonte de preços desconhecida: {name!r} (use 'postgres' ou 'parquet').")
+
+def _default_features(source: Optional[PriceSource]) -> Optional[FeatureStore]:
+    # a fonte padrão (postgres) chega resolvida pela API (get_price_source), não só como None
+    postgres = isinstance(source, PostgresPriceSource) or (source is None and TRAIN_SOURCE == "postgres")
+    return FEATURE_STORE if postgres and TRAIN_FEATURE_STORE else None
+
+def _load_training_table(db: Optional[Session], source: Optional[PriceSource], symbol: str,
+                         limit: int, features: Optional[FeatureStore]) -> pa.Table:
+    # features prontas (com y) quando o feature store cobre o símbolo; senão, preços crus
+    if features is not None and db is not None:
+        with stage("feature_store_update"):
+            features.update(db, symbol)
+        df = features.training_set(symbol, limit)
+        if df is not None:
+            return pa.Table.from_pandas(df, preserve_index=False)
+    source = source or get_price_source(TRAIN_SOURCE, db)
+    with stage("db_query"):
+        return source.load(symbol, ("ts", "close"), limit=limit)
+
+def _load_prices_df(db: Optional[Session], source: Optional[PriceSource], symbol: str,
+                    limit: int = TRAIN_LIMIT, features: Optional[FeatureStore] = None) -> pd.DataFrame:
+    df = _load_training_table(db, source, symbol, limit, features).to_pandas()
+    if df.empty:
         raise RuntimeError("Sem dados para treino. Rode a ingestão primeiro.")
-    rows = list(reversed(rows))
-    df = pd.DataFrame([{"ts": r.ts, "close": float(r.close)} for r in rows])
     return df
 
-def train_model(db: Session, symbol: str = "BTCUSDT") -> dict:
-    os.makedirs(MODELS_DIR, exist_ok=True)
-
-    df = _load_prices_df(db, symbol)
-    X, y = build_features(df)
+def _fit(df: pd.DataFrame, backend: str = MODEL_BACKEND, base=None) -> tuple[object, dict]:
+    # base: ensemble já ajustado com warm start ligado (ver warm_start_copy); só as árvores novas são treinadas
+    if "y" in df.columns:
+        X, y = df[FEATURES], df["y"]
+    else:
+        with stage("feature_build"):
+            X, y = build_features(df)
     if len(X) < 200:
         raise RuntimeError("Poucos dados após feature engineering (mín. 200 linhas).")
 
@@ -40,32 +75,179 @@ def train_model(db: Session, symbol: str = "BTCUSDT") -> dict:
     X_train, X_val = X.iloc[:split_idx], X.iloc[split_idx:]
     y_train, y_val = y.iloc[:split_idx], y.iloc[split_idx:]
 
-    model = GradientBoostingRegressor(random_state=42)
-    model.fit(X_train, y_train)
+    model = base if base is not None else make_model(backend)
+    with stage("fit"):
+        model.fit(X_train, y_train)
 
     preds = model.predict(X_val)
-    mae = float(mean_absolute_error(y_val, preds))
-    rmse = float(np.sqrt(mean_squared_error(y_val, preds)))
+    stats = {
+        "mae": float(mean_absolute_error(y_val, preds)),
+        "rmse": float(np.sqrt(mean_squared_error(y_val, preds))),
+        "n_rows": int(len(df)),
+        "n_features": int(X.shape[1]),
+        "train_end_ts": df["ts"].max(),
+        "backend": backend,
+        "fit": "warm" if base is not None else "full",
+        "n_trees": n_trees(model),
+    }
+    return model, stats
 
+def _save(store: ModelStore, symbol: str, interval: str, model, stats: dict) -> tuple[dict, ModelMetric]:
     version = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-    bundle = {"model": model, "version": version}
-    joblib.dump(bundle, MODEL_PATH)
-    print(f"[train] model saved to: {MODEL_PATH}")
+    # mesmo bundle para todos os backends; "compiled" só existe para ensembles de árvores
+    bundle = {"model": model, "version": version, "backend": stats["backend"], "compiled": compile_model(model)}
+    saved = store.save(
+        symbol, interval, bundle,
+        info={
+            "mae": stats["mae"], "rmse": stats["rmse"], "n_rows": stats["n_rows"],
+            "train_end_ts": stats["train_end_ts"].isoformat(), "backend": stats["backend"],
+            "fit": stats["fit"], "n_trees": stats["n_trees"], "warm_starts": stats.get("warm_starts", 0),
+            **({"base_version": stats["base_version"]} if stats.get("base_version") else {}),
+        },
+    )
+    print(f"[train] model saved to: {saved['path']}")
 
     metric = ModelMetric(
-        model_version=version,
-        train_end_ts=df["ts"].max(),
-        mae=mae,
-        rmse=rmse,
+        model_version=saved["version"],
+        train_end_ts=stats["train_end_ts"],
+        mae=stats["mae"],
+        rmse=stats["rmse"],
     )
-    db.add(metric)
-    db.commit()
-
-    return {
-        "version": version,
-        "mae": mae,
-        "rmse": rmse,
-        "model_path": MODEL_PATH,
-        "n_rows": int(len(df)),
-        "n_features": int(X.shape[1]),
+    result = {
+        "symbol": symbol,
+        "interval": interval,
+        "version": saved["version"],
+        "mae": stats["mae"],
+        "rmse": stats["rmse"],
+        "model_path": saved["path"],
+        "n_rows": stats["n_rows"],
+        "n_features": stats["n_features"],
+        "backend": stats["backend"],
+        "fit": stats["fit"],
     }
+    return result, metric
+
+def train_model(db: Optional[Session], symbol: str = "BTCUSDT", interval: str = "1m",
+                store: Optional[ModelStore] = None, source: Optional[PriceSource] = None,
+                limit: int = TRAIN_LIMIT, features: Optional[FeatureStore] = None,
+                backend: Optional[str] = None) -> dict:
+    # db=None (só possível com outra fonte, ex.: parquet) treina offline, sem gravar model_metrics
+    store = store or MODEL_STORE
+    features = features or _default_features(source)
+    df = _load_prices_df(db, source, symbol, limit, features)
+    model, stats = _fit(df, backend or MODEL_BACKEND)
+    result, metric = _save(store, symbol, interval, model, stats)
+    if db is not None:
+        db.add(metric)
+        db.commit()
+    return result
+
+def _to_ipc(table: pa.Table) -> pa.Buffer:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+def _fit_ipc(symbol: str, buf: pa.Buffer, backend: str = MODEL_BACKEND, base=None):
+    # roda no processo filho: reconstrói o frame a partir do stream Arrow (sem pickle de DataFrame)
+    try:
+        df = pa.ipc.open_stream(buf).read_all().to_pandas()
+        return symbol, *_fit(df, backend, base), None
+    except Exception as e:
+        return symbol, None, None, str(e)
+
+def fit_payloads(
+    db: Optional[Session],
+    store: ModelStore,
+    interval: str,
+    payloads: dict[str, tuple[pa.Buffer, str, object, dict]],
+    max_workers: int = RETRAIN_MAX_WORKERS,
+) -> tuple[int, dict, dict]:
+    # payloads: símbolo -> (buffer Arrow, backend, modelo base do warm start ou None, campos extras do manifest)
+    workers = max(1, min(max_workers, len(payloads)))
+    args = [(sym, buf, backend, base) for sym, (buf, backend, base, _) in payloads.items()]
+    if workers == 1:
+        fitted = [_fit_ipc(*a) for a in args]
+    else:
+        # spawn: o processo da API tem threads (scheduler, servidor) e fork não é seguro
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            fitted = list(pool.map(_fit_ipc, *zip(*args)))
+
+    # com processos filhos, as etapas de features/fit são medidas lá e não aparecem aqui
+    results: dict[str, dict] = {}
+    errors: dict[str, str] = {}
+    metrics: list[ModelMetric] = []
+    for sym, model, stats, err in fitted:
+        if err is not None:
+            errors[sym] = err
+            continue
+        results[sym], metric = _save(store, sym, interval, model, {**stats, **payloads[sym][3]})
+        metrics.append(metric)
+
+    # métricas de todos os símbolos numa única transação
+    if metrics and db is not None:
+        db.add_all(metrics)
+        db.commit()
+    return workers, results, errors
+
+def train_many(
+    db: Optional[Session],
+    symbols: list[str],
+    interval: str = "1m",
+    store: Optional[ModelStore] = None,
+    max_workers: int = RETRAIN_MAX_WORKERS,
+    source: Optional[PriceSource] = None,
+    limit: int = TRAIN_LIMIT,
+    features: Optional[FeatureStore] = None,
+    backend: Optional[str] = None,
+) -> dict:
+    store = store or MODEL_STORE
+    backend = backend or MODEL_BACKEND
+    features = features or _default_features(source)
+    symbols = list(dict.fromkeys(s.strip() for s in symbols if s.strip()))
+
+    # leitura no processo pai (na sessão do chamador, se a fonte for o banco); os filhos só recebem buffers Arrow
+    payloads: dict[str, tuple] = {}
+    errors: dict[str, str] = {}
+    for sym in symbols:
+        table = _load_training_table(db, source, sym, limit, features)
+        if table.num_rows == 0:
+            errors[sym] = "Sem dados para treino. Rode a ingestão primeiro."
+            continue
+        payloads[sym] = (_to_ipc(table), backend, None, {})
+
+    workers, results, fit_errors = fit_payloads(db, store, interval, payloads, max_workers)
+    errors.update(fit_errors)
+    for sym in errors:
+        TRAIN_FAILURES.inc(sym)
+    return {"interval": interval, "workers": workers, "results": results, "errors": errors}
+
+def main() -> None:
+    # treino offline a partir do lake: python -m api.train --source parquet --symbols BTCUSDT,ETHUSDT
+    import argparse
+    import json
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", default="BTCUSDT")
+    ap.add_argument("--interval", default="1m")
+    ap.add_argument("--source", default="parquet", choices=["parquet", "postgres"])
+    ap.add_argument("--limit", type=int, default=TRAIN_LIMIT)
+    ap.add_argument("--workers", type=int, default=RETRAIN_MAX_WORKERS)
+    ap.add_argument("--backend", default=MODEL_BACKEND, choices=list(BACKENDS))
+    args = ap.parse_args()
+
+    db = None
+    if args.source == "postgres":
+        from .db import SessionLocal
+        db = SessionLocal()
+    try:
+        out = train_many(db, args.symbols.split(","), interval=args.interval, max_workers=args.workers,
+                         source=get_price_source(args.source, db), limit=args.limit, backend=args.backend)
+    finally:
+        if db is not None:
+            db.close()
+    print(json.dumps(out, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Compara build_features chamado símbolo a símbolo com build_features_long num único frame longo.
+# Uso: python -m benchmarks.bench_features --symbols 1,100,1000 --rows 5000
+from __future__ import annotations
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from api.features import build_features, build_features_long
+
+def synthetic_long(n_symbols: int, n_rows: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, (n_symbols, n_rows)), axis=1)
+    ts = pd.date_range("2024-01-01", periods=n_rows, freq="min", tz="UTC")
+    return pd.DataFrame({
+        "symbol": np.repeat([f"SYM{s:04d}USDT" for s in range(n_symbols)], n_rows),
+        "ts": np.tile(ts, n_symbols),
+        "close": close.ravel(),
+    })
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", default="1,100,1000")
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    results = []
+    for n_symbols in (int(x) for x in args.symbols.split(",")):
+        df = synthetic_long(n_symbols, args.rows)
+        groups = [g[["ts", "close"]] for _, g in df.groupby("symbol", sort=False)]
+        per_symbol = _best(lambda: [build_features(g) for g in groups], args.repeat)
+        long = _best(lambda: build_features_long(df), args.repeat)
+        results.append({
+            "symbols": n_symbols,
+            "rows_per_symbol": args.rows,
+            "per_symbol_seconds": per_symbol,
+            "long_seconds": long,
+            "speedup": per_symbol / long,
+            "long_rows_per_sec": len(df) / long,
+        })
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Compara o caminho INSERT ... VALUES com o COPY + staging na escrita de candles.
+# Uso: DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.bench_ingest_write --rows 200000
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base
+from api.ingest import _values_upsert_prices, _copy_upsert_prices
+
+def synthetic_rows(n_rows: int, n_symbols: int, seed: int = 42) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    per_symbol = n_rows // n_symbols
+    t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for s in range(n_symbols):
+        close = 100 + np.cumsum(rng.normal(0, 0.5, per_symbol))
+        for i, c in enumerate(close):
+            c = float(c)
+            rows.append({
+                "symbol": f"SYM{s:04d}USDT",
+                "ts": t0 + timedelta(minutes=i, seconds=59, microseconds=999000),
+                "open": c, "high": c, "low": c, "close": c, "volume": 1.0,
+            })
+    return rows
+
+def _run(Session, fn, rows, chunk_size) -> dict:
+    db = Session()
+    try:
+        db.execute(text("TRUNCATE prices"))
+        db.commit()
+        t0 = time.perf_counter()
+        inserted = sum(fn(db, rows, chunk_size).values())
+        fresh = time.perf_counter() - t0
+        # segunda passada: todas as linhas conflitam (cenário de re-ingestão)
+        t0 = time.perf_counter()
+        fn(db, rows, chunk_size)
+        dup = time.perf_counter() - t0
+    finally:
+        db.close()
+    return {
+        "inserted": inserted,
+        "fresh_seconds": fresh,
+        "fresh_rows_per_sec": len(rows) / fresh,
+        "conflict_seconds": dup,
+        "conflict_rows_per_sec": len(rows) / dup,
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--symbols", type=int, default=10)
+    ap.add_argument("--chunk-size", type=int, default=5000)
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = ap.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    rows = synthetic_rows(args.rows, args.symbols)
+
+    results = {
+        "rows": len(rows),
+        "chunk_size": args.chunk_size,
+        "values": _run(Session, _values_upsert_prices, rows, args.chunk_size),
+        "copy": _run(Session, _copy_upsert_prices, rows, args.chunk_size),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
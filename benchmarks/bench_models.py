@@ -0,0 +1,67 @@
+# Backends de modelo lado a lado: tempo de fit, latência de previsão de 1 linha (sklearn × árvores
+# compiladas), vazão em lote e MAE/RMSE no mesmo split temporal do treino.
+# Uso: python -m benchmarks.bench_models --rows 5000,50000
+from __future__ import annotations
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+
+from api.features import FEATURES, build_features
+from api.model_backends import BACKENDS, compile_model, make_model
+from benchmarks.bench_features import synthetic_long
+
+def _p50(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return float(np.median(samples))
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="5000,50000")
+    ap.add_argument("--backends", default=",".join(BACKENDS))
+    ap.add_argument("--repeat", type=int, default=500)
+    args = ap.parse_args()
+
+    results = []
+    for n in (int(x) for x in args.rows.split(",")):
+        X, y = build_features(synthetic_long(1, n)[["ts", "close"]])
+        split = int(len(X) * 0.8)
+        X_train, X_val, y_train, y_val = X.iloc[:split], X.iloc[split:], y.iloc[:split], y.iloc[split:]
+        one_df = X_val.iloc[:1]
+        one = one_df.to_numpy()
+        for backend in args.backends.split(","):
+            model = make_model(backend)
+            t0 = time.perf_counter()
+            model.fit(X_train, y_train)
+            fit_s = time.perf_counter() - t0
+            preds = model.predict(X_val)
+            compiled = compile_model(model)
+            row = {
+                "rows": n,
+                "backend": backend,
+                "fit_seconds": fit_s,
+                "mae": float(mean_absolute_error(y_val, preds)),
+                "rmse": float(np.sqrt(mean_squared_error(y_val, preds))),
+                # caminho do predict_next antes: DataFrame de 1 linha + estimador do sklearn
+                "predict_1_sklearn_us": _p50(
+                    lambda: model.predict(pd.DataFrame(one, columns=FEATURES)), args.repeat) * 1e6,
+                "predict_batch_sklearn_rows_per_sec": len(X_val) / _p50(lambda: model.predict(X_val), 5),
+            }
+            if compiled is not None:
+                row["predict_1_compiled_us"] = _p50(lambda: compiled.predict(one), args.repeat) * 1e6
+                row["predict_batch_compiled_rows_per_sec"] = len(X_val) / _p50(
+                    lambda: compiled.predict(X_val.to_numpy()), 5)
+                row["compiled_max_abs_diff"] = float(np.abs(compiled.predict(X_val.to_numpy()) - preds).max())
+                row["n_trees"] = compiled.n_trees
+            results.append(row)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Compara a leitura dos "últimos N fechamentos" no layout antigo (heap única, NUMERIC)
+# com o layout atual (particionado por mês, DOUBLE PRECISION, índice de cobertura).
+# Uso: DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.bench_prices_read --rows 2000000 --symbols 4
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base
+from api.ingest import _copy_upsert_prices
+from api.loader import load_prices
+from benchmarks.bench_ingest_write import synthetic_rows
+
+LEGACY_DDL = """
+CREATE TABLE prices_legacy_bench (
+id BIGSERIAL PRIMARY KEY,
+symbol TEXT NOT NULL,
+ts TIMESTAMPTZ NOT NULL,
+open NUMERIC(18,8),
+high NUMERIC(18,8),
+low NUMERIC(18,8),
+close NUMERIC(18,8) NOT NULL,
+volume NUMERIC(18,8),
+CONSTRAINT uq_prices_legacy_bench_symbol_ts UNIQUE(symbol, ts)
+)
+"""
+
+LATEST_SQL = "SELECT ts, close FROM {table} WHERE symbol = %s ORDER BY ts DESC LIMIT %s"
+
+def _median_seconds(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+def _fetch_latest(db, table: str, symbol: str, n: int) -> list[float]:
+    raw = db.connection().connection
+    with raw.cursor() as cur:
+        cur.execute(LATEST_SQL.format(table=table), (symbol, n))
+        # no layout antigo cada close chega como Decimal e passa por float() um a um
+        return [float(c) for _, c in cur.fetchall()]
+
+def _setup(Session, rows: list[dict], chunk_size: int) -> None:
+    db = Session()
+    try:
+        db.execute(text("TRUNCATE prices"))
+        db.execute(text("DROP TABLE IF EXISTS prices_legacy_bench"))
+        db.execute(text(LEGACY_DDL))
+        db.commit()
+        _copy_upsert_prices(db, rows, chunk_size)
+        db.execute(text(
+            "INSERT INTO prices_legacy_bench (symbol, ts, open, high, low, close, volume) "
+            "SELECT symbol, ts, open, high, low, close, volume FROM prices ORDER BY symbol, ts"
+        ))
+        db.commit()
+        db.execute(text("ANALYZE prices"))
+        db.execute(text("ANALYZE prices_legacy_bench"))
+        db.commit()
+    finally:
+        db.close()
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--symbols", type=int, default=4)
+    ap.add_argument("--sizes", default="5000,500000")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--chunk-size", type=int, default=50_000)
+    ap.add_argument("--keep", action="store_true", help="não apaga prices_legacy_bench no final")
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    args = ap.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    rows = synthetic_rows(args.rows, args.symbols)
+    symbol = rows[0]["symbol"]
+    _setup(Session, rows, args.chunk_size)
+
+    results: dict = {"rows": len(rows), "symbols": args.symbols, "repeat": args.repeat, "loads": {}}
+    db = Session()
+    try:
+        for n in (int(x) for x in args.sizes.split(",")):
+            results["loads"][n] = {
+                "legacy_seconds": _median_seconds(lambda: _fetch_latest(db, "prices_legacy_bench", symbol, n), args.repeat),
+                "partitioned_seconds": _median_seconds(lambda: _fetch_latest(db, "prices", symbol, n), args.repeat),
+                "loader_seconds": _median_seconds(lambda: load_prices(db, symbol, ("ts", "close"), limit=n), args.repeat),
+            }
+        if not args.keep:
+            db.execute(text("DROP TABLE IF EXISTS prices_legacy_bench"))
+            db.commit()
+    finally:
+        db.close()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# Suíte offline dos caminhos quentes: ingestão, features, treino e previsão.
+# Usa gerador sintético de preços, SQLite temporário (ou --database-url) e um servidor de klines local.
+# Uso:
+#   python -m benchmarks.suite --out benchmarks/results/atual.json
+#   python -m benchmarks.suite --quick --compare benchmarks/results/base.json --threshold 0.25
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from api import ingest, predict
+from api.db import Base
+from api.feature_state import FEATURE_STATES
+from api.feature_store import FeatureStore
+from api.features import build_features, build_features_long
+from api.loader import PostgresPriceSource
+from api.model_store import ModelStore
+from api.registry import ModelRegistry
+from api.train import train_model
+from benchmarks.bench_features import synthetic_long
+
+T0_MS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+
+SIZES = {
+    "ingest": [1_000, 10_000],
+    "features": [1_000, 5_000, 50_000],
+    "features_long": [10, 100],
+    "train": [1_000, 5_000],
+    "predict": [5_000],
+}
+QUICK_SIZES = {
+    "ingest": [1_000],
+    "features": [1_000, 5_000],
+    "features_long": [10],
+    "train": [1_000],
+    "predict": [1_000],
+}
+
+def synthetic_close(symbol: str, n: int, seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng([seed, sum(symbol.encode())])
+    return 100 + np.cumsum(rng.normal(0, 0.5, n))
+
+class _KlineHandler(BaseHTTPRequestHandler):
+    # mesmo formato da Binance (/api/v3/klines), com startTime/limit e candles de 1m
+    n_candles = 0
+    _closes: dict[str, np.ndarray] = {}
+
+    def do_GET(self):
+        qs = parse_qs(urlparse(self.path).query)
+        symbol, limit = qs["symbol"][0], int(qs["limit"][0])
+        n = type(self).n_candles
+        closes = self._closes.get(symbol)
+        if closes is None or len(closes) < n:
+            closes = self._closes[symbol] = synthetic_close(symbol, max(n, 1) * 2)
+        if "startTime" in qs:
+            start = max(0, -(-(int(qs["startTime"][0]) - T0_MS) // 60_000))
+        else:
+            start = max(0, n - limit)
+        end = min(n, start + limit)
+        klines = []
+        for i in range(start, end):
+            c = f"{closes[i]:.8f}"
+            open_ms = T0_MS + i * 60_000
+            klines.append([open_ms, c, c, c, c, "1.0", open_ms + 59_999])
+        body = json.dumps(klines).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+@contextmanager
+def kline_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KlineHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/api/v3/klines"
+    finally:
+        server.shutdown()
+
+@contextmanager
+def patched(obj, **attrs):
+    old = {k: getattr(obj, k) for k in attrs}
+    for k, v in attrs.items():
+        setattr(obj, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(obj, k, v)
+
+def summarize(samples: list[float], rows: int) -> dict:
+    arr = np.asarray(samples)
+    p50 = float(np.percentile(arr, 50))
+    return {
+        "n": len(samples),
+        "mean_ms": float(arr.mean() * 1000),
+        "p50_ms": p50 * 1000,
+        "p95_ms": float(np.percentile(arr, 95) * 1000),
+        "p99_ms": float(np.percentile(arr, 99) * 1000),
+        "rows": rows,
+        "rows_per_sec": rows / p50 if p50 > 0 else None,
+    }
+
+def timed(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+class Env:
+    # banco e diretórios descartáveis por execução
+    def __init__(self, database_url: Optional[str]) -> None:
+        self.tmpdir = tempfile.mkdtemp(prefix="bench-")
+        url = database_url or f"sqlite:///{os.path.join(self.tmpdir, 'bench.db')}"
+        self.engine = create_engine(url)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def reset_db(self) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM prices"))
+            conn.execute(text("DELETE FROM model_metrics"))
+        ingest.WATERMARKS.reset()
+        ingest.PRICES_CACHE.invalidate()
+
+    def path(self, *parts: str) -> str:
+        return os.path.join(self.tmpdir, *parts)
+
+    def close(self) -> None:
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+def bench_ingest(env: Env, sizes: list[int], repeat: int, symbols: int = 4) -> dict:
+    out = {}
+    syms = [f"SYM{i:04d}USDT" for i in range(symbols)]
+    with kline_server() as url:
+        source = ingest.BinanceKlineSource(base_url=url, rate_limit=0)
+        for n in sizes:
+            _KlineHandler.n_candles = n
+            db = env.Session()
+
+            def backfill_setup():
+                env.reset_db()
+                for sym in syms:
+                    ingest.WATERMARKS.advance(sym, "1m", datetime.fromtimestamp((T0_MS - 1) / 1000, tz=timezone.utc))
+
+            # backfill: todos os candles de todos os símbolos, paginados pelo watermark
+            # (até INGEST_MAX_PAGES páginas de KLINES_PAGE_SIZE por símbolo)
+            samples = timed(lambda: ingest.run_ingestion_many(db, syms, source=source), max(1, repeat // 3),
+                            setup=backfill_setup)
+            out[f"backfill/{n}"] = summarize(samples, n * symbols)
+
+            # regime: um candle novo por símbolo a cada execução
+            def tick():
+                _KlineHandler.n_candles += 1
+            samples = timed(lambda: ingest.run_ingestion_many(db, syms, source=source), repeat, setup=tick)
+            out[f"tick/{n}"] = summarize(samples, symbols)
+            db.close()
+    return out
+
+def bench_features(sizes: list[int], repeat: int) -> dict:
+    out = {}
+    for n in sizes:
+        df = synthetic_long(1, n)[["ts", "close"]]
+        out[str(n)] = summarize(timed(lambda: build_features(df), repeat), n)
+    return out
+
+def bench_features_long(sizes: list[int], repeat: int, rows: int = 5_000) -> dict:
+    out = {}
+    for n_symbols in sizes:
+        df = synthetic_long(n_symbols, rows)
+        out[f"{n_symbols}x{rows}"] = summarize(timed(lambda: build_features_long(df), max(1, repeat // 3)),
+                                               n_symbols * rows)
+    return out
+
+def _fill_prices(env: Env, symbol: str, n: int) -> None:
+    env.reset_db()
+    close = synthetic_close(symbol, n)
+    rows = [{
+        "symbol": symbol,
+        "ts": datetime.fromtimestamp((T0_MS + i * 60_000 + 59_999) / 1000, tz=timezone.utc),
+        "open": float(c), "high": float(c), "low": float(c), "close": float(c), "volume": 1.0,
+    } for i, c in enumerate(close)]
+    db = env.Session()
+    try:
+        ingest._upsert_prices(db, rows)
+    finally:
+        db.close()
+
+def bench_train(env: Env, sizes: list[int], repeat: int) -> dict:
+    out = {}
+    for n in sizes:
+        _fill_prices(env, "BTCUSDT", n)
+        store = ModelStore(env.path(f"models-{n}"), registry=ModelRegistry())
+        db = env.Session()
+        try:
+            # sem feature store: mede features + fit a partir dos preços
+            cold = timed(lambda: train_model(db, "BTCUSDT", store=store, features=None,
+                                             source=PostgresPriceSource(db)), max(1, repeat // 3))
+            out[f"prices/{n}"] = summarize(cold, n)
+            features = FeatureStore(env.path(f"features-{n}"))
+            features.update(db, "BTCUSDT")
+            warm = timed(lambda: train_model(db, "BTCUSDT", store=store, features=features), max(1, repeat // 3))
+            out[f"feature_store/{n}"] = summarize(warm, n)
+        finally:
+            db.close()
+    return out
+
+def bench_predict(env: Env, sizes: list[int], repeat: int) -> dict:
+    out = {}
+    for n in sizes:
+        _fill_prices(env, "BTCUSDT", n)
+        registry = ModelRegistry()
+        store = ModelStore(env.path(f"predict-models-{n}"), registry=registry)
+        features = FeatureStore(env.path(f"predict-features-{n}"))
+        db = env.Session()
+        try:
+            train_model(db, "BTCUSDT", store=store, features=features)
+            with patched(predict, MODEL_STORE=store, FEATURE_STORE=features):
+                FEATURE_STATES.drop("BTCUSDT")
+                predict._MEMO.clear()
+                cold = timed(lambda: predict.predict_next(db, "BTCUSDT"), 1)
+                out[f"cold/{n}"] = summarize(cold, 1)
+                fresh = timed(lambda: predict.predict_next(db, "BTCUSDT"), repeat, setup=predict._MEMO.clear)
+                out[f"fresh/{n}"] = summarize(fresh, 1)
+                memo = timed(lambda: predict.predict_next(db, "BTCUSDT"), repeat)
+                out[f"memo/{n}"] = summarize(memo, 1)
+                FEATURE_STATES.drop("BTCUSDT")
+        finally:
+            db.close()
+    return out
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run(sizes: dict, repeat: int, database_url: Optional[str] = None, stages: Optional[list[str]] = None) -> dict:
+    stages = stages or list(sizes)
+    env = Env(database_url)
+    results: dict = {}
+    try:
+        if "ingest" in stages:
+            results["ingest"] = bench_ingest(env, sizes["ingest"], repeat)
+        if "features" in stages:
+            results["features"] = bench_features(sizes["features"], repeat)
+        if "features_long" in stages:
+            results["features_long"] = bench_features_long(sizes["features_long"], repeat)
+        if "train" in stages:
+            results["train"] = bench_train(env, sizes["train"], repeat)
+        if "predict" in stages:
+            results["predict"] = bench_predict(env, sizes["predict"], repeat)
+    finally:
+        env.close()
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": "sqlite" if database_url is None else create_engine(database_url).dialect.name,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = 0.2, metric: str = "p50_ms") -> list[dict]:
+    # regressão: a métrica ficou mais de `threshold` (fração) acima da linha de base
+    regressions = []
+    for stage, cases in current["results"].items():
+        for case, stats in cases.items():
+            base = baseline.get("results", {}).get(stage, {}).get(case)
+            if not base or not base.get(metric):
+                continue
+            ratio = stats[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append({
+                    "stage": stage, "case": case, "metric": metric,
+                    "baseline": base[metric], "current": stats[metric], "ratio": ratio,
+                })
+    return regressions
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--quick", action="store_true", help="tamanhos menores (CI)")
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--stages", default=",".join(SIZES))
+    ap.add_argument("--database-url", default=None, help="padrão: SQLite temporário")
+    ap.add_argument("--out", default=None, help="grava o resultado em JSON")
+    ap.add_argument("--compare", default=None, help="JSON de uma execução anterior")
+    ap.add_argument("--threshold", type=float, default=0.2)
+    args = ap.parse_args()
+
+    report = run(QUICK_SIZES if args.quick else SIZES, args.repeat, args.database_url, args.stages.split(","))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.threshold)
+        report["baseline"] = {"path": args.compare, **baseline.get("meta", {})}
+
+    text_out = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text_out)
+    print(text_out)
+    if report.get("regressions"):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
+import json
 import os
+import threading
+import time
 import requests
 import pandas as pd
 import streamlit as st
 
 API_BASE = os.getenv("API_BASE_URL", "http://localhost:8000")
+# redesenho do gráfico a partir do buffer local (não faz requisições)
+LIVE_REFRESH_SECONDS = float(os.getenv("LIVE_REFRESH_SECONDS", "2"))
 
 st.set_page_config(page_title="Tech Challenge — Cripto", layout="wide")
 
@@ -13,6 +18,113 @@ SYMBOL = st.sidebar.text_input("Symbol", value="BTCUSDT")
 N_POINTS = st.sidebar.number_input("Pontos (últimos N)", min_value=50, max_value=2000, value=720, step=10)
 LIMIT = st.sidebar.number_input("Limit (ingestão manual)", min_value=50, max_value=1000, value=1000, step=50)
 INTERVAL = st.sidebar.selectbox("Intervalo", options=["1m", "3m", "5m", "15m", "30m", "1h"], index=0)
+# períodos longos vêm agregados pela API (/prices/range); "Ao vivo" usa o feed em push
+PERIODS = {"Ao vivo": None, "24 horas": 1, "7 dias": 7, "30 dias": 30, "1 ano": 365}
+PERIOD_DAYS = PERIODS[st.sidebar.selectbox("Período", options=list(PERIODS), index=0)]
+RANGE_POINTS = 800
+
+def wait_job(resp, timeout: float = 300):
+    # /train e /export respondem 202 com o id do job; acompanha até terminar
+    job = resp.json()
+    if resp.status_code != 202:
+        return job
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = requests.get(f"{API_BASE}/jobs/{job['job_id']}", timeout=10).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(1)
+    return job
+
+class LiveFeed:
+    # lê /stream/prices numa thread: snapshot ao conectar e depois só candles novos e previsões;
+    # a tela redesenha a partir deste buffer, então a carga na API acompanha os candles, não os reruns
+    def __init__(self, symbol: str, n: int) -> None:
+        self.symbol, self.n = symbol, n
+        self.lock = threading.Lock()
+        self.points: dict[str, float] = {}
+        self.prediction = None
+        self.connected = False
+        self.error = None
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                with requests.get(f"{API_BASE}/stream/prices", params={"symbol": self.symbol, "n": self.n},
+                                  stream=True, timeout=(10, 60)) as r:
+                    r.raise_for_status()
+                    self.connected, self.error, backoff = True, None, 1
+                    event, data = None, []
+                    for line in r.iter_lines(decode_unicode=True):
+                        if self._stop.is_set():
+                            return
+                        if not line:
+                            if event and data:
+                                self._apply(event, json.loads("\n".join(data)))
+                            event, data = None, []
+                        elif line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data.append(line[5:].strip())
+            except Exception as e:
+                self.error = str(e)
+            # fim do stream (resync ou queda): reconecta e recebe snapshot novo
+            self.connected = False
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _apply(self, event: str, body: dict) -> None:
+        with self.lock:
+            if event == "snapshot":
+                self.points = {p["ts"]: p["close"] for p in body.get("data", [])}
+            elif event == "candles":
+                # candle já recebido no snapshot chega de novo: chave por ts descarta a duplicata
+                for p in body["data"]:
+                    self.points[p["ts"]] = p["close"]
+                extra = len(self.points) - self.n
+                if extra > 0:
+                    for ts in sorted(self.points)[:extra]:
+                        del self.points[ts]
+            elif event == "prediction":
+                self.prediction = body
+
+    def frame(self):
+        with self.lock:
+            df = pd.DataFrame(sorted(self.points.items()), columns=["ts", "close"])
+            return df, self.prediction
+
+def range_frame(symbol: str, days: int) -> pd.DataFrame:
+    # início arredondado para a hora: a URL se repete entre reruns e a API responde 304 pelo ETag
+    start = (pd.Timestamp.now(tz="UTC") - pd.Timedelta(days=days)).floor("h")
+    params = {"symbol": symbol, "start": start.isoformat(), "max_points": RANGE_POINTS}
+    cache_key = f"range:{symbol}:{start.isoformat()}"
+    cached = st.session_state.get(cache_key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    r = requests.get(f"{API_BASE}/prices/range", params=params, headers=headers, timeout=30)
+    if r.status_code == 304 and cached:
+        js = cached[1]
+    else:
+        r.raise_for_status()
+        js = r.json()
+        if r.headers.get("ETag"):
+            st.session_state[cache_key] = (r.headers["ETag"], js)
+    df = pd.DataFrame(js.get("data", []), columns=["ts", "close"])
+    df["ts"] = pd.to_datetime(df["ts"])
+    return df
+
+def live_feed(symbol: str, n: int) -> LiveFeed:
+    feed = st.session_state.get("live_feed")
+    if feed is None or (feed.symbol, feed.n) != (symbol, n):
+        if feed is not None:
+            feed.stop()
+        feed = st.session_state["live_feed"] = LiveFeed(symbol, n)
+    return feed
 
 st.title("Tech Challenge — Preço e Predição (real-time)")
 
@@ -34,8 +146,14 @@ with col1:
 with col2:
     if st.button("Treinar modelo", use_container_width=True):
         try:
-            r = requests.post(f"{API_BASE}/train", params={"symbol": SYMBOL}, timeout=180)
-            st.toast(f"Train: {r.json()}", icon="✅")
+            r = requests.post(f"{API_BASE}/train", params={"symbol": SYMBOL}, timeout=30)
+            with st.spinner("Treinando..."):
+                job = wait_job(r)
+            if job.get("status") == "failed":
+                st.error(f"Falha ao treinar: {job['error']}")
+            else:
+                st.toast(f"Train: {job.get('result', job)}", icon="✅")
+                st.session_state.pop("metrics", None)
         except Exception as e:
             st.error(f"Falha ao treinar: {e}")
 
@@ -54,37 +172,38 @@ with col3:
 
 st.divider()
 
-# Gráfico de preços recentes
-st.subheader(f"Preço — {SYMBOL}")
-try:
-    r = requests.get(f"{API_BASE}/prices/latest", params={"symbol": SYMBOL, "n": N_POINTS}, timeout=30)
-    js = r.json()
-    df = pd.DataFrame(js.get("data", []))
-    if not df.empty:
-        df["ts"] = pd.to_datetime(df["ts"])
-        st.line_chart(df.set_index("ts")["close"])
-    else:
-        st.info("Sem dados ainda. Clique em **Ingerir agora**.")
-except Exception as e:
-    st.warning(f"API indisponível para /prices/latest: {e}")
-
-# Bloco de predição rápida + timestamps
-st.subheader("Predição rápida")
-pr = st.session_state.get("last_predict")
-if pr:
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        st.metric("Último fechamento", f"{pr['last_close']:.2f}")
-    with c2:
-        st.metric("Próximo fechamento (previsto)", f"{pr['predicted_next_close']:.2f}")
-    with c3:
-        st.metric("Delta previsto", f"{pr['delta']:.2f}", f"{pr['delta_pct']*100:.3f}%")
-    st.caption(f"Modelo: {pr['model_version']} • Dados até: {pr['last_ts']} • Previsto em: {pr['predicted_at']}")
-else:
+# Gráfico de preços recentes e predição: vêm do feed em push, redesenhados só neste trecho
+feed = live_feed(SYMBOL, int(N_POINTS))
+
+if PERIOD_DAYS:
+    # período longo: redesenha só em reruns (interação), não a cada atualização do feed
+    st.subheader(f"Preço — {SYMBOL} ({PERIOD_DAYS} d)")
     try:
-        r = requests.post(f"{API_BASE}/predict", params={"symbol": SYMBOL}, timeout=30)
-        pr = r.json()
-        st.session_state["last_predict"] = pr
+        df = range_frame(SYMBOL, PERIOD_DAYS)
+        if not df.empty:
+            st.line_chart(df.set_index("ts")["close"])
+        else:
+            st.info("Sem dados no período.")
+    except Exception as e:
+        st.warning(f"API indisponível para /prices/range: {e}")
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_panel():
+    df, pr = feed.frame()
+    if not PERIOD_DAYS:
+        st.subheader(f"Preço — {SYMBOL}")
+        if not df.empty:
+            df["ts"] = pd.to_datetime(df["ts"])
+            st.line_chart(df.set_index("ts")["close"])
+        elif feed.error:
+            st.warning(f"API indisponível para /stream/prices: {feed.error}")
+        else:
+            st.info("Sem dados ainda. Clique em **Ingerir agora**.")
+
+    # Bloco de predição rápida + timestamps (a do botão vale até chegar uma do feed)
+    st.subheader("Predição rápida")
+    pr = pr or st.session_state.get("last_predict")
+    if pr:
         c1, c2, c3 = st.columns(3)
         with c1:
             st.metric("Último fechamento", f"{pr['last_close']:.2f}")
@@ -93,24 +212,33 @@ else:
         with c3:
             st.metric("Delta previsto", f"{pr['delta']:.2f}", f"{pr['delta_pct']*100:.3f}%")
         st.caption(f"Modelo: {pr['model_version']} • Dados até: {pr['last_ts']} • Previsto em: {pr['predicted_at']}")
-    except Exception:
+    else:
         st.info("Treine o modelo para visualizar a predição.")
 
+live_panel()
+
 with st.sidebar:
     if st.button("Exportar Parquet (data lake)"):
         try:
-            r = requests.post(f"{API_BASE}/export/parquet", params={"symbol": SYMBOL, "n": 20000}, timeout=120)
-            st.success(r.json())
+            r = requests.post(f"{API_BASE}/export/parquet", params={"symbol": SYMBOL, "n": 20000}, timeout=30)
+            with st.spinner("Exportando..."):
+                job = wait_job(r)
+            if job.get("status") == "failed":
+                st.error(f"Falha ao exportar: {job['error']}")
+            else:
+                st.success(job.get("result", job))
         except Exception as e:
             st.error(f"Falha ao exportar: {e}")
 
 
 st.subheader("Métricas do Modelo")
 try:
-    r = requests.get(f"{API_BASE}/metrics", params={"limit": 50}, timeout=30)
-    items = r.json().get("items", [])
+    # só mudam com um treino: busca uma vez por sessão e de novo depois de treinar
+    if "metrics" not in st.session_state:
+        r = requests.get(f"{API_BASE}/metrics", params={"limit": 50}, timeout=30)
+        st.session_state["metrics"] = r.json().get("items", [])
+    items = st.session_state["metrics"]
     if items:
-        import pandas as pd
         st.dataframe(pd.DataFrame(items))
     else:
         st.info("Sem métricas registradas ainda.")
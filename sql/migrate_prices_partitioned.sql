@@ -0,0 +1,55 @@
+-- Migra a tabela prices antiga (heap única, NUMERIC(18,8), id BIGSERIAL) para o layout
+-- particionado por mês com DOUBLE PRECISION. Rodar com a API parada:
+--   psql "$DATABASE_URL" -f sql/migrate_prices_partitioned.sql
+-- A tabela antiga fica como prices_legacy; apague-a depois de conferir as contagens.
+
+BEGIN;
+
+-- limites das partições em UTC, como em api/db.py
+SET LOCAL TIME ZONE 'UTC';
+
+ALTER TABLE prices RENAME TO prices_legacy;
+ALTER TABLE prices_legacy RENAME CONSTRAINT uq_prices_symbol_ts TO uq_prices_legacy_symbol_ts;
+
+CREATE TABLE prices (
+symbol VARCHAR(32) NOT NULL,
+ts TIMESTAMPTZ NOT NULL,
+open DOUBLE PRECISION,
+high DOUBLE PRECISION,
+low DOUBLE PRECISION,
+close DOUBLE PRECISION NOT NULL,
+volume DOUBLE PRECISION,
+CONSTRAINT uq_prices_symbol_ts PRIMARY KEY (symbol, ts)
+) PARTITION BY RANGE (ts);
+
+CREATE INDEX ix_prices_symbol_ts_close ON prices (symbol, ts DESC) INCLUDE (close);
+
+-- uma partição por mês presente nos dados, até o mês seguinte ao atual
+DO $$
+DECLARE
+    m TIMESTAMPTZ;
+    last_m TIMESTAMPTZ;
+BEGIN
+    SELECT date_trunc('month', COALESCE(min(ts), now())) INTO m FROM prices_legacy;
+    last_m := date_trunc('month', now()) + interval '1 month';
+    WHILE m <= last_m LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF prices FOR VALUES FROM (%L) TO (%L)',
+            'prices_' || to_char(m, 'YYYYMM'), m, m + interval '1 month'
+        );
+        m := m + interval '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO prices (symbol, ts, open, high, low, close, volume)
+SELECT symbol, ts, open::float8, high::float8, low::float8, close::float8, volume::float8
+FROM prices_legacy
+ORDER BY symbol, ts;
+
+ANALYZE prices;
+
+COMMIT;
+
+-- Conferência:
+--   SELECT (SELECT count(*) FROM prices) AS novo, (SELECT count(*) FROM prices_legacy) AS antigo;
+-- DROP TABLE prices_legacy;
@@ -1,13 +1,31 @@
 CREATE TABLE IF NOT EXISTS prices (
-id BIGSERIAL PRIMARY KEY,
-symbol TEXT NOT NULL,
+symbol VARCHAR(32) NOT NULL,
+ts TIMESTAMPTZ NOT NULL,
+open DOUBLE PRECISION,
+high DOUBLE PRECISION,
+low DOUBLE PRECISION,
+close DOUBLE PRECISION NOT NULL,
+volume DOUBLE PRECISION,
+CONSTRAINT uq_prices_symbol_ts PRIMARY KEY (symbol, ts)
+) PARTITION BY RANGE (ts);
+
+-- "últimos N fechamentos do símbolo" sai só do índice; criado em cada partição
+CREATE INDEX IF NOT EXISTS ix_prices_symbol_ts_close ON prices (symbol, ts DESC) INCLUDE (close);
+
+-- partições mensais (prices_YYYYMM) são criadas pela API antes de gravar (api/db.py: ensure_partitions)
+
+-- agregados OHLCV por resolução (ROLLUP_RESOLUTIONS), mantidos na ingestão (api/rollups.py)
+CREATE TABLE IF NOT EXISTS price_rollups (
+symbol VARCHAR(32) NOT NULL,
+resolution VARCHAR(8) NOT NULL,
 ts TIMESTAMPTZ NOT NULL,
-open NUMERIC(18,8),
-high NUMERIC(18,8),
-low NUMERIC(18,8),
-close NUMERIC(18,8) NOT NULL,
-volume NUMERIC(18,8),
-CONSTRAINT uq_prices_symbol_ts UNIQUE(symbol, ts)
+open DOUBLE PRECISION,
+high DOUBLE PRECISION,
+low DOUBLE PRECISION,
+close DOUBLE PRECISION NOT NULL,
+volume DOUBLE PRECISION,
+candles INTEGER NOT NULL,
+CONSTRAINT uq_price_rollups_symbol_res_ts PRIMARY KEY (symbol, resolution, ts)
 );
 
 
@@ -18,4 +36,23 @@ train_end_ts TIMESTAMPTZ NOT NULL,
 mae DOUBLE PRECISION,
 rmse DOUBLE PRECISION,
 created_at TIMESTAMPTZ DEFAULT NOW()
-);
\ No newline at end of file
+);
+-- previsões servidas, resolvidas com o fechamento realizado na ingestão (api/predlog.py)
+CREATE TABLE IF NOT EXISTS prediction_log (
+id BIGSERIAL PRIMARY KEY,
+symbol VARCHAR(32) NOT NULL,
+interval VARCHAR(8) NOT NULL,
+model_version VARCHAR(64) NOT NULL,
+base_ts TIMESTAMPTZ NOT NULL,
+target_ts TIMESTAMPTZ NOT NULL,
+predicted DOUBLE PRECISION NOT NULL,
+last_close DOUBLE PRECISION NOT NULL,
+predicted_at TIMESTAMPTZ NOT NULL,
+actual DOUBLE PRECISION,
+resolved_at TIMESTAMPTZ,
+-- uma linha por previsão (o índice único atende o ON CONFLICT DO NOTHING do flush)
+CONSTRAINT uq_prediction_log_key UNIQUE (symbol, interval, model_version, base_ts)
+);
+
+-- resolução: previsões do símbolo cujo alvo é um candle recém-gravado
+CREATE INDEX IF NOT EXISTS ix_prediction_log_symbol_target ON prediction_log (symbol, target_ts);
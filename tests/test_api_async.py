@@ -0,0 +1,85 @@
+import os
+import tempfile
+import threading
+import time
+
+import pandas as pd
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base, Price, ModelMetric, get_async_db, get_db
+from api.jobs import JobManager
+from api.main import app
+from api.response_cache import PRICES_CACHE
+
+def _client(path):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+        db.add_all([Price(symbol="BTCUSDT", ts=(t0 + pd.Timedelta(minutes=i)).to_pydatetime(), close=100 + i)
+                    for i in range(10)])
+        db.add(ModelMetric(model_version="v1", train_end_ts=t0.to_pydatetime(), mae=1.0, rmse=2.0))
+        db.commit()
+    async_session = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+    def _db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def _async_db():
+        async with async_session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = _db
+    app.dependency_overrides[get_async_db] = _async_db
+    return TestClient(app)
+
+def test_read_paths_use_async_session():
+    with tempfile.TemporaryDirectory() as tmp:
+        PRICES_CACHE.invalidate()
+        client = _client(os.path.join(tmp, "api.db"))
+        try:
+            r = client.get("/prices/latest", params={"symbol": "BTCUSDT", "n": 3})
+            assert r.status_code == 200
+            assert [p["close"] for p in r.json()["data"]] == [107.0, 108.0, 109.0]
+            r2 = client.get("/prices/latest", params={"symbol": "BTCUSDT", "n": 3},
+                            headers={"If-None-Match": r.headers["ETag"]})
+            assert r2.status_code == 304
+            assert client.get("/metrics").json()["items"][0]["model_version"] == "v1"
+            assert client.get("/jobs/nao-existe").status_code == 404
+        finally:
+            app.dependency_overrides.clear()
+            PRICES_CACHE.invalidate()
+
+def test_job_manager_runs_in_background_and_dedupes():
+    release = threading.Event()
+    closed = []
+
+    class _Db:
+        def close(self):
+            closed.append(True)
+
+    jobs = JobManager(max_workers=1, session_factory=_Db)
+    try:
+        first = jobs.submit("train", lambda db: release.wait(5) and {"ok": True}, {"symbol": "BTCUSDT"})
+        again = jobs.submit("train", lambda db: {"ok": False}, {"symbol": "BTCUSDT"})
+        assert again["id"] == first["id"]
+        failing = jobs.submit("export", lambda db: 1 / 0, {"symbol": "BTCUSDT"})
+        release.set()
+        for _ in range(100):
+            if jobs.get(failing["id"])["status"] == "failed":
+                break
+            time.sleep(0.02)
+        assert jobs.get(first["id"])["status"] == "succeeded"
+        assert jobs.get(first["id"])["result"] == {"ok": True}
+        assert "division" in jobs.get(failing["id"])["error"]
+        assert len(closed) == 2
+    finally:
+        jobs.shutdown()
@@ -0,0 +1,17 @@
+from benchmarks.suite import compare, summarize
+
+def _report(**p50):
+    return {"results": {"predict": {k: {"p50_ms": v} for k, v in p50.items()}}}
+
+def test_summarize_percentiles():
+    s = summarize([0.001] * 99 + [0.1], rows=10)
+    assert s["n"] == 100
+    assert abs(s["p50_ms"] - 1.0) < 1e-9
+    assert s["p99_ms"] > s["p95_ms"] >= s["p50_ms"]
+    assert abs(s["rows_per_sec"] - 10_000) < 1e-6
+
+def test_compare_flags_only_regressions():
+    base = _report(fresh=10.0, memo=1.0, cold=5.0)
+    cur = _report(fresh=13.0, memo=1.1, cold=2.0, novo=50.0)
+    out = compare(cur, base, threshold=0.2)
+    assert [(r["case"], round(r["ratio"], 2)) for r in out] == [("fresh", 1.3)]
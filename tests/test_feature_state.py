@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from api.features import build_features
+from api.feature_state import FEATURE_STATES, IncrementalFeatures
+from api.runtime_metrics import FEATURE_RESYNCS
+from api.stream import push_feature_states
+
+def test_incremental_matches_build_features():
+    rng = np.random.default_rng(0)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, 300))
+    ts = pd.date_range("2024-01-01", periods=len(close), freq="min", tz="UTC")
+    df = pd.DataFrame({"ts": ts, "close": close})
+    X, _ = build_features(df)
+
+    state = IncrementalFeatures()
+    rows = []
+    for t, c in zip(ts, close):
+        state.update(t, c)
+        v = state.vector()
+        if v is not None:
+            rows.append(v)
+
+    # build_features descarta a última linha (alvo NaN); o estado incremental também a cobre
+    got = np.asarray(rows[:len(X)])
+    assert len(rows) == len(X) + 1
+    np.testing.assert_allclose(got, X.to_numpy(), rtol=1e-10, atol=1e-12)
+
+def test_incremental_ignores_stale_candles():
+    state = IncrementalFeatures()
+    t0 = pd.Timestamp("2024-01-01", tz="UTC")
+    assert state.update(t0, 1.0)
+    assert not state.update(t0, 2.0)
+    assert state.last_close == 1.0 and state.out_of_order == 0
+    # candle anterior ao estado: recusado, mas contado para o chamador ressincronizar
+    assert state.update(t0 + pd.Timedelta(minutes=2), 3.0)
+    assert not state.update(t0 + pd.Timedelta(minutes=1), 2.0)
+    assert state.out_of_order == 1 and state.count == 2
+
+def test_push_drops_state_that_missed_a_backfilled_candle():
+    ts = pd.date_range("2024-01-01", periods=20, freq="min", tz="UTC")
+    state, _ = FEATURE_STATES.get_or_create("BTCUSDT")
+    try:
+        state.extend((t, 100.0 + i) for i, t in enumerate(ts[:10]))
+        state.extend((t, 100.0 + i) for i, t in zip(range(11, 14), ts[11:14]))
+        # o candle 10 chega depois (lacuna preenchida pelo REST) junto com o 14
+        rows = [{"symbol": "BTCUSDT", "ts": ts[i], "close": 100.0 + i} for i in (10, 14)]
+        push_feature_states(rows, "1m")
+        assert FEATURE_STATES.get("BTCUSDT") is None
+        assert FEATURE_RESYNCS.value("BTCUSDT", "state") >= 1
+
+        # em ordem, o estado só avança
+        state, _ = FEATURE_STATES.get_or_create("BTCUSDT")
+        state.extend((t, 100.0 + i) for i, t in enumerate(ts[:15]))
+        push_feature_states([{"symbol": "BTCUSDT", "ts": ts[15], "close": 115.0}], "1m")
+        assert FEATURE_STATES.get("BTCUSDT") is state and state.last_ts == ts[15]
+    finally:
+        FEATURE_STATES.drop("BTCUSDT")
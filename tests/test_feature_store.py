@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import api.train
+from api.db import Base, Price, get_db
+from api.feature_store import FeatureStore
+from api.main import app
+from api.runtime_metrics import FEATURE_RESYNCS
+from api.model_store import ModelStore
+from api.registry import ModelRegistry
+from api.features import FEATURES, build_features
+
+def _session(close, t0):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    _add(db, close, t0)
+    return db
+
+def _add(db, close, t0, offset=0):
+    db.add_all([
+        Price(symbol="BTCUSDT", ts=(t0 + pd.Timedelta(minutes=offset + i)).to_pydatetime(), close=float(c))
+        for i, c in enumerate(close)
+    ])
+    db.commit()
+
+def test_store_appends_incrementally_and_matches_build_features():
+    root = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        close = 100 + np.cumsum(rng.normal(0, 0.5, 400))
+        t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+        db = _session(close[:300], t0)
+
+        store = FeatureStore(root, max_rows=1000)
+        assert store.update(db, "BTCUSDT") == 300 - 15
+        _add(db, close[300:], t0, offset=300)
+        assert store.update(db, "BTCUSDT") == 100
+        assert store.update(db, "BTCUSDT") == 0
+
+        ts = pd.date_range(t0, periods=len(close), freq="min")
+        X, y = build_features(pd.DataFrame({"ts": ts, "close": close}))
+        train = FeatureStore(root).training_set("BTCUSDT", limit=10_000)
+        np.testing.assert_allclose(train[FEATURES].to_numpy(), X.to_numpy(), rtol=1e-10, atol=1e-12)
+        np.testing.assert_array_equal(train["y"].to_numpy(), y.to_numpy())
+
+        state = store.state("BTCUSDT")
+        np.testing.assert_allclose(state.vector(), store.get("BTCUSDT").slice(384).to_pandas()[FEATURES].iloc[0])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_store_is_bounded():
+    root = tempfile.mkdtemp()
+    try:
+        db = _session(100 + np.arange(200.0), pd.Timestamp("2024-01-01 00:00:00Z"))
+        store = FeatureStore(root, max_rows=50, max_symbols=1)
+        store.update(db, "BTCUSDT")
+        assert store.get("BTCUSDT").num_rows == 50
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_updates_append_segments_compact_tail_and_trim_whole_segments():
+    root = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(1)
+        close = 100 + np.cumsum(rng.normal(0, 0.5, 300))
+        t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+        db = _session(close[:60], t0)
+        store = FeatureStore(root, max_rows=100, segment_rows=20, compact_every=4)
+        store.update(db, "BTCUSDT")
+        seed = os.path.join(root, "BTCUSDT", sorted(os.listdir(os.path.join(root, "BTCUSDT")))[0])
+        inode = os.stat(seed).st_ino
+
+        for i in range(60, 100):
+            _add(db, close[i:i + 1], t0, offset=i)
+            store.update(db, "BTCUSDT")
+        # o segmento inicial nunca é reescrito pelos appends
+        assert os.stat(seed).st_ino == inode
+        assert store.compactions > 0 and store.segments_written < 1 + 40 + 40 // 4
+
+        for i in range(100, 300):
+            _add(db, close[i:i + 1], t0, offset=i)
+            store.update(db, "BTCUSDT")
+        # corte por segmentos inteiros: fica entre max_rows e max_rows + um segmento
+        assert not os.path.exists(seed)
+        rows = store.get("BTCUSDT").num_rows
+        assert 100 <= rows < 100 + 20 + 4
+        files = os.listdir(os.path.join(root, "BTCUSDT"))
+        assert len(files) == store.stats()["segments"]["BTCUSDT"] <= 100 // 20 + 1 + 4
+
+        ts = pd.date_range(t0, periods=len(close), freq="min")
+        X, y = build_features(pd.DataFrame({"ts": ts, "close": close}))
+        train = FeatureStore(root).training_set("BTCUSDT", limit=10_000)
+        assert len(train) == rows - 1
+        np.testing.assert_allclose(train[FEATURES].to_numpy(), X.to_numpy()[-(rows - 1):], rtol=1e-10, atol=1e-12)
+        np.testing.assert_array_equal(train["y"].to_numpy(), y.to_numpy()[-(rows - 1):])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_train_endpoint_uses_feature_store_for_postgres_source(monkeypatch):
+    root = tempfile.mkdtemp()
+    try:
+        engine = create_engine(f"sqlite:///{os.path.join(root, 'api.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            _add(db, 100 + np.cumsum(np.random.default_rng(1).normal(0, 0.5, 400)), pd.Timestamp("2024-01-01 00:00:00Z"))
+        features = FeatureStore(os.path.join(root, "features"))
+        monkeypatch.setattr(api.train, "FEATURE_STORE", features)
+        monkeypatch.setattr(api.train, "MODEL_STORE", ModelStore(os.path.join(root, "models"), registry=ModelRegistry()))
+
+        def _db():
+            with Session() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = _db
+        r = TestClient(app).post("/train", params={"symbol": "BTCUSDT", "source": "postgres", "wait": True})
+        assert r.status_code == 200
+        assert features.rows_appended == 400 - 15
+        # treinou sobre as linhas do store (com y), não sobre os 400 preços crus
+        assert r.json()["n_rows"] == 400 - 15 - 1
+    finally:
+        app.dependency_overrides.clear()
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_backfilled_candles_behind_the_store_rebuild_its_tail():
+    root = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(2)
+        close = 100 + np.cumsum(rng.normal(0, 0.5, 260))
+        t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+        db = _session(close[:150], t0)
+        _add(db, close[155:220], t0, offset=155)
+        store = FeatureStore(root, max_rows=1000, segment_rows=20, compact_every=4)
+        store.update(db, "BTCUSDT")
+        for lo in range(220, 260, 10):
+            _add(db, close[lo:lo + 10], t0, offset=lo)
+            store.update(db, "BTCUSDT")
+
+        # o buraco 150..154 chega depois: o store volta até ele e recalcula o resto
+        resyncs = FEATURE_RESYNCS.value("BTCUSDT", "store")
+        _add(db, close[150:155], t0, offset=150)
+        assert store.update(db, "BTCUSDT", oldest=(t0 + pd.Timedelta(minutes=150)).to_pydatetime()) == 110
+        assert FEATURE_RESYNCS.value("BTCUSDT", "store") == resyncs + 1
+
+        ts = pd.date_range(t0, periods=len(close), freq="min")
+        X, _ = build_features(pd.DataFrame({"ts": ts, "close": close}))
+        for s in (store, FeatureStore(root)):
+            got = s.get("BTCUSDT").to_pandas()
+            assert len(got) == len(close) - 15
+            # build_features deixa de fora o último candle (sem alvo)
+            np.testing.assert_allclose(got[FEATURES].to_numpy()[:-1], X.to_numpy(), rtol=1e-10, atol=1e-12)
+
+        # candle anterior ao início do store: sem histórico para retomar, o símbolo é refeito do zero
+        before = (t0 - pd.Timedelta(minutes=1)).to_pydatetime()
+        db.add(Price(symbol="BTCUSDT", ts=before, close=100.0))
+        db.commit()
+        assert store.update(db, "BTCUSDT", oldest=before) == len(close) + 1 - 15
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
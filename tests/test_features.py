@@ -1,5 +1,13 @@
+from datetime import timedelta
+
+import numpy as np
 import pandas as pd
-from api.features import build_features
+import pytest
+from fastapi.testclient import TestClient
+
+from api.db import get_db
+from api.features import build_features, build_features_long, interval_delta, FEATURES
+from api.main import app
 
 def test_build_features_minimal():
     data = [{"ts": pd.Timestamp(f"2024-01-01 00:{i:02d}:00Z"), "close": 100 + i} for i in range(20)]
@@ -10,3 +18,53 @@ def test_build_features_minimal():
     assert X.index.max() == y.index.max()
     assert not X.isna().any().any()
     assert not y.isna().any()
+
+def _reference(df):
+    # implementação original, um símbolo por vez
+    df = df.sort_values("ts").reset_index(drop=True)
+    c = df["close"]
+    df["ret_1"], df["ret_5"], df["ret_15"] = c.pct_change(1), c.pct_change(5), c.pct_change(15)
+    df["sma_5"], df["sma_15"] = c.rolling(5).mean(), c.rolling(15).mean()
+    df["ema_5"], df["ema_15"] = c.ewm(span=5, adjust=False).mean(), c.ewm(span=15, adjust=False).mean()
+    df["std_15"] = c.rolling(15).std()
+    df["y"] = c.shift(-1)
+    df = df.dropna().reset_index(drop=True)
+    return df[FEATURES], df["y"]
+
+def test_build_features_long_matches_single_symbol():
+    rng = np.random.default_rng(1)
+    frames = []
+    for s in range(3):
+        close = 100 + np.cumsum(rng.normal(0, 0.5, 200 + 10 * s))
+        ts = pd.date_range("2024-01-01", periods=len(close), freq="min", tz="UTC")
+        frames.append(pd.DataFrame({"symbol": f"S{s}", "ts": ts, "close": close}))
+    long = pd.concat(frames).sample(frac=1, random_state=0)
+
+    out = build_features_long(long)
+    for s, frame in enumerate(frames):
+        X_ref, y_ref = _reference(frame[["ts", "close"]].copy())
+        got = out[out["symbol"] == f"S{s}"]
+        assert np.array_equal(got[FEATURES].to_numpy(), X_ref.to_numpy())
+        assert np.array_equal(got["y"].to_numpy(), y_ref.to_numpy())
+
+    X, y = build_features(frames[0][["ts", "close"]])
+    pd.testing.assert_frame_equal(X, _reference(frames[0][["ts", "close"]].copy())[0])
+
+def test_interval_delta_handles_fixed_binance_intervals_and_rejects_monthly():
+    assert interval_delta("1s") == timedelta(seconds=1)
+    assert interval_delta("15m") == timedelta(minutes=15)
+    assert interval_delta("4h") == timedelta(hours=4)
+    assert interval_delta("3d") == timedelta(days=3)
+    assert interval_delta("1w") == timedelta(weeks=1)
+    for bad in ("1M", "m", "0m", "1x", ""):
+        with pytest.raises(ValueError):
+            interval_delta(bad)
+
+    app.dependency_overrides[get_db] = lambda: None
+    try:
+        client = TestClient(app)
+        r = client.post("/predict/batch", params={"symbols": "BTCUSDT", "interval": "1M"})
+        assert r.status_code == 400 and "1M" in r.json()["detail"]
+        assert client.post("/predict", params={"ingest_interval": "1M", "ingest": False}).status_code == 400
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,200 @@
+import csv
+import json
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from api import ingest
+from api.db import Base, Price, get_db
+from api.main import API_INTERVAL, app
+
+def _kline(open_ms, close):
+    return [open_ms, str(close), str(close), str(close), str(close), "1.0", open_ms + 59_999]
+
+class _StubHandler(BaseHTTPRequestHandler):
+    n_candles = 8
+
+    def do_GET(self):
+        qs = parse_qs(urlparse(self.path).query)
+        if qs["symbol"][0] == "BADUSDT":
+            self.send_response(400)
+            self.end_headers()
+            return
+        limit = int(qs["limit"][0])
+        klines = [_kline(i * 60_000, 100 + i) for i in range(self.n_candles)]
+        if "startTime" in qs:
+            klines = [k for k in klines if k[0] >= int(qs["startTime"][0])][:limit]
+        else:
+            klines = klines[-limit:]
+        body = json.dumps(klines).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        pass
+
+class _MemWatermarks(ingest.Watermarks):
+    def get(self, db, symbol):
+        return self._marks.get(symbol)
+
+def test_run_ingestion_many_against_stub(monkeypatch):
+    server = HTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/api/v3/klines"
+        source = ingest.BinanceKlineSource(base_url=url, rate_limit=0)
+        upserts = []
+        monkeypatch.setattr(ingest, "WATERMARKS", _MemWatermarks())
+        monkeypatch.setattr(ingest, "_upsert_prices",
+                            lambda db, rows: upserts.append(rows) or Counter(r["symbol"] for r in rows))
+
+        out = ingest.run_ingestion_many(None, ["BTCUSDT", "ETHUSDT", "BADUSDT"], limit=5, source=source)
+
+        assert out["fetched"] == {"BTCUSDT": 5, "ETHUSDT": 5}
+        assert set(out["errors"]) == {"BADUSDT"}
+        assert len(upserts) == 1 and len(upserts[0]) == 10
+
+        # com watermark, só os candles novos são buscados
+        _StubHandler.n_candles = 10
+        out = ingest.run_ingestion_many(None, ["BTCUSDT"], limit=5, source=source)
+        assert out["fetched"] == {"BTCUSDT": 2}
+        assert [r["close"] for r in upserts[-1]] == [108.0, 109.0]
+    finally:
+        server.shutdown()
+        _StubHandler.n_candles = 8
+
+T0 = datetime(2024, 1, 1, 0, 0, 59, 999000, tzinfo=timezone.utc)
+
+def _rows(symbol, start, n):
+    return [{"symbol": symbol, "ts": T0 + timedelta(minutes=start + i), "open": 1.0, "high": 2.0, "low": 0.5,
+             "close": 100.0 + start + i, "volume": 3.0} for i in range(n)]
+
+class _PgSession:
+    # Session falsa com dialeto postgresql: o SQL do cursor psycopg2 (db.connection().connection) fica em
+    # `sql`, as instruções SQLAlchemy são compiladas com literal_binds em `statements`; o ON CONFLICT da
+    # tabela final é simulado por (symbol, ts) e o commit esvazia a staging (ON COMMIT DELETE ROWS)
+    def __init__(self):
+        self.sql = []
+        self.statements = []
+        self.staged = []
+        self.copied = []
+        self.stored = set()
+
+    def get_bind(self):
+        return SimpleNamespace(dialect=postgresql.dialect())
+
+    def connection(self):
+        return SimpleNamespace(connection=self)
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        if isinstance(sql, str):
+            self.sql.append(sql)
+            return None
+        self.statements.append(str(sql.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})))
+        return []
+
+    def copy_expert(self, sql, buf):
+        self.sql.append(sql)
+        self.staged = list(csv.reader(buf))
+        self.copied.extend(self.staged)
+
+    def fetchall(self):
+        out = [(sym,) for sym, ts, *_ in self.staged if (sym, ts) not in self.stored]
+        self.stored.update((sym, ts) for sym, ts, *_ in self.staged)
+        return out
+
+    def commit(self):
+        self.staged = []
+        self.sql.append("COMMIT")
+
+def test_bulk_upsert_on_postgres_uses_copy_staging_and_merge(monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_COPY_THRESHOLD", 20)
+    db = _PgSession()
+    cols = "symbol, ts, open, high, low, close, volume"
+
+    rows = _rows("BTCUSDT", 0, 15) + _rows("ETHUSDT", 0, 10)
+    assert ingest._upsert_prices(db, rows, chunk_size=10) == Counter(BTCUSDT=15, ETHUSDT=10)
+    # por chunk, numa transação: staging temporária, COPY, merge na tabela final e commit
+    ops = [s.split()[0] for s in db.sql]
+    assert ops[-12:] == ["CREATE", "COPY", "INSERT", "COMMIT"] * 3
+    ddl, copy, merge = db.sql[-4:-1]
+    assert "CREATE TEMP TABLE IF NOT EXISTS prices_staging" in ddl and "ON COMMIT DELETE ROWS" in ddl
+    assert copy == f"COPY prices_staging ({cols}) FROM STDIN WITH (FORMAT csv)"
+    assert merge == (f"INSERT INTO prices ({cols}) SELECT {cols} FROM prices_staging "
+                     "ON CONFLICT (symbol, ts) DO NOTHING RETURNING symbol")
+    assert not any(s.startswith("INSERT") for s in db.statements)
+
+    # as linhas já gravadas são ignoradas pelo merge e não contam
+    db.copied.clear()
+    assert ingest._upsert_prices(db, _rows("BTCUSDT", 10, 20), chunk_size=10) == Counter(BTCUSDT=15)
+    assert db.copied[0] == ["BTCUSDT", (T0 + timedelta(minutes=10)).isoformat(), "1.0", "2.0", "0.5", "110.0", "3.0"]
+    assert len(db.copied) == 20
+
+    # abaixo do limiar: INSERT ... VALUES com ON CONFLICT DO NOTHING ... RETURNING
+    db.sql.clear()
+    ingest._upsert_prices(db, _rows("SOLUSDT", 0, 3))
+    inserts = [s for s in db.statements if s.startswith("INSERT")]
+    assert "COPY" not in " ".join(db.sql) and len(inserts) == 1
+    assert inserts[0].startswith(f"INSERT INTO prices ({cols}) VALUES ('SOLUSDT', '2024-01-01 00:00:59.999000+00:00'")
+    assert inserts[0].endswith("ON CONFLICT (symbol, ts) DO NOTHING RETURNING prices.symbol")
+
+def test_values_upsert_writes_several_chunks_on_sqlite(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    inserts = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cur, stmt, *a: inserts.append(stmt) if stmt.startswith("INSERT") else None)
+    # teto de variáveis do SQLite: 70 / 7 colunas = 10 linhas por INSERT, mesmo pedindo chunks maiores
+    monkeypatch.setattr(ingest, "SQLITE_MAX_VARIABLES", 70)
+    with sessionmaker(bind=engine)() as db:
+        rows = _rows("BTCUSDT", 0, 15) + _rows("ETHUSDT", 0, 10)
+        assert ingest._values_upsert_prices(db, rows, chunk_size=1000) == Counter(BTCUSDT=15, ETHUSDT=10)
+        assert len(inserts) == 3
+
+        # regravação com sobreposição: só as linhas novas entram (e contam)
+        rows = _rows("BTCUSDT", 10, 10) + _rows("ETHUSDT", 5, 5)
+        assert ingest._values_upsert_prices(db, rows, chunk_size=4) == Counter(BTCUSDT=5)
+        assert len(inserts) == 3 + 4
+        assert db.execute(select(func.count()).select_from(Price)).scalar_one() == 30
+        last = db.execute(select(Price).where(Price.symbol == "BTCUSDT").order_by(Price.ts.desc())).scalars().first()
+        assert last.close == 119.0 and last.volume == 3.0
+
+def test_watermark_is_per_symbol_and_other_intervals_are_rejected():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    marks = ingest.Watermarks()
+    with sessionmaker(bind=engine)() as db:
+        ingest._values_upsert_prices(db, _rows("BTCUSDT", 0, 5))
+        # semeado do banco na primeira consulta; prices não tem intervalo, o watermark também não
+        assert marks.get(db, "BTCUSDT").replace(tzinfo=timezone.utc) == T0 + timedelta(minutes=4)
+        assert marks.get(db, "ETHUSDT") is None
+        marks.advance("BTCUSDT", T0 + timedelta(minutes=9))
+        assert marks.snapshot() == {"BTCUSDT": (T0 + timedelta(minutes=9)).isoformat()}
+
+    other = "1h" if API_INTERVAL != "1h" else "1m"
+    app.dependency_overrides[get_db] = lambda: None
+    try:
+        r = TestClient(app).post("/ingest/run", params={"symbol": "BTCUSDT", "interval": other})
+        assert r.status_code == 400 and API_INTERVAL in r.json()["detail"]
+    finally:
+        app.dependency_overrides.clear()
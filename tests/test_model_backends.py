@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base, Price
+from api.feature_store import FeatureStore
+from api.model_backends import compile_model, make_model
+from api.model_store import ModelStore
+from api.registry import ModelRegistry
+from api.train import train_model
+
+def _session_with_prices(n=400):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+    db.add_all([Price(symbol="BTCUSDT", ts=(t0 + pd.Timedelta(minutes=i)).to_pydatetime(), close=100 + np.sin(i / 9))
+                for i in range(n)])
+    db.commit()
+    return db
+
+def _data(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, 9))
+    y = 2 * X[:, 0] + np.sin(X[:, 1]) + rng.normal(0, 0.1, n)
+    return X, y
+
+@pytest.mark.parametrize("backend", ["gbr", "hgb"])
+def test_compiled_trees_match_sklearn(backend):
+    X, y = _data()
+    model = make_model(backend).fit(X, y)
+    compiled = compile_model(model)
+    X_new = _data(300, seed=1)[0]
+    np.testing.assert_allclose(compiled.predict(X_new), model.predict(X_new), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(compiled.predict(X_new[0]), model.predict(X_new[:1]), rtol=0, atol=1e-9)
+
+def test_compiled_trees_follow_missing_values():
+    X, y = _data()
+    X[::7, 2] = np.nan
+    model = make_model("hgb").fit(X, y)
+    X_new = _data(300, seed=2)[0]
+    X_new[::3, 2] = np.nan
+    np.testing.assert_allclose(compile_model(model).predict(X_new), model.predict(X_new), rtol=0, atol=1e-9)
+
+def test_linear_backend_is_not_compiled():
+    X, y = _data()
+    assert compile_model(make_model("linear").fit(X, y)) is None
+    with pytest.raises(ValueError):
+        make_model("xgboost")
+
+def test_train_model_bundle_records_backend():
+    tmpdir = tempfile.mkdtemp()
+    store = ModelStore(tmpdir, registry=ModelRegistry())
+    try:
+        out = train_model(_session_with_prices(), symbol="BTCUSDT", store=store, backend="hgb",
+                          features=FeatureStore(os.path.join(tmpdir, "features")))
+        bundle = store.load("BTCUSDT", "1m")
+        assert out["backend"] == bundle["backend"] == "hgb"
+        assert bundle["compiled"] is not None
+        assert store.manifest("BTCUSDT", "1m")["versions"][-1]["backend"] == "hgb"
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
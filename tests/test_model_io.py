@@ -2,43 +2,76 @@ import os
 import shutil
 import tempfile
 import pandas as pd
-from sqlalchemy.orm import Session
-from types import SimpleNamespace
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
 
-from api.train import train_model, MODELS_DIR, MODEL_PATH
-from api.db import Price
+from api.train import train_model, train_many
+from api.feature_store import FeatureStore
+from api.model_store import ModelStore
+from api.registry import ModelRegistry
+from api.db import Base, Price, ModelMetric
+from api.runtime_metrics import STAGE_SECONDS
 
 def _fake_session_with_data():
-    class FakeRow: 
-        def __init__(self, ts, close): self.ts, self.close = ts, close
-
-    rows = [FakeRow(pd.Timestamp(f"2024-01-01 00:{i:02d}:00Z"), 100 + i*0.5) for i in range(400)]
-    class FakeQuery:
-        def __init__(self, rows): self._rows = rows
-        def filter(self, *_args, **_kwargs): return self
-        def order_by(self, *_args, **_kwargs): return self
-        def limit(self, *_args, **_kwargs): return self
-        def all(self): return self._rows
-    class FakeSession:
-        def query(self, _): return FakeQuery(rows)
-        def add(self, _): pass
-        def commit(self): pass
-    return FakeSession()
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+    db.add_all([
+        Price(symbol="BTCUSDT", ts=(t0 + pd.Timedelta(minutes=i)).to_pydatetime(), close=100 + i*0.5)
+        for i in range(400)
+    ])
+    db.commit()
+    return db
 
 def test_train_model_saves_artifact(monkeypatch):
     tmpdir = tempfile.mkdtemp()
     monkeypatch.setenv("PYTHONHASHSEED", "42")
 
-    from api import train as tr
-    orig_models_dir, orig_model_path = tr.MODELS_DIR, tr.MODEL_PATH
+    store = ModelStore(tmpdir, registry=ModelRegistry())
     try:
-        tr.MODELS_DIR = tmpdir
-        tr.MODEL_PATH = os.path.join(tmpdir, "model.pkl")
-
         db = _fake_session_with_data()
-        out = tr.train_model(db, symbol="BTCUSDT")
-        assert os.path.exists(tr.MODEL_PATH), "modelo não foi salvo"
+        fits = STAGE_SECONDS.count("fit")
+        out = train_model(db, symbol="BTCUSDT", store=store, features=FeatureStore(os.path.join(tmpdir, "features")))
+        assert STAGE_SECONDS.count("fit") == fits + 1
+        assert os.path.exists(out["model_path"]), "modelo não foi salvo"
+        assert store.current_path("BTCUSDT", "1m") == out["model_path"]
         assert "mae" in out and "rmse" in out
     finally:
-        tr.MODELS_DIR, tr.MODEL_PATH = orig_models_dir, orig_model_path
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_train_many_fits_symbols_in_worker_processes():
+    tmpdir = tempfile.mkdtemp()
+    store = ModelStore(tmpdir, registry=ModelRegistry())
+    try:
+        db = _fake_session_with_data()
+        t0 = pd.Timestamp("2024-01-01 00:00:00Z")
+        db.add_all([
+            Price(symbol="ETHUSDT", ts=(t0 + pd.Timedelta(minutes=i)).to_pydatetime(), close=50 + i*0.2)
+            for i in range(400)
+        ])
+        db.commit()
+
+        out = train_many(db, ["BTCUSDT", "ETHUSDT", "SOLUSDT"], store=store, max_workers=2,
+                         features=FeatureStore(os.path.join(tmpdir, "features")))
+        assert out["workers"] == 2
+        assert sorted(out["results"]) == ["BTCUSDT", "ETHUSDT"]
+        assert "SOLUSDT" in out["errors"]
+        assert store.load("ETHUSDT", "1m")["symbol"] == "ETHUSDT"
+        assert db.query(ModelMetric).count() == 2
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_train_model_offline_from_lake():
+    from api.lake import export_prices, ParquetPriceSource
+
+    tmpdir = tempfile.mkdtemp()
+    store = ModelStore(os.path.join(tmpdir, "models"), registry=ModelRegistry())
+    try:
+        lake = os.path.join(tmpdir, "lake")
+        export_prices(_fake_session_with_data(), "BTCUSDT", root=lake)
+        out = train_model(None, symbol="BTCUSDT", store=store, source=ParquetPriceSource(lake))
+        assert out["n_rows"] == 400
+        assert os.path.exists(out["model_path"])
+    finally:
         shutil.rmtree(tmpdir, ignore_errors=True)
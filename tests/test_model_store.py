@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import main
+from api.model_store import ModelStore
+from api.registry import ModelRegistry
+
+def test_store_keeps_models_per_symbol():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = ModelStore(tmpdir, registry=ModelRegistry())
+        store.save("BTCUSDT", "1m", {"model": "btc", "version": "v1"})
+        store.save("ETHUSDT", "1m", {"model": "eth", "version": "v1"})
+        assert store.load("BTCUSDT", "1m")["model"] == "btc"
+        assert store.load("ETHUSDT", "1m")["model"] == "eth"
+        with pytest.raises(RuntimeError):
+            store.load("SOLUSDT", "1m")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_store_retention_and_promote():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = ModelStore(tmpdir, retention=2, registry=ModelRegistry())
+        first = store.save("BTCUSDT", "1m", {"model": "m0", "version": "v0"})
+        for i in range(1, 3):
+            store.save("BTCUSDT", "1m", {"model": f"m{i}", "version": f"v{i}"})
+        # mesma versão (treinos no mesmo segundo) ganha sufixo em vez de sobrescrever
+        store.save("BTCUSDT", "1m", {"model": "m3", "version": "v2"})
+        versions = [v["version"] for v in store.manifest("BTCUSDT", "1m")["versions"]]
+        assert versions == ["v2", "v2_1"]
+        assert not os.path.exists(first["path"])
+        assert store.load("BTCUSDT", "1m")["model"] == "m3"
+
+        store.promote("BTCUSDT", "1m", "v2")
+        assert store.load("BTCUSDT", "1m")["model"] == "m2"
+        # a versão corrente sobrevive à coleta mesmo fora da janela de retenção
+        store.save("BTCUSDT", "1m", {"model": "m4", "version": "v4"}, promote=False)
+        store.save("BTCUSDT", "1m", {"model": "m5", "version": "v5"}, promote=False)
+        assert store.load("BTCUSDT", "1m")["model"] == "m2"
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_store_rejects_unsafe_keys():
+    store = ModelStore(tempfile.mkdtemp(), registry=ModelRegistry())
+    with pytest.raises(ValueError):
+        store.save("../etc", "1m", {"model": "x", "version": "v1"})
+
+def test_promote_endpoint_returns_404_for_unknown_version(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = ModelStore(tmpdir, registry=ModelRegistry())
+        store.save("BTCUSDT", "1m", {"model": "m1", "version": "v1"})
+        store.save("BTCUSDT", "1m", {"model": "m2", "version": "v2"})
+        monkeypatch.setattr(main, "MODEL_STORE", store)
+        client = TestClient(main.app)
+
+        r = client.post("/model/promote", params={"symbol": "BTCUSDT", "version": "v1"})
+        assert r.status_code == 200 and r.json()["current"] == "v1"
+        r = client.post("/model/promote", params={"symbol": "BTCUSDT", "version": "v9"})
+        assert r.status_code == 404 and "v9" in r.json()["detail"]
+        assert client.post("/model/promote", params={"symbol": "ETHUSDT", "version": "v1"}).status_code == 404
+        assert client.post("/model/promote", params={"symbol": "../etc", "version": "v1"}).status_code == 400
+        assert store.manifest("BTCUSDT", "1m")["current"] == "v1"
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,134 @@
+import os
+import tempfile
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base, Prediction, get_async_db
+from api.ingest import _upsert_prices
+from api.main import app
+from api.predlog import ONLINE_ERRORS, OnlineErrors, PredictionLog
+
+T0 = pd.Timestamp("2024-01-01 00:00:59.999Z").to_pydatetime()
+
+def _candles(start, closes):
+    return [{"symbol": "BTCUSDT", "ts": T0 + timedelta(minutes=start + i), "close": float(c)}
+            for i, c in enumerate(closes)]
+
+def _count(Session):
+    with Session() as db:
+        return db.execute(select(func.count()).select_from(Prediction)).scalar_one()
+
+def test_predictions_buffered_and_written_in_one_insert():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    inserts = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cur, stmt, *a: inserts.append(stmt) if stmt.startswith("INSERT") else None)
+    log = PredictionLog(Session, batch_size=1000, errors=OnlineErrors())
+
+    for i in range(50):
+        assert log.record("BTCUSDT", "1m", "v1", T0 + timedelta(minutes=i), 100.0 + i, 100.0)
+    # a mesma previsão servida de novo (memo/batch) não entra duas vezes
+    assert not log.record("BTCUSDT", "1m", "v1", T0 + timedelta(minutes=49), 149.0, 100.0)
+    assert log.pending() == 50 and _count(Session) == 0
+
+    assert log.flush() == 50
+    assert len(inserts) == 1 and _count(Session) == 50
+    with Session() as db:
+        first = db.execute(select(Prediction).order_by(Prediction.base_ts)).scalars().first()
+        assert first.target_ts.replace(tzinfo=None) == (T0 + timedelta(minutes=1)).replace(tzinfo=None)
+        assert first.actual is None
+
+def test_failed_flush_keeps_rows_up_to_buffer_limit():
+    class _Broken:
+        def get_bind(self):
+            raise RuntimeError("banco fora")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    log = PredictionLog(_Broken, max_buffer=3, errors=OnlineErrors())
+    for i in range(5):
+        log.record("BTCUSDT", "1m", "v1", T0 + timedelta(minutes=i), 1.0, 1.0)
+    assert log.pending() == 3  # as mais antigas saem: memória limitada com o banco fora
+    with pytest.raises(RuntimeError):
+        log.flush()
+    assert log.pending() == 3 and "banco fora" in log.stats()["last_error"]
+
+def test_resolve_joins_realized_close_and_tracks_online_error():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "p.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        errors = OnlineErrors(span=9)
+        log = PredictionLog(Session, errors=errors)
+
+        rng = np.random.default_rng(3)
+        closes = 100 + np.cumsum(rng.normal(0, 1, 41))
+        preds = closes[1:] + rng.normal(0, 0.5, 40)
+        with Session() as db:
+            _upsert_prices(db, _candles(0, closes[:1]))
+        for i in range(40):
+            # previsão feita no candle i para o candle i + 1; a versão muda no meio
+            log.record("BTCUSDT", "1m", "v1" if i < 20 else "v2", T0 + timedelta(minutes=i), preds[i], closes[i])
+            with Session() as db:
+                rows = _candles(i + 1, closes[i + 1:i + 2])
+                assert log.resolve(db, rows, _upsert_prices(db, rows)) == 1
+
+        err = preds - closes[1:]
+        ewm = pd.Series(np.abs(err)).ewm(span=9, adjust=False).mean().iloc[-1]
+        ewm_sq = pd.Series(err ** 2).ewm(span=9, adjust=False).mean().iloc[-1]
+        overall = errors.get("BTCUSDT", "1m")
+        assert overall["n"] == 40
+        assert overall["mae"] == pytest.approx(ewm) and overall["rmse"] == pytest.approx(np.sqrt(ewm_sq))
+        assert overall["mae_total"] == pytest.approx(np.abs(err).mean())
+        assert overall["naive_mae"] > 0
+        v2 = errors.get("BTCUSDT", "1m", "v2")
+        assert v2["n"] == 20 and v2["mae_total"] == pytest.approx(np.abs(err[20:]).mean())
+
+        with Session() as db:
+            assert db.execute(select(func.count()).select_from(Prediction)
+                              .where(Prediction.actual.is_(None))).scalar_one() == 0
+            # candles regravados não resolvem de novo
+            assert log.resolve(db, _candles(40, closes[40:]), {"BTCUSDT": 1}) == 0
+
+        async_session = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+        async def _async_db():
+            async with async_session() as db:
+                yield db
+
+        app.dependency_overrides[get_async_db] = _async_db
+        ONLINE_ERRORS.observe("BTCUSDT", "1m", "v2", 101.0, 100.0, 100.5, T0)
+        try:
+            client = TestClient(app)
+            body = client.get("/predictions", params={"limit": 5}).json()
+            assert len(body["items"]) == 5 and body["items"][0]["actual"] == pytest.approx(closes[40])
+            assert body["items"][0]["error"] == pytest.approx(err[-1])
+            series = client.get("/predictions/errors", params={"symbol": "BTCUSDT"}).json()["series"]
+            assert {s["model_version"] for s in series} == {"*", "v2"}
+        finally:
+            app.dependency_overrides.clear()
+            ONLINE_ERRORS.clear()
+
+def test_online_errors_memory_is_bounded():
+    errors = OnlineErrors(max_series=4)
+    for v in range(10):
+        for _ in range(100):
+            errors.observe("BTCUSDT", "1m", f"v{v}", 1.0, 0.0, 0.0, T0)
+    # cada série guarda só contadores, e as séries têm teto (a agregada segue viva por ser a mais usada)
+    series = errors.snapshot()
+    assert len(series) == 4 and errors.get("BTCUSDT", "1m")["n"] == 1000
+    assert errors.get("BTCUSDT", "1m", "v0") is None
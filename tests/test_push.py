@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from api.push import PriceFeed, push_updates, sse_stream
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def _rows(symbol, start, n):
+    return [{"symbol": symbol, "ts": T0 + timedelta(minutes=start + i), "close": 100.0 + start + i} for i in range(n)]
+
+def _parse(payload: bytes):
+    fields = dict(line.split(": ", 1) for line in payload.decode().strip().split("\n"))
+    return fields["event"], json.loads(fields["data"])
+
+class _Session:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def test_fan_out_serializes_once_and_skips_symbols_without_subscribers():
+    feed = PriceFeed()
+
+    async def scenario():
+        a, b = feed.subscribe("BTCUSDT"), feed.subscribe("BTCUSDT")
+        # gravação acontece em outra thread (flush do stream / job de ingestão)
+        t = threading.Thread(target=feed.publish_candles, args=(_rows("BTCUSDT", 0, 2) + _rows("ETHUSDT", 0, 1),))
+        t.start()
+        t.join()
+        pa_, pb = await asyncio.wait_for(a.queue.get(), 1), await asyncio.wait_for(b.queue.get(), 1)
+        assert pa_ is pb
+        event, body = _parse(pa_)
+        assert event == "candles"
+        assert [p["close"] for p in body["data"]] == [100.0, 101.0]
+        feed.unsubscribe(a)
+        feed.unsubscribe(b)
+
+    asyncio.run(scenario())
+    assert feed.stats()["subscribers"] == {}
+    assert feed.last_ts("ETHUSDT") == T0
+
+def test_prediction_computed_once_per_candle_not_per_viewer():
+    feed = PriceFeed()
+    calls = []
+
+    def predict(db, symbol, interval):
+        calls.append(symbol)
+        return {"symbol": symbol, "predicted_next_close": 1.0, "last_ts": T0.isoformat()}
+
+    push_updates(_rows("BTCUSDT", 0, 1), "1m", predict, _Session, feed=feed)
+    assert calls == []  # ninguém conectado: nada a calcular
+
+    async def scenario():
+        subs = [feed.subscribe("BTCUSDT") for _ in range(5)]
+        await asyncio.to_thread(push_updates, _rows("BTCUSDT", 1, 1), "1m", predict, _Session, feed)
+        got = [[_parse(await asyncio.wait_for(s.queue.get(), 1))[0] for _ in range(2)] for s in subs]
+        assert got == [["candles", "prediction"]] * 5
+        for s in subs:
+            feed.unsubscribe(s)
+
+    asyncio.run(scenario())
+    assert calls == ["BTCUSDT"]
+    assert _parse(feed.last_prediction("BTCUSDT"))[0] == "prediction"
+
+def test_sse_stream_sends_snapshot_then_increments_and_heartbeat():
+    feed = PriceFeed()
+    feed.publish("BTCUSDT", "prediction", {"symbol": "BTCUSDT", "predicted_next_close": 2.0})
+    snapshot = json.dumps({"symbol": "BTCUSDT", "data": [{"ts": T0.isoformat(), "close": 100.0}]}).encode()
+
+    async def disconnected():
+        return False
+
+    async def scenario():
+        sub = feed.subscribe("BTCUSDT")
+        gen = sse_stream(feed, sub, snapshot, disconnected, heartbeat=0.05)
+        event, body = _parse(await gen.__anext__())
+        assert event == "snapshot" and body["data"][0]["close"] == 100.0
+        assert _parse(await gen.__anext__())[0] == "prediction"
+        assert await gen.__anext__() == b": ping\n\n"
+        feed.publish_candles(_rows("BTCUSDT", 1, 1))
+        event, body = _parse(await gen.__anext__())
+        assert event == "candles" and body["data"][0]["close"] == 101.0
+        await gen.aclose()
+
+    asyncio.run(scenario())
+    assert not feed.has_subscribers("BTCUSDT")
+
+def test_slow_client_is_dropped_with_resync():
+    feed = PriceFeed(queue_size=1)
+
+    async def disconnected():
+        return False
+
+    async def scenario():
+        sub = feed.subscribe("BTCUSDT")
+        gen = sse_stream(feed, sub, b'{"symbol":"BTCUSDT","data":[]}', disconnected, heartbeat=1)
+        assert _parse(await gen.__anext__())[0] == "snapshot"
+        for i in range(3):
+            feed.publish_candles(_rows("BTCUSDT", i, 1))
+        await asyncio.sleep(0)
+        assert sub.overflowed
+        assert _parse(await gen.__anext__())[0] == "resync"
+        assert [p async for p in gen] == []
+
+    asyncio.run(scenario())
+    assert not feed.has_subscribers("BTCUSDT")
@@ -0,0 +1,19 @@
+import os
+import tempfile
+import joblib
+
+from api.registry import ModelRegistry
+
+def test_registry_caches_and_reloads_on_change():
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "model.pkl")
+    joblib.dump({"model": "a", "version": "v1"}, path)
+
+    reg = ModelRegistry()
+    assert reg.get(path)["version"] == "v1"
+    assert reg.get(path)["version"] == "v1"
+    assert reg.loads == 1 and reg.hits == 1
+
+    joblib.dump({"model": "b", "version": "v2-rebuilt"}, path)
+    assert reg.get(path)["version"] == "v2-rebuilt"
+    assert reg.loads == 2
@@ -0,0 +1,47 @@
+from api.response_cache import ResponseCache
+
+class _Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_cache_hits_until_candle_boundary():
+    clock = _Clock(120.0)
+    cache = ResponseCache(maxsize=8, interval="1m", clock=clock)
+    calls = []
+    build = lambda: calls.append(1) or b'{"x": 1}'
+
+    first = cache.get_or_build(("BTCUSDT", 10), build)
+    clock.now = 179.0
+    assert cache.get_or_build(("BTCUSDT", 10), build).etag == first.etag
+    assert len(calls) == 1 and cache.hits == 1 and cache.misses == 1
+
+    clock.now = 180.0
+    cache.get_or_build(("BTCUSDT", 10), build)
+    assert len(calls) == 2
+
+def test_invalidate_drops_symbol_and_in_flight_builds():
+    cache = ResponseCache(maxsize=8, interval="1m", clock=lambda: 0.0)
+    cache.put(("BTCUSDT", 10), b"a")
+    cache.put(("ETHUSDT", 10), b"b")
+
+    def build():
+        cache.invalidate("BTCUSDT")
+        return b"stale"
+
+    cache.invalidate("BTCUSDT")
+    assert cache.get(("BTCUSDT", 10)) is None
+    assert cache.get(("ETHUSDT", 10)) is not None
+    cache.get_or_build(("BTCUSDT", 20), build)
+    assert cache.get(("BTCUSDT", 20)) is None
+
+def test_lru_eviction():
+    cache = ResponseCache(maxsize=2, interval="1m", clock=lambda: 0.0)
+    cache.put(("A", 1), b"1")
+    cache.put(("B", 1), b"2")
+    cache.get(("A", 1))
+    cache.put(("C", 1), b"3")
+    assert cache.get(("B", 1)) is None
+    assert cache.get(("A", 1)) is not None
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base, Price
+from api.feature_store import FeatureStore
+from api.model_store import ModelStore
+from api.predlog import ONLINE_ERRORS
+from api.registry import ModelRegistry
+from api.features import FEATURES
+from api.retrain import retrain
+from api.train import TRAIN_LIMIT, _fit
+
+T0 = pd.Timestamp("2024-01-01 00:00:59.999Z")
+
+def _add(db, start, close):
+    db.add_all([Price(symbol="BTCUSDT", ts=(T0 + pd.Timedelta(minutes=start + i)).to_pydatetime(), close=float(c))
+                for i, c in enumerate(close)])
+    db.commit()
+
+def _walk(n, seed, level=100.0):
+    return level + np.cumsum(np.random.default_rng(seed).normal(0, 0.5, n))
+
+def _setup():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    tmpdir = tempfile.mkdtemp()
+    store = ModelStore(tmpdir, registry=ModelRegistry())
+    features = FeatureStore(os.path.join(tmpdir, "features"))
+    return db, tmpdir, store, features
+
+def test_retrain_skips_unchanged_symbols_and_warm_starts_on_new_data():
+    db, tmpdir, store, features = _setup()
+    try:
+        _add(db, 0, _walk(600, 1))
+        kw = dict(store=store, features=features, max_workers=1, backend="gbr", min_new_rows=50)
+
+        first = retrain(db, ["BTCUSDT"], **kw)
+        assert first["decisions"][0]["action"] == "full" and first["decisions"][0]["reason"] == "no_model"
+        v1 = first["results"]["BTCUSDT"]["version"]
+        base = store.load("BTCUSDT", "1m")["model"]
+
+        # nada chegou: nenhum fit
+        again = retrain(db, ["BTCUSDT"], **kw)
+        assert again["decisions"][0]["reason"] == "no_new_data" and again["results"] == {}
+        assert store.manifest("BTCUSDT", "1m")["current"] == v1
+
+        _add(db, 600, _walk(100, 2, level=_walk(600, 1)[-1]))
+        warm = retrain(db, ["BTCUSDT"], **kw)
+        d = warm["decisions"][0]
+        assert d["action"] == "warm" and d["reason"] == "new_data" and d["new_rows"] == 100
+        assert warm["results"]["BTCUSDT"]["fit"] == "warm"
+        model = store.load("BTCUSDT", "1m")["model"]
+        # árvores novas sobre o ensemble anterior, que segue intacto no cache do registry
+        assert model.n_estimators_ == base.n_estimators_ + 20 and base.n_estimators_ == 100
+        entry = store.manifest("BTCUSDT", "1m")["versions"][-1]
+        assert entry["warm_starts"] == 1 and entry["base_version"] == v1 and entry["n_trees"] == 120
+
+        # limite de retreinos incrementais seguidos: volta a treinar do zero
+        _add(db, 700, _walk(60, 3, level=_walk(100, 2, level=_walk(600, 1)[-1])[-1]))
+        full = retrain(db, ["BTCUSDT"], full_every=1, **kw)
+        assert full["decisions"][0]["action"] == "full"
+        assert store.manifest("BTCUSDT", "1m")["versions"][-1]["warm_starts"] == 0
+    finally:
+        db.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_gbr_warm_retrain_predicts_like_a_full_refit_on_the_same_window():
+    db, tmpdir, store, features = _setup()
+    try:
+        _add(db, 0, _walk(600, 1))
+        kw = dict(store=store, features=features, max_workers=1, backend="gbr", min_new_rows=50)
+        retrain(db, ["BTCUSDT"], **kw)
+        _add(db, 600, _walk(300, 2, level=_walk(600, 1)[-1]))
+        assert retrain(db, ["BTCUSDT"], **kw)["results"]["BTCUSDT"]["fit"] == "warm"
+
+        df = features.training_set("BTCUSDT", TRAIN_LIMIT)
+        warm = store.load("BTCUSDT", "1m")["model"].predict(df[FEATURES])
+        full, _ = _fit(df, "gbr")
+        full = full.predict(df[FEATURES])
+        y = df["y"].to_numpy()
+        # as árvores antigas continuam válidas na janela nova: o erro fica no nível do fit do zero
+        assert np.abs(warm - y).mean() <= 1.1 * np.abs(full - y).mean()
+        assert np.abs(warm - full).mean() < 0.1 * np.abs(y).std()
+    finally:
+        db.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_retrain_on_drift_below_new_data_threshold():
+    db, tmpdir, store, features = _setup()
+    try:
+        _add(db, 0, _walk(600, 1))
+        kw = dict(store=store, features=features, max_workers=1, backend="gbr", min_new_rows=1000,
+                  drift_min_rows=30)
+        retrain(db, ["BTCUSDT"], **kw)
+
+        # poucos candles novos no mesmo regime: pulado
+        calm = _walk(40, 4, level=_walk(600, 1)[-1])
+        _add(db, 600, calm)
+        d = retrain(db, ["BTCUSDT"], dry_run=True, **kw)["decisions"][0]
+        assert d["action"] == "skip" and d["reason"] == "below_threshold" and d["live_mae"] is not None
+
+        # salto de nível fora da faixa do treino: o erro nos candles novos dispara o retreino
+        _add(db, 640, _walk(40, 5, level=calm[-1] + 50))
+        d = retrain(db, ["BTCUSDT"], **kw)["decisions"][0]
+        assert d["reason"] == "drift" and d["action"] == "warm"
+        assert d["live_mae"] > 1.5 * d["model_mae"]
+    finally:
+        db.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+@pytest.mark.parametrize("backend", ["hgb", "linear"])
+def test_backends_without_valid_warm_start_refit_from_scratch(backend):
+    db, tmpdir, store, features = _setup()
+    try:
+        _add(db, 0, _walk(600, 1))
+        kw = dict(store=store, features=features, max_workers=1, backend=backend, min_new_rows=50)
+        retrain(db, ["BTCUSDT"], **kw)
+        _add(db, 600, _walk(100, 2, level=_walk(600, 1)[-1]))
+        out = retrain(db, ["BTCUSDT"], **kw)
+        assert out["decisions"][0]["action"] == "full" and out["results"]["BTCUSDT"]["fit"] == "full"
+        assert retrain(db, ["ETHUSDT"], **kw)["errors"]["ETHUSDT"].startswith("Sem dados")
+        # o modelo gravado é o mesmo de um fit do zero na janela nova
+        df = features.training_set("BTCUSDT", TRAIN_LIMIT)
+        full, _ = _fit(df, backend)
+        np.testing.assert_allclose(store.load("BTCUSDT", "1m")["model"].predict(df[FEATURES]),
+                                   full.predict(df[FEATURES]))
+    finally:
+        db.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def test_drift_uses_online_error_of_served_predictions():
+    db, tmpdir, store, features = _setup()
+    try:
+        _add(db, 0, _walk(600, 1))
+        kw = dict(store=store, features=features, max_workers=1, backend="gbr", min_new_rows=1000,
+                  drift_min_rows=30)
+        version = retrain(db, ["BTCUSDT"], **kw)["results"]["BTCUSDT"]["version"]
+        _add(db, 600, _walk(40, 4, level=_walk(600, 1)[-1]))
+        # previsões servidas com erro alto (ex.: regime novo visto só ao vivo)
+        for _ in range(30):
+            ONLINE_ERRORS.observe("BTCUSDT", "1m", version, 110.0, 100.0, 100.0, T0.to_pydatetime())
+        d = retrain(db, ["BTCUSDT"], dry_run=True, **kw)["decisions"][0]
+        assert d["live_source"] == "online" and d["live_mae"] == pytest.approx(10.0)
+        assert d["reason"] == "drift" and d["action"] == "warm"
+    finally:
+        ONLINE_ERRORS.clear()
+        db.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
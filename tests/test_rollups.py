@@ -0,0 +1,132 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from api.db import Base, PriceRollup, get_async_db
+from api.ingest import _upsert_prices, _update_rollups
+from api.main import app
+from api.response_cache import PRICES_CACHE
+from api.rollups import lttb, rebuild_rollups
+
+T0 = pd.Timestamp("2024-01-01 00:00:59.999Z")
+
+def _candles(start, n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    return [
+        {"symbol": "BTCUSDT", "ts": (T0 + pd.Timedelta(minutes=start + i)).to_pydatetime(),
+         "open": c - 0.5, "high": c + 1, "low": c - 1, "close": c, "volume": 1.0}
+        for i, c in enumerate(close)
+    ]
+
+def _write(Session, rows):
+    with Session() as db:
+        inserted = _upsert_prices(db, rows)
+        _update_rollups(db, rows, inserted)
+
+def _rollups(Session, resolution):
+    with Session() as db:
+        t = PriceRollup.__table__
+        rows = db.execute(select(t.c.ts, t.c.open, t.c.high, t.c.low, t.c.close, t.c.volume, t.c.candles)
+                          .where(t.c.resolution == resolution).order_by(t.c.ts)).all()
+    df = pd.DataFrame(rows, columns=["ts", "open", "high", "low", "close", "volume", "candles"])
+    df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    return df.set_index("ts")
+
+def _expected(rows, rule):
+    df = pd.DataFrame(rows).set_index("ts").sort_index()
+    df.index = pd.to_datetime(df.index, utc=True) - pd.Timedelta(milliseconds=59_999)
+    out = df.resample(rule).agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+    out["candles"] = df["close"].resample(rule).size()
+    out = out[out["candles"] > 0]
+    out.index = out.index + pd.Timedelta(rule) - pd.Timedelta(milliseconds=1)
+    return out
+
+def test_rollups_follow_ingestion_including_late_candles():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'r.db')}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+
+        rows = _candles(0, 3000)
+        late = [r for i, r in enumerate(rows) if 1000 <= i < 1010]
+        first = [r for r in rows if r not in late]
+        # lotes como os da ingestão: histórico, depois candles novos e por fim um buraco preenchido
+        _write(Session, first[:2000])
+        _write(Session, first[2000:])
+        _write(Session, late)
+
+        for res, rule in (("5m", "5min"), ("1h", "1h"), ("1d", "1D")):
+            got, want = _rollups(Session, res), _expected(rows, rule)
+            assert list(got.index) == list(want.index)
+            np.testing.assert_allclose(got[["open", "high", "low", "close", "volume"]].to_numpy(),
+                                       want[["open", "high", "low", "close", "volume"]].to_numpy())
+            assert got["candles"].tolist() == want["candles"].tolist()
+
+        # recálculo do histórico inteiro chega ao mesmo resultado
+        before = _rollups(Session, "1h")
+        with Session() as db:
+            assert rebuild_rollups(db, "BTCUSDT", chunk_days=1) > 0
+        pd.testing.assert_frame_equal(_rollups(Session, "1h"), before)
+
+def test_lttb_keeps_endpoints_and_extremes():
+    x = np.arange(10_000, dtype=float)
+    y = np.sin(x / 500)
+    y[4321], y[7777] = 50.0, -50.0
+    idx = lttb(x, y, 200)
+    assert len(idx) == 200 and idx[0] == 0 and idx[-1] == len(x) - 1
+    assert np.all(np.diff(idx) > 0)
+    assert {4321, 7777} <= set(idx.tolist())
+    assert len(lttb(x[:50], y[:50], 200)) == 50
+
+def test_prices_range_endpoint():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "r.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        rows = _candles(0, 3 * 1440)
+        _write(Session, rows)
+        async_session = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+
+        async def _async_db():
+            async with async_session() as db:
+                yield db
+
+        PRICES_CACHE.invalidate()
+        app.dependency_overrides[get_async_db] = _async_db
+        client = TestClient(app)
+        try:
+            params = {"symbol": "BTCUSDT", "start": "2024-01-01T00:00:00Z", "end": "2024-01-04T00:00:00Z"}
+            r = client.get("/prices/range", params={**params, "max_points": 100})
+            body = r.json()
+            assert r.status_code == 200
+            assert body["resolution"] == "1h" and body["source"] == "1h" and body["points"] == 72
+            assert body["data"][0]["ts"].startswith("2024-01-01T00:59:59.999")
+            assert client.get("/prices/range", params={**params, "max_points": 100},
+                              headers={"If-None-Match": r.headers["ETag"]}).status_code == 304
+
+            # 15m não é guardado: sai da soma de 5m e bate com o recorte de 1m
+            r15 = client.get("/prices/range", params={**params, "resolution": "15m", "max_points": 500}).json()
+            want = _expected(rows, "15min")
+            assert r15["source"] == "5m" and r15["points"] == len(want)
+            np.testing.assert_allclose([p["high"] for p in r15["data"]], want["high"].to_numpy())
+
+            assert client.get("/prices/range", params={**params, "resolution": "1m"}).status_code == 400
+            bad = {**params, "start": params["end"], "end": params["start"]}
+            assert client.get("/prices/range", params=bad).status_code == 400
+
+            rl = client.get("/prices/range", params={**params, "method": "lttb", "max_points": 300}).json()
+            assert rl["points"] == 300 and rl["source"] == "5m"
+            closes = _expected(rows, "5min")["close"]
+            assert max(p["close"] for p in rl["data"]) == max(closes)
+            assert min(p["close"] for p in rl["data"]) == min(closes)
+        finally:
+            app.dependency_overrides.clear()
+            PRICES_CACHE.invalidate()
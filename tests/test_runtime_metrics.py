@@ -0,0 +1,40 @@
+import pytest
+
+from api.runtime_metrics import Counter, Gauge, Histogram, MetricsRegistry, JOB_RUNS, JOB_SECONDS, job
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("t_seconds", "teste", ("stage",), buckets=(0.01, 0.1))
+    h.observe("db", value=0.005)
+    h.observe("db", value=0.05)
+    h.observe("db", value=5.0)
+    text = "\n".join(h.render())
+    assert 'app_t_seconds_bucket{stage="db",le="0.01"} 1' in text
+    assert 'app_t_seconds_bucket{stage="db",le="0.1"} 2' in text
+    assert 'app_t_seconds_bucket{stage="db",le="+Inf"} 3' in text
+    assert 'app_t_seconds_count{stage="db"} 3' in text
+    assert "# TYPE app_t_seconds histogram" in text
+
+def test_registry_renders_counters_and_gauges():
+    reg = MetricsRegistry()
+    c = reg.register(Counter("rows", "linhas", ("symbol",)))
+    g = reg.register(Gauge("last", "último"))
+    c.inc("BTC", amount=3)
+    c.inc('a"b')
+    g.set(value=12.5)
+    text = reg.render()
+    assert 'app_rows_total{symbol="BTC"} 3' in text
+    assert 'app_rows_total{symbol="a\\"b"} 1' in text
+    assert "app_last 12.5" in text
+    with pytest.raises(ValueError):
+        c.inc()
+
+def test_job_records_outcome():
+    ok, err = JOB_RUNS.value("t_job", "ok"), JOB_RUNS.value("t_job", "error")
+    with job("t_job"):
+        pass
+    with pytest.raises(RuntimeError):
+        with job("t_job"):
+            raise RuntimeError("x")
+    assert JOB_RUNS.value("t_job", "ok") == ok + 1
+    assert JOB_RUNS.value("t_job", "error") == err + 1
+    assert JOB_SECONDS.count("t_job") >= 2
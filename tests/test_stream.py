@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from api import ingest as ingest_mod
+from api import stream as stream_mod
+from api.db import Base, Price
+from api.ingest import WATERMARKS
+from api.stream import ReplaySource, StreamIngestor, parse_kline_message
+
+T0 = 1_704_067_200_000
+
+def _msg(symbol, i, closed=True, close=None):
+    open_ms = T0 + i * 60_000
+    c = str(close if close is not None else 100 + i)
+    return {"stream": f"{symbol.lower()}@kline_1m", "data": {
+        "e": "kline", "E": open_ms + (59_999 if closed else 30_000), "s": symbol,
+        "k": {"t": open_ms, "T": open_ms + 59_999, "s": symbol, "i": "1m",
+              "o": c, "h": c, "l": c, "c": c, "v": "1.5", "x": closed},
+    }}
+
+def _write(path, messages):
+    with open(path, "w", encoding="utf-8") as f:
+        for m in messages:
+            f.write(json.dumps(m) + "\n")
+
+def _sessions(tmp):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, 'stream.db')}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+def _count(Session, symbol=None):
+    with Session() as db:
+        q = select(func.count()).select_from(Price)
+        if symbol:
+            q = q.where(Price.symbol == symbol)
+        return db.execute(q).scalar()
+
+def test_parse_kline_message():
+    row = parse_kline_message(json.dumps(_msg("BTCUSDT", 3)))
+    assert row["symbol"] == "BTCUSDT" and row["closed"] and row["close"] == 103.0
+    assert int(row["ts"].timestamp() * 1000) // 1000 == (T0 + 3 * 60_000 + 59_999) // 1000
+    assert parse_kline_message(json.dumps({"e": "trade"})) is None
+
+def test_replay_micro_batches_closed_candles_and_notifies_subscribers():
+    WATERMARKS.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "klines.jsonl")
+        msgs = []
+        for i in range(30):
+            for sym in ("BTCUSDT", "ETHUSDT", "SOLUSDT"):
+                msgs.append(_msg(sym, i, closed=False))
+                msgs.append(_msg(sym, i))
+        _write(path, msgs)
+        Session = _sessions(tmp)
+        got = []
+        ingestor = StreamIngestor(["BTCUSDT", "ETHUSDT"], source=ReplaySource(path, speed=0),
+                                  session_factory=Session, batch_size=16, backfill=False)
+        ingestor.subscribe(got.extend)
+        asyncio.run(ingestor.run())
+
+        assert _count(Session) == 60
+        assert _count(Session, "SOLUSDT") == 0
+        assert ingestor.stats["closed"] == 60
+        assert ingestor.stats["inserted"] == 60
+        assert ingestor.stats["flushes"] >= 60 // 16
+        assert len(got) == 60
+        # repetir o replay não duplica nem notifica de novo
+        got.clear()
+        again = StreamIngestor(["BTCUSDT", "ETHUSDT"], source=ReplaySource(path, speed=0),
+                               session_factory=Session, backfill=False)
+        again.subscribe(got.extend)
+        asyncio.run(again.run())
+        assert _count(Session) == 60 and got == []
+    WATERMARKS.reset()
+
+class _Rest:
+    # REST de klines com o histórico completo (paginado por start_ms); com open_last, o último candle
+    # ainda está aberto (close parcial), como na Binance
+    def __init__(self, n, open_last=False):
+        self.n = n
+        self.open_last = open_last
+        self.calls = 0
+
+    def fetch(self, symbol, interval, limit, start_ms=None):
+        self.calls += 1
+        rows = []
+        for i in range(self.n):
+            partial = self.open_last and i == self.n - 1
+            row = parse_kline_message(json.dumps(_msg(symbol, i, close=999.0 if partial else None)))
+            del row["closed"], row["event_ms"]
+            if start_ms is None or row["ts"].timestamp() * 1000 >= start_ms:
+                rows.append(row)
+        return rows[:limit] if start_ms is not None else rows[-limit:]
+
+def _row(symbol, i):
+    row = parse_kline_message(json.dumps(_msg(symbol, i)))
+    del row["closed"], row["event_ms"]
+    return row
+
+def test_gap_in_stream_is_backfilled_from_rest():
+    WATERMARKS.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "klines.jsonl")
+        _write(path, [_msg("BTCUSDT", i) for i in range(5)])
+        Session = _sessions(tmp)
+        rest = _Rest(0)
+        got = []
+        ingestor = StreamIngestor(["BTCUSDT"], source=ReplaySource(path, speed=0), session_factory=Session,
+                                  rest_source=rest, backfill=True, batch_size=100)
+        ingestor.subscribe(got.extend)
+        # backfill inicial (banco vazio, REST sem nada) e depois os candles 0..4 do stream
+        asyncio.run(ingestor.run())
+        assert _count(Session) == 5
+
+        # candle 5 se perdeu no stream: o lote seguinte (6, 7) puxa o buraco do REST
+        rest.n = 8
+        ingestor._buffer = [_row("BTCUSDT", 6), _row("BTCUSDT", 7)]
+        ingestor._flush()
+        assert _count(Session) == 8
+        assert ingestor.stats["backfilled"] == 3
+        assert [r["close"] for r in got[5:]] == [105.0, 106.0, 107.0]
+    WATERMARKS.reset()
+
+def test_open_candle_from_rest_is_not_stored(monkeypatch):
+    # "agora" no meio do candle 4: o REST o devolve aberto, o stream o fecha depois
+    now = ingest_mod._ms_to_dt_utc(T0 + 4 * 60_000 + 30_000)
+    monkeypatch.setattr(ingest_mod, "_utcnow", lambda: now)
+    WATERMARKS.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "klines.jsonl")
+        _write(path, [_msg("BTCUSDT", i) for i in range(5)])
+        Session = _sessions(tmp)
+        ingestor = StreamIngestor(["BTCUSDT"], source=ReplaySource(path, speed=0), session_factory=Session,
+                                  rest_source=_Rest(5, open_last=True), backfill=True, batch_size=100)
+        asyncio.run(ingestor.run())
+
+        assert ingestor.stats["backfilled"] == 4
+        with Session() as db:
+            closes = db.execute(select(Price.close).order_by(Price.ts)).scalars().all()
+        assert closes == [100.0, 101.0, 102.0, 103.0, 104.0]
+    WATERMARKS.reset()
+
+class _FlakySource:
+    def __init__(self, path):
+        self.calls = 0
+        self.replay = ReplaySource(path, speed=0)
+
+    async def messages(self, symbols, interval):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("queda simulada")
+        async for raw in self.replay.messages(symbols, interval):
+            yield raw
+
+def test_reconnects_after_connection_error(monkeypatch):
+    monkeypatch.setattr(stream_mod, "STREAM_RECONNECT_MIN", 0.01)
+    WATERMARKS.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "klines.jsonl")
+        _write(path, [_msg("BTCUSDT", i) for i in range(5)])
+        Session = _sessions(tmp)
+        source = _FlakySource(path)
+        ingestor = StreamIngestor(["BTCUSDT"], source=source, session_factory=Session, backfill=False)
+        ingestor.subscribe(lambda rows: ingestor.stop())
+        asyncio.run(asyncio.wait_for(ingestor.run(), timeout=10))
+        assert source.calls == 2
+        assert ingestor.stats["reconnects"] == 1
+        assert "queda simulada" in ingestor.stats["last_error"]
+        assert _count(Session) == 5
+    WATERMARKS.reset()